@@ -1,27 +1,83 @@
 # Импорт необходимых модулей и классов
-from flask import Flask, render_template, redirect, url_for, request, flash, jsonify, abort, current_app
+from flask import Flask, render_template, redirect, url_for, request, flash, jsonify, abort, current_app, Response, stream_with_context
 from flask_login import LoginManager, login_user, login_required, logout_user, current_user  # Модули для аутентификации
 from werkzeug.security import generate_password_hash, check_password_hash  # Хеширование паролей
 from flask_sqlalchemy import SQLAlchemy  # ORM для работы с БД
 from flask_wtf import FlaskForm  # Формы Flask
 from wtforms import StringField, PasswordField, SelectField, SubmitField  # Поля форм
 from wtforms.validators import DataRequired, Length, Regexp, EqualTo  # Валидаторы полей
-from functools import wraps  # Для создания декораторов
+from functools import wraps, partial  # Для создания декораторов
+import os
 from models import db, Role, User, VisitLog  # Импорт моделей БД
+from visit_buffer import visit_buffer  # Буферизованная запись журнала посещений
+from visit_paths import path_dictionary  # Словарь путей журнала посещений
+from visit_rules import visit_rules  # Исключения и выборка при записи журнала посещений
+from visit_stream import visit_stream  # Лента посещений для панели (SSE)
+import rollups  # Агрегаты журнала посещений
+import partitions  # Помесячные разделы журнала посещений
+from sketches import visit_sketches  # Оперативная статистика посещений в памяти
+from roles import role_cache  # Кэш ролей для check_rights и форм
+from web_common.identity_cache import identity_cache  # Кэш пользователей для load_user
+from web_common.passwords import password_hasher, bulk_password_hasher, login_throttle, HasherBusy  # Пулы хеширования паролей и ограничение входа
+from sqlalchemy.orm import joinedload
+import bootstrap  # Создание схемы и начальных данных (flask bootstrap)
+import user_import  # Массовый импорт и экспорт пользователей
+from user_deletion import user_deletion, purge_logs_command, LOG_POLICIES  # Удаление пользователей и их журнала
+import user_bulk  # Массовые операции над пользователями и ролями
+import io
+import json
+from web_common import request_timing  # Учёт времени и числа SQL-запросов, поиск N+1
+import sqlite_profile  # PRAGMA и пул соединений SQLite по окружению (APP_ENV)
 
 # Инициализация Flask-Login для управления аутентификацией
 login_manager = LoginManager()
 
 # Функция для создания и настройки Flask-приложения
-def create_app():
+def create_app(config=None):
     # Создание экземпляра приложения
     app = Flask(__name__)
     app.secret_key = 'my_secret_key'  # Секретный ключ для сессий
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///app.db'  # Путь к БД
+    app.config['VISIT_LOG_BACKPRESSURE'] = 'drop'  # При переполнении буфера журнала: block, drop или sample
+    app.config['VISIT_LOG_RETENTION_MONTHS'] = None  # Срок хранения разделов журнала (flask visit-logs retention)
+    app.config['VISIT_LOG_ARCHIVE_DIR'] = os.path.join(app.instance_path, 'visit_log_archive')  # Сжатые архивы разделов
+    # Допустимое число SQL-запросов на страницу (request_timing): с запасом на загрузку
+    # пользователя и снимка ролей при промахе кэшей
+    app.config['QUERY_BUDGETS'] = {
+        'index': 3,
+        'suggest_users': 3,
+        'view_user': 3,
+        'edit_user': 3,
+        'manage_roles': 3,
+        'visit_logs.index': 5,
+        'visit_logs.by_pages': 3,
+        'visit_logs.by_users': 3,
+        'visit_logs.latency': 3,
+    }
+    app.config.update(config or {})  # Переопределение настроек (например, отдельная БД для нагрузочных замеров)
 
     # Инициализация расширений
+    sqlite_profile.configure(app)  # Профиль SQLite: PRAGMA и пул соединений для APP_ENV
     db.init_app(app)  # Инициализация SQLAlchemy
+    visit_buffer.init_app(app)  # Фоновая пакетная запись журнала посещений
+    path_dictionary.init_app(app)  # Пути и маршруты журнала - целочисленные id
+    visit_rules.init_app(app)  # Какие запросы записывать в журнал и с какой вероятностью
+    visit_stream.init_app(app)  # Ежесекундные кадры посещений для /visit_logs/stream
+    visit_buffer.on_flush(rollups.record_visits)  # Агрегаты обновляются вместе с журналом
+    app.cli.add_command(rollups.rebuild_rollups_command)  # flask rebuild-rollups
+    visit_sketches.init_app(app)  # Top-N страниц и уникальные посетители (/visit_logs/live)
+    app.cli.add_command(partitions.visit_logs_cli)  # flask visit-logs list|retention|archive|split-legacy
+    app.cli.add_command(bootstrap.bootstrap_command)  # flask bootstrap: схема и начальные данные
+    app.cli.add_command(bootstrap.startup_timing_command)  # flask startup-timing
+    app.cli.add_command(user_import.users_cli)  # flask users import|export
+    user_import.users_cli.add_command(purge_logs_command)  # flask users purge-logs
+    user_deletion.init_app(app)  # Пакетная обработка журнала удалённых пользователей
+    identity_cache.init_app(app)  # LRU+TTL кэш пользователей для load_user
+    password_hasher.init_app(app)  # Хеширование паролей в пуле процессов
+    bulk_password_hasher.init_app(app)  # Отдельный пул с низким приоритетом для импорта пользователей
+    login_throttle.init_app(app)  # Ограничение попыток входа по IP и учётной записи
     login_manager.init_app(app)  # Инициализация Flask-Login
+    request_timing.init_app(app)  # Бюджеты SQL-запросов по endpoint и предупреждения о N+1
     login_manager.login_view = 'login'  # Страница входа
 
     # Регистрация Blueprint для журнала посещений
@@ -32,40 +88,25 @@ def create_app():
     # Регистрация маршрутов приложения
     register_routes(app)
 
-    # Создание таблиц БД и тестовых данных при первом запуске
+    # Очередь хеширования паролей переполнена
+    @app.errorhandler(HasherBusy)
+    def handle_hasher_busy(err):
+        return 'Сервер перегружен. Повторите попытку позже.', 503, {'Retry-After': '5'}
+
+    # Схема и тестовые данные создаются командой flask bootstrap, а не при обработке запросов
     with app.app_context():
-        db.create_all()
-
-    # Обработчик, выполняемый перед каждым запросом
-    @app.before_request
-    def initialize_database():
-        if not hasattr(app, 'db_initialized'):
-            db.create_all()  # Создание таблиц, если их нет
-            app.db_initialized = True
-            
-            # Создание тестовых ролей, если их нет
-            if not Role.query.first():
-                roles = [
-                    Role(name="Администратор", description="Полный доступ"),
-                    Role(name="Пользователь", description="Ограниченный доступ")
-                ]
-                db.session.bulk_save_objects(roles)  # Массовое сохранение
-                db.session.commit()
-            
-            # Создание тестового пользователя, если его нет
-            if not User.query.filter_by(username="user").first():
-                default_role = Role.query.filter_by(name="Пользователь").first()
-                default_user = User(
-                    username="user",
-                    password_hash=generate_password_hash("kBj-d53-huA-3zC"),
-                    first_name="Тест",
-                    last_name="Пользователь",
-                    middle_name="",
-                    role_id=default_role.id
-                )
-                db.session.add(default_user)
-                db.session.commit()
-            print("Тестовые данные созданы: пользователь 'user' и роли.")
+        sqlite_profile.install(db.engine, app.config['SQLITE_EFFECTIVE_PRAGMAS'])
+        request_timing.install_db_timer(db.engine)
+
+    # Проверка готовности: доступность БД и фактические PRAGMA
+    @app.route('/health/ready')
+    def readiness():
+        try:
+            status = sqlite_profile.readiness(db.engine)
+        except Exception as e:
+            return jsonify(database='error', error=str(e)), 503
+        status['env'] = app.config['APP_ENV']
+        return jsonify(status)
 
     return app
 
@@ -74,8 +115,8 @@ def check_rights(required_role):
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
-            # Проверка аутентификации и роли пользователя
-            if not current_user.is_authenticated or current_user.role.name != required_role:
+            # Проверка аутентификации и роли пользователя (по кэшу ролей, без запроса к БД)
+            if not current_user.is_authenticated or not role_cache.has_role(current_user.role_id, required_role):
                 flash('У вас недостаточно прав для доступа к данной странице.', 'danger')
                 return redirect(url_for('index'))
             return func(*args, **kwargs)
@@ -90,12 +131,27 @@ def register_routes(app):
     from werkzeug.security import generate_password_hash, check_password_hash
     from models import Role, User, VisitLog
     from forms import UserForm
+    from pagination import KeysetPagination
+    from blueprints.visit_logs import stream_report
+    from user_search import fetch_users, suggest, SUGGEST_LIMIT, NAME_COLUMNS
 
-    # Главная страница - список пользователей
+    # Главная страница - справочник пользователей с поиском и курсорной пагинацией
     @app.route('/')
     def index():
-        users = User.query.all()  # Получение всех пользователей из БД
-        return render_template('index.html', users=users)
+        q = request.args.get('q', '').strip()
+        # Без входа - поиск только по ФИО (логины в справочнике не раскрываются)
+        columns = None if current_user.is_authenticated else NAME_COLUMNS
+        users = KeysetPagination(partial(fetch_users, q=q, columns=columns),
+                                 cursor=request.args.get('cursor'), per_page=20)
+        return render_template('index.html', users=users, q=q)
+
+    # Подсказки для поиска пользователей (JSON для автодополнения); содержат логины,
+    # поэтому только для вошедших пользователей
+    @app.route('/users/suggest')
+    @login_required
+    def suggest_users():
+        limit = min(request.args.get('limit', SUGGEST_LIMIT, type=int), 50)
+        return jsonify(suggest(request.args.get('q', ''), limit))
 
     # Страница входа
     @app.route('/login', methods=['GET', 'POST'])
@@ -105,17 +161,33 @@ def register_routes(app):
             username = request.form['username']
             password = request.form['password']
             remember = 'remember' in request.form  # Запомнить пользователя
+
+            # Ограничение частоты попыток входа
+            wait = login_throttle.attempt(request.remote_addr, username)
+            if wait:
+                flash(f'Слишком много попыток входа. Повторите через {wait} с.', 'danger')
+                return render_template('login.html', next=request.args.get('next')), 429, {'Retry-After': str(wait)}
             
             # Поиск пользователя в БД
             user = User.query.filter_by(username=username).first()
             
-            # Проверка пароля
-            if user and check_password_hash(user.password_hash, password):
+            # Проверка пароля (в пуле процессов)
+            if user and password_hasher.check(user.password_hash, password):
+                login_throttle.success(username)
+                if not user.active:
+                    flash('Учётная запись отключена. Обратитесь к администратору.', 'danger')
+                    return render_template('login.html', next=request.args.get('next'))
+                # Хеш со старыми параметрами KDF пересчитывается с текущими
+                if password_hasher.needs_rehash(user.password_hash):
+                    user.password_hash = password_hasher.hash(password)
+                    db.session.commit()
+                    identity_cache.invalidate(user.id)
                 login_user(user, remember=remember)  # Вход пользователя
                 flash('Вы успешно вошли в систему!', 'success')
                 next_page = request.args.get('next')  # Перенаправление после входа
                 return redirect(next_page or url_for('index'))
             else:
+                login_throttle.failure(username)
                 flash('Неверное имя пользователя или пароль.', 'danger')
         return render_template('login.html', next=request.args.get('next'))
 
@@ -133,14 +205,15 @@ def register_routes(app):
     def create_user():
         form = UserForm()
         # Заполнение списка ролей для выбора
-        form.role_id.choices = [(role.id, role.name) for role in Role.query.all()]
+        form.role_id.choices = role_cache.choices()
         
         if form.validate_on_submit():  # Если форма валидна
+            password_hash = password_hasher.hash(form.password.data)
             try:
                 # Создание нового пользователя
                 user = User(
                     username=form.username.data,
-                    password_hash=generate_password_hash(form.password.data),
+                    password_hash=password_hash,
                     last_name=form.last_name.data,
                     first_name=form.first_name.data,
                     middle_name=form.middle_name.data,
@@ -154,6 +227,49 @@ def register_routes(app):
                 flash('Ошибка при создании пользователя.', 'danger')
         return render_template('user_form.html', form=form)
 
+    # Массовый импорт пользователей из CSV или JSONL (файл формы или тело запроса).
+    # Ответ - поток JSONL с результатом по каждой строке и итоговой записью.
+    @app.route('/users/import', methods=['GET', 'POST'])
+    @login_required
+    @check_rights('Администратор')
+    def import_users():
+        if request.method == 'GET':
+            return render_template('users_import.html', fields=user_import.IMPORT_FIELDS)
+        upload = request.files.get('file')
+        if upload:
+            # Файл формы закрывается при завершении запроса, до чтения потоковым ответом:
+            # забираем его у FileStorage и закрываем сами
+            stream, filename = upload.stream, upload.filename
+            upload.stream = io.BytesIO()
+        else:
+            stream, filename = request.stream, None
+        fmt = user_import.detect_format(request.values.get('format'), filename)
+        text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+
+        def generate():
+            created = failed = 0
+            try:
+                for result in user_import.import_users(user_import.read_records(text, fmt)):
+                    if result['status'] == 'created':
+                        created += 1
+                    else:
+                        failed += 1
+                    yield json.dumps(result, ensure_ascii=False) + '\n'
+            finally:
+                if upload:
+                    text.close()
+            yield json.dumps({'status': 'summary', 'created': created, 'failed': failed}, ensure_ascii=False) + '\n'
+
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    # Потоковый экспорт пользователей (CSV или JSONL) в формате импорта
+    @app.route('/users/export')
+    @login_required
+    @check_rights('Администратор')
+    def export_users():
+        return stream_report(user_import.export_query(), user_import.EXPORT_FIELDS, user_import.EXPORT_FIELDS,
+                             user_import.export_row, 'users')
+
     # Редактирование пользователя (только для админов)
     @app.route('/user/<int:user_id>/edit', methods=['GET', 'POST'])
     @login_required
@@ -161,7 +277,7 @@ def register_routes(app):
     def edit_user(user_id):
         user = User.query.get_or_404(user_id)  # 404 если пользователь не найден
         form = UserForm(obj=user)
-        form.role_id.choices = [(role.id, role.name) for role in Role.query.all()]
+        form.role_id.choices = role_cache.choices()
         # Удаление ненужных полей для редактирования
         del form.username
         del form.password
@@ -175,6 +291,7 @@ def register_routes(app):
                 user.middle_name = form.middle_name.data
                 user.role_id = form.role_id.data
                 db.session.commit()
+                identity_cache.invalidate(user.id)
                 flash('Пользователь успешно обновлён.', 'success')
                 return redirect(url_for('index'))
             except Exception as e:
@@ -190,14 +307,62 @@ def register_routes(app):
         if user.id == current_user.id:
             flash('Вы не можете удалить свою собственную учетную запись.', 'danger')
             return redirect(url_for('index'))
+        # Политика для журнала посещений: из формы подтверждения или USER_DELETE_LOG_POLICY
+        policy = request.form.get('log_policy')
+        if policy not in LOG_POLICIES:
+            policy = None
         try:
-            db.session.delete(user)
-            db.session.commit()
-            flash('Пользователь успешно удалён.', 'success')
+            background = user_deletion.delete(user.id, policy)
+            if background:
+                flash('Пользователь удалён. Журнал посещений обрабатывается в фоне.', 'success')
+            else:
+                flash('Пользователь успешно удалён.', 'success')
         except Exception as e:
+            db.session.rollback()
             flash('Ошибка при удалении пользователя.', 'danger')
         return redirect(url_for('index'))
 
+    # Массовые операции: перевод пользователей роли в другую роль, удаление, включение и
+    # отключение выбранных, отключение неактивных с даты. Ответ - поток JSONL с ходом
+    # выполнения по пачкам (см. user_bulk).
+    @app.route('/users/bulk', methods=['GET', 'POST'])
+    @login_required
+    @check_rights('Администратор')
+    def bulk_users():
+        if request.method == 'GET':
+            return render_template('users_bulk.html', roles=role_cache.choices())
+        action = request.form.get('action')
+        user_ids = request.form.getlist('user_ids', type=int)
+        try:
+            if action == 'move_role':
+                operation = user_bulk.move_role(request.form.get('from_role_id', type=int),
+                                                request.form.get('to_role_id', type=int))
+            elif action == 'delete':
+                operation = user_bulk.delete_users(user_ids, request.form.get('log_policy'), exclude_id=current_user.id)
+            elif action in ('activate', 'deactivate'):
+                operation = user_bulk.set_active(user_ids, action == 'activate', exclude_id=current_user.id)
+            elif action == 'deactivate_inactive':
+                operation = user_bulk.deactivate_inactive(user_bulk.parse_date(request.form.get('since')),
+                                                          exclude_id=current_user.id)
+            else:
+                raise ValueError('Неизвестная операция.')
+        except ValueError as e:
+            flash(str(e) if action != 'deactivate_inactive' else 'Укажите дату в формате ГГГГ-ММ-ДД.', 'danger')
+            return redirect(url_for('bulk_users'))
+
+        def generate():
+            for progress in operation:
+                yield json.dumps(progress, ensure_ascii=False) + '\n'
+
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    # Ход фоновой обработки журнала удалённых пользователей
+    @app.route('/users/deletions')
+    @login_required
+    @check_rights('Администратор')
+    def user_deletions():
+        return jsonify(jobs=user_deletion.jobs())
+
     # Смена пароля
     @app.route('/change_password', methods=['GET', 'POST'])
     @login_required
@@ -208,16 +373,19 @@ def register_routes(app):
             confirm_password = request.form['confirm_password']
 
             # Проверка старого пароля
-            if not check_password_hash(current_user.password_hash, old_password):
+            if not password_hasher.check(current_user.password_hash, old_password):
                 flash('Старый пароль неверен.', 'danger')
             elif new_password != confirm_password:
                 flash('Новые пароли не совпадают.', 'danger')
             elif len(new_password) < 8 or len(new_password) > 128:
                 flash('Пароль должен быть от 8 до 128 символов.', 'danger')
             else:
-                # Обновление пароля
-                current_user.password_hash = generate_password_hash(new_password)
+                # Обновление пароля (current_user - отсоединённая копия из кэша)
+                user = User.query.get(current_user.id)
+                user.password_hash = password_hasher.hash(new_password)
                 db.session.commit()
+                identity_cache.invalidate(user.id)
+                login_user(user)  # Новый идентификатор сессии с новой версией пароля
                 flash('Пароль успешно изменён.', 'success')
                 return redirect(url_for('index'))
         return render_template('change_password.html')
@@ -235,6 +403,7 @@ def register_routes(app):
                 new_role = Role(name=role_name, description=role_description)
                 db.session.add(new_role)
                 db.session.commit()
+                role_cache.invalidate()
                 flash('Роль успешно добавлена.', 'success')
             else:
                 flash('Название роли не может быть пустым.', 'danger')
@@ -244,14 +413,16 @@ def register_routes(app):
     # Удаление роли
     @app.route('/roles/<int:role_id>/delete', methods=['POST'])
     @login_required
+    @check_rights('Администратор')
     def delete_role(role_id):
         role = Role.query.get_or_404(role_id)
-        # Проверка, что роль не используется
+        # Проверка, что роль не используется (перевод пользователей - /users/bulk)
         if User.query.filter_by(role_id=role.id).first():
             flash('Невозможно удалить роль, так как она связана с пользователями.', 'danger')
         else:
             db.session.delete(role)
             db.session.commit()
+            role_cache.invalidate()
             flash('Роль успешно удалена.', 'success')
         return redirect(url_for('manage_roles'))
 
@@ -260,7 +431,7 @@ def register_routes(app):
     @login_required
     @check_rights('Администратор')
     def view_user(user_id):
-        user = User.query.get_or_404(user_id)
+        user = User.query.options(joinedload(User.role)).get_or_404(user_id)  # Роль - тем же запросом
         return render_template('view_user.html', user=user)
 
     # Журнал посещений
@@ -270,13 +441,30 @@ def register_routes(app):
     def visit_logs():
         return redirect(url_for('visit_logs.index'))
 
+    # Метрики пула хеширования паролей (глубина очереди, задержки) и ограничения входа
+    @app.route('/passwords/stats')
+    @login_required
+    @check_rights('Администратор')
+    def password_stats():
+        return jsonify(hasher=password_hasher.stats(), bulk_hasher=bulk_password_hasher.stats(),
+                       throttle=login_throttle.stats())
+
+    # Метрики кэша пользователей (попадания, промахи, вытеснения)
+    @app.route('/identity_cache/stats')
+    @login_required
+    @check_rights('Администратор')
+    def identity_cache_stats():
+        return jsonify(identity_cache.stats())
+
     # Журнал посещений текущего пользователя
     @app.route('/visit_logs/user')
     @login_required
     @check_rights('Пользователь')
     def user_visit_logs():
-        logs = VisitLog.query.filter_by(user_id=current_user.id).order_by(VisitLog.created_at.desc()).all()
-        return render_template('visit_logs/user_logs.html', logs=logs)
+        fetch = partial(partitions.fetch_logs, user_id=current_user.id)
+        logs = KeysetPagination(fetch, cursor=request.args.get('cursor'), per_page=20)
+        total = rollups.approximate_total(user_id=current_user.id)
+        return render_template('visit_logs/user_logs.html', logs=logs, total=total)
 
     # Профиль текущего пользователя
     @app.route('/profile', methods=['GET'])
@@ -299,21 +487,43 @@ def register_routes(app):
         
         if form.validate_on_submit():
             try:
-                # Обновление профиля
-                current_user.last_name = form.last_name.data
-                current_user.first_name = form.first_name.data
-                current_user.middle_name = form.middle_name.data
+                # Обновление профиля (current_user - отсоединённая копия из кэша)
+                user = User.query.get(current_user.id)
+                user.last_name = form.last_name.data
+                user.first_name = form.first_name.data
+                user.middle_name = form.middle_name.data
                 db.session.commit()
+                identity_cache.invalidate(user.id)
                 flash('Ваш профиль успешно обновлён.', 'success')
                 return redirect(url_for('view_profile'))
             except Exception as e:
                 flash('Ошибка при обновлении профиля.', 'danger')
         return render_template('user_form.html', form=form)
 
-# Загрузчик пользователя для Flask-Login
+# Загрузчик пользователя для Flask-Login.
+# user_id - строка "id:версия_пароля" из User.get_id; пользователь с ролью загружается
+# одним запросом и хранится в identity_cache отсоединённым от сессии.
 @login_manager.user_loader
 def load_user(user_id):
-    return db.session.query(User).get(int(user_id))
+    user = identity_cache.get(user_id)
+    if user is not None:
+        return user
+    id_part, _, version = user_id.partition(':')
+    if not id_part.isdigit():
+        return None
+    user = db.session.query(User).options(joinedload(User.role)).get(int(id_part))
+    # Сессии, выданные до смены пароля, больше не действительны
+    if user is None or (version and version != user.password_version):
+        return None
+    # Сессии отключённого пользователя завершаются (запись кэша сбрасывается при отключении)
+    if not user.active:
+        return None
+    db.session.expunge(user)
+    if user.role is not None:
+        # Роль загружена тем же запросом; без expunge коммит в этом запросе сделал бы её устаревшей
+        db.session.expunge(user.role)
+    identity_cache.set(user_id, user)
+    return user
 
 # Форма пользователя
 class UserForm(FlaskForm):
@@ -336,4 +546,6 @@ class UserForm(FlaskForm):
 # Запуск приложения
 if __name__ == '__main__':
     app = create_app()
+    with app.app_context():
+        bootstrap.bootstrap_database()  # Для локального запуска - то же, что flask bootstrap
     app.run(debug=True)  # Запуск в режиме отладки
\ No newline at end of file
@@ -0,0 +1,365 @@
+# Нагрузочные замеры LAB5 на отдельной базе (instance/bench.db).
+# - seed: детерминированное заполнение (одинаковый --seed даёт одинаковые данные):
+#   пользователи через bootstrap.seed_users, посещения - пачками сразу в разделы
+#   журнала и агрегаты, с датами в пределах --months месяцев от SEED_EPOCH.
+#   Параметры набора данных сохраняются рядом с БД (<БД>.dataset.json).
+# - run: запросы к страницам от имени администратора, включая экспорт отчётов и вход
+#   (POST /login с учётными данными BENCH_ADMIN - проверка пароля в пуле хеширования).
+#   Драйвер client - тестовый клиент Flask в одном потоке; wsgi - несколько потоков
+#   вызывают WSGI-приложение напрямую. Результат - JSON: пропускная способность,
+#   p50/p95/p99 задержки и число SQL-запросов на запрос для каждой страницы; в meta -
+#   драйвер и параметры набора данных.
+# - Сравнение с базовой линией (benchmarks/baseline.json): регрессией считается рост
+#   p50/p95 или числа запросов и падение пропускной способности сверх порогов из файла;
+#   при регрессии код выхода 1. Линия, снятая с другим драйвером или на другом наборе
+#   данных, не сравнивается (ошибка): такие регрессии невоспроизводимы. Перед замером
+#   каждая страница запрашивается --warmup раз. --save-baseline записывает результат
+#   как новую базовую линию.
+# Запуск: python benchmark.py seed --visits 100000 --users 10000
+#         python benchmark.py run --driver wsgi --threads 8
+
+import json
+import os
+import platform
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import click
+from sqlalchemy import event
+from werkzeug.test import EnvironBuilder, run_wsgi_app
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BENCH_DATABASE = os.path.join(BASE_DIR, 'instance', 'bench.db')
+BASELINE_FILE = os.path.join(BASE_DIR, 'benchmarks', 'baseline.json')
+SEED_EPOCH = datetime(2025, 1, 1)  # Начало интервала дат посещений
+SEED_CHUNK_ROWS = 10000  # Посещений в одной транзакции
+BENCH_ADMIN = {'username': 'benchadmin', 'password': 'BenchAdmin123', 'last_name': 'Замеров',
+               'first_name': 'Админ', 'middle_name': '', 'role': 'Администратор'}
+# Страницы замера: "путь" (GET) или "МЕТОД путь"; данные форм POST - в BENCH_FORMS
+BENCH_PATHS = [
+    '/',
+    '/?q=пользователь',
+    '/users/suggest?q=bench1',
+    'POST /login',
+    '/visit_logs/',
+    '/visit_logs/by_pages',
+    '/visit_logs/by_users',
+    '/visit_logs/latency',
+    '/visit_logs/live',
+    '/visit_logs/export_pages',
+    '/visit_logs/export_users?format=jsonl',
+]
+BENCH_FORMS = {
+    '/login': {'username': BENCH_ADMIN['username'], 'password': BENCH_ADMIN['password']},
+}
+COMPARABLE_META = ('driver', 'dataset')  # Условия замера, общие с базовой линией
+DEFAULT_THRESHOLDS = {
+    'latency': 0.25,  # Допустимый рост p50, доля
+    'tail_latency': 0.5,  # Допустимый рост p95 - хвост шумнее медианы
+    'throughput': 0.2,  # Допустимое падение запросов в секунду, доля
+    'queries': 0,  # Допустимый рост числа SQL-запросов на запрос
+}
+
+# Страницы и обработчики для синтетических посещений; частоты убывают по закону Ципфа
+SEED_PAGES = [('/', 'index'), ('/login', 'login'), ('/profile', 'view_profile'),
+              ('/visit_logs/', 'visit_logs.index'), ('/visit_logs/by_pages', 'visit_logs.by_pages'),
+              ('/visit_logs/by_users', 'visit_logs.by_users'), ('/roles', 'manage_roles'),
+              ('/change_password', 'change_password')] + \
+             [('/user/%d' % i, 'view_user') for i in range(1, 43)]
+SEED_WEIGHTS = [1 / rank for rank in range(1, len(SEED_PAGES) + 1)]
+
+
+def bench_app(database, env):
+    from app import create_app
+    return create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + database,
+        'APP_ENV': env,
+        'VISIT_SKETCH_SNAPSHOT': database + '.sketches.json',
+        'LOGIN_THROTTLE_PER_IP': 10 ** 9,  # Замер входа, а не ограничения попыток
+    })
+
+
+def dataset_file(database):
+    return database + '.dataset.json'
+
+
+# Параметры seed для БД замеров; None - БД заполнена без сохранения параметров
+def load_dataset(database):
+    if not os.path.exists(dataset_file(database)):
+        return None
+    with open(dataset_file(database), encoding='utf-8') as f:
+        return json.load(f)
+
+
+# "POST /login" -> ('POST', '/login'); просто путь - GET
+def split_request(entry):
+    method, _, path = entry.partition(' ')
+    return (method, path) if path else ('GET', entry)
+
+
+def seed_database(app, visits, users, seed, months):
+    import bootstrap
+    import partitions
+    import rollups
+    from models import db, User
+
+    rng = random.Random(seed)
+    with app.app_context():
+        bootstrap.bootstrap_database()
+        bootstrap.seed_users([BENCH_ADMIN])
+        bootstrap.seed_users(bootstrap.generated_users(users, 'Passw0rd123', prefix='bench'))
+        user_ids = [user_id for user_id, in db.session.query(User.id).order_by(User.id)]
+        span = months * 30 * 24 * 3600
+        for start in range(0, visits, SEED_CHUNK_ROWS):
+            entries = []
+            for _ in range(min(SEED_CHUNK_ROWS, visits - start)):
+                path, endpoint = rng.choices(SEED_PAGES, SEED_WEIGHTS)[0]
+                duration = rng.lognormvariate(3, 0.8)
+                entries.append({
+                    'path': path,
+                    'user_id': rng.choice(user_ids) if rng.random() < 0.7 else None,
+                    'created_at': SEED_EPOCH + timedelta(seconds=rng.randrange(span)),
+                    'endpoint': endpoint,
+                    'status_code': rng.choices((200, 302, 404), (90, 8, 2))[0],
+                    'duration_ms': round(duration, 2),
+                    'db_time_ms': round(duration * rng.random() * 0.5, 2),
+                    'response_size': rng.randrange(500, 20000),
+                })
+            partitions.insert_entries(entries)
+            rollups.record_visits(entries)
+            db.session.commit()
+
+
+# Счётчик SQL-запросов текущего потока (запрос тестового клиента выполняется в вызывающем потоке)
+class QueryCounter:
+    def __init__(self, engine):
+        self._local = threading.local()
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self._local.count = getattr(self._local, 'count', 0) + 1
+
+    def take(self):
+        count = getattr(self._local, 'count', 0)
+        self._local.count = 0
+        return count
+
+
+def login_client(app):
+    client = app.test_client()
+    response = client.post('/login', data={'username': BENCH_ADMIN['username'],
+                                           'password': BENCH_ADMIN['password']})
+    if response.status_code != 302 or client.get_cookie('session') is None:
+        raise click.ClickException('Не удалось войти как %s; выполните seed.' % BENCH_ADMIN['username'])
+    return client
+
+
+def client_get(client):
+    def get(entry):
+        method, path = split_request(entry)
+        response = client.open(path, method=method, data=BENCH_FORMS.get(path.split('?')[0]))
+        response.get_data()
+        return response.status_code
+    return get
+
+
+# Вызов WSGI-приложения без тестового клиента: окружение запроса и cookie сессии
+def wsgi_get(app, cookie):
+    def get(entry):
+        method, path = split_request(entry)
+        builder = EnvironBuilder(path=path, method=method, headers={'Cookie': cookie},
+                                 data=BENCH_FORMS.get(path.split('?')[0]))
+        try:
+            environ = builder.get_environ()
+        finally:
+            builder.close()
+        app_iter, status, headers = run_wsgi_app(app, environ)
+        try:
+            for _ in app_iter:
+                pass
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+        return int(status.split(' ', 1)[0])
+    return get
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, len(values) * p // 100)] if values else None
+
+
+def run_benchmark(app, paths, requests, driver, threads, warmup=0, dataset=None):
+    from models import db
+
+    with app.app_context():
+        counter = QueryCounter(db.engine)
+    samples = {path: [] for path in paths}  # Путь -> [(мс, SQL-запросов, статус)]
+    lock = threading.Lock()
+
+    def worker(count):
+        client = login_client(app)
+        if driver == 'wsgi':
+            get = wsgi_get(app, 'session=' + client.get_cookie('session').value)
+        else:
+            get = client_get(client)
+        # Прогрев: кэши шаблонов, ролей и страниц SQLite не попадают в замер
+        for path in paths * warmup:
+            get(path)
+        for i in range(count):
+            path = paths[i % len(paths)]
+            counter.take()
+            started = time.perf_counter()
+            status = get(path)
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                samples[path].append((elapsed, counter.take(), status))
+
+    workers = threads if driver == 'wsgi' else 1
+    total = requests * len(paths)
+    shares = [total // workers + (1 if i < total % workers else 0) for i in range(workers)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for future in [pool.submit(worker, share) for share in shares]:
+            future.result()
+    elapsed = time.perf_counter() - started
+
+    endpoints = {}
+    for path, rows in samples.items():
+        latencies = sorted(row[0] for row in rows)
+        endpoints[path] = {
+            'requests': len(rows),
+            'errors': sum(1 for row in rows if row[2] >= 400),
+            # Оценка для страницы: сколько таких запросов в секунду выполнили бы все потоки
+            'throughput_rps': round(1000 / (sum(latencies) / len(latencies)) * workers, 2) if latencies else None,
+            'mean_ms': round(sum(latencies) / len(latencies), 3) if latencies else None,
+            'p50_ms': round(percentile(latencies, 50), 3) if latencies else None,
+            'p95_ms': round(percentile(latencies, 95), 3) if latencies else None,
+            'p99_ms': round(percentile(latencies, 99), 3) if latencies else None,
+            'queries_per_request': round(sum(row[1] for row in rows) / len(rows), 2) if rows else None,
+        }
+    all_latencies = sorted(row[0] for rows in samples.values() for row in rows)
+    return {
+        'meta': {
+            'driver': driver,
+            'dataset': dataset,  # Параметры seed: visits, users, seed, months
+            'threads': workers,
+            'requests_per_path': requests,
+            'warmup_per_path': warmup,
+            'env': app.config['APP_ENV'],
+            'python': platform.python_version(),
+            'timestamp': datetime.utcnow().isoformat(timespec='seconds'),
+        },
+        'total': {
+            'requests': total,
+            'elapsed_s': round(elapsed, 3),
+            'throughput_rps': round(total / elapsed, 2),
+            'p50_ms': round(percentile(all_latencies, 50), 3),
+            'p95_ms': round(percentile(all_latencies, 95), 3),
+            'p99_ms': round(percentile(all_latencies, 99), 3),
+        },
+        'endpoints': endpoints,
+    }
+
+
+# Регрессии относительно базовой линии: список описаний
+def compare(result, baseline):
+    thresholds = dict(DEFAULT_THRESHOLDS, **baseline.get('thresholds', {}))
+    regressions = []
+    for path, base in baseline.get('endpoints', {}).items():
+        current = result['endpoints'].get(path)
+        if current is None:
+            continue
+        if base.get('p50_ms') and current['p50_ms'] > base['p50_ms'] * (1 + thresholds['latency']):
+            regressions.append('%s: p50 %.1f мс > %.1f мс' % (path, current['p50_ms'], base['p50_ms']))
+        if base.get('p95_ms') and current['p95_ms'] > base['p95_ms'] * (1 + thresholds['tail_latency']):
+            regressions.append('%s: p95 %.1f мс > %.1f мс' % (path, current['p95_ms'], base['p95_ms']))
+        if base.get('queries_per_request') is not None and \
+                current['queries_per_request'] > base['queries_per_request'] + thresholds['queries']:
+            regressions.append('%s: SQL-запросов %.2f > %.2f'
+                               % (path, current['queries_per_request'], base['queries_per_request']))
+        if base.get('throughput_rps') and \
+                current['throughput_rps'] < base['throughput_rps'] * (1 - thresholds['throughput']):
+            regressions.append('%s: %.1f запросов/с < %.1f'
+                               % (path, current['throughput_rps'], base['throughput_rps']))
+    return regressions
+
+
+@click.group()
+def cli():
+    """Нагрузочные замеры LAB5."""
+
+
+@cli.command('seed')
+@click.option('--database', default=BENCH_DATABASE, show_default=True, help='Файл БД для замеров (пересоздаётся).')
+@click.option('--visits', type=click.IntRange(1), default=10000, show_default=True, help='Посещений (10^4 - 10^7).')
+@click.option('--users', type=click.IntRange(1), default=1000, show_default=True, help='Пользователей (10^3 - 10^5).')
+@click.option('--seed', type=int, default=42, show_default=True, help='Зерно генератора случайных чисел.')
+@click.option('--months', type=click.IntRange(1), default=6, show_default=True, help='Месяцев истории посещений.')
+@click.option('--env', default='production', show_default=True, help='Профиль SQLite (APP_ENV).')
+def seed_command(database, visits, users, seed, months, env):
+    for suffix in ('', '-wal', '-shm', '.sketches.json', '.dataset.json'):
+        if os.path.exists(database + suffix):
+            os.remove(database + suffix)
+    started = time.perf_counter()
+    seed_database(bench_app(database, env), visits, users, seed, months)
+    with open(dataset_file(database), 'w', encoding='utf-8') as f:
+        json.dump({'visits': visits, 'users': users, 'seed': seed, 'months': months}, f)
+    click.echo('Создано посещений: %d, пользователей: %d за %.1f с.' % (visits, users, time.perf_counter() - started))
+
+
+@cli.command('run')
+@click.option('--database', default=BENCH_DATABASE, show_default=True)
+@click.option('--driver', type=click.Choice(['client', 'wsgi']), default='client', show_default=True)
+@click.option('--threads', type=click.IntRange(1), default=8, show_default=True, help='Потоков для драйвера wsgi.')
+@click.option('--requests', type=click.IntRange(1), default=200, show_default=True, help='Запросов на страницу.')
+@click.option('--warmup', type=click.IntRange(0), default=10, show_default=True, help='Запросов прогрева на страницу.')
+@click.option('--path', 'paths', multiple=True, help='Страницы (по умолчанию - BENCH_PATHS).')
+@click.option('--env', default='production', show_default=True, help='Профиль SQLite (APP_ENV).')
+@click.option('--output', type=click.File('w'), default='-', help='Файл результата JSON.')
+@click.option('--baseline', 'baseline_file', default=BASELINE_FILE, show_default=True)
+@click.option('--save-baseline', is_flag=True, help='Сохранить результат как базовую линию.')
+def run_command(database, driver, threads, requests, warmup, paths, env, output, baseline_file, save_baseline):
+    if not os.path.exists(database):
+        raise click.ClickException('БД %s не найдена; выполните seed.' % database)
+    app = bench_app(database, env)
+    result = run_benchmark(app, list(paths) or BENCH_PATHS, requests, driver, threads, warmup,
+                           dataset=load_dataset(database))
+
+    baseline = None
+    if os.path.exists(baseline_file):
+        with open(baseline_file, encoding='utf-8') as f:
+            baseline = json.load(f)
+    if save_baseline:
+        result['thresholds'] = baseline.get('thresholds', DEFAULT_THRESHOLDS) if baseline else DEFAULT_THRESHOLDS
+        os.makedirs(os.path.dirname(baseline_file), exist_ok=True)
+        with open(baseline_file, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+            f.write('\n')
+        regressions = []
+    else:
+        regressions = []
+        if baseline:
+            for key in COMPARABLE_META:
+                expected, actual = baseline.get('meta', {}).get(key), result['meta'][key]
+                if expected != actual:
+                    raise click.ClickException(
+                        'Базовая линия снята с другим %s (%s, сейчас %s); сравнение невозможно. '
+                        'Повторите seed/run с параметрами линии или сохраните новую (--save-baseline).'
+                        % ({'driver': 'драйвером', 'dataset': 'набором данных'}[key],
+                           json.dumps(expected, ensure_ascii=False), json.dumps(actual, ensure_ascii=False)))
+            regressions = compare(result, baseline)
+        result['regressions'] = regressions
+
+    json.dump(result, output, ensure_ascii=False, indent=2)
+    output.write('\n')
+    for message in regressions:
+        click.echo('Регрессия: ' + message, err=True)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    cli()
@@ -1,107 +1,237 @@
 
 
-from flask import Blueprint, render_template, request, make_response, current_app, flash, redirect, url_for
+from flask import Blueprint, render_template, request, Response, stream_with_context, current_app, flash, redirect, url_for, jsonify
 from flask_login import current_user, login_required
 from models import VisitLog, User  
 from sqlalchemy import func
 from app import check_rights 
+from visit_buffer import visit_buffer
+from visit_paths import path_dictionary
+from visit_rules import visit_rules
+from visit_stream import visit_stream, StreamFull
+from rollups import page_stats, user_stats, latency_stats, clear_rollups, approximate_total, margin
+from web_common.request_timing import finish_request  # Замер начинается хуком request_timing.init_app
+from pagination import KeysetPagination
+from partitions import fetch_logs, count_logs, clear_partitions
+from sketches import visit_sketches
+from datetime import datetime
 import csv
 import io
+import json
+
+EXPORT_CHUNK_ROWS = 500  # Строк в одном фрагменте потокового ответа
+ANONYMOUS_NAME = 'Неаутентифицированный пользователь'
 
 # Создание Blueprint для работы с журналом посещений
 visit_logs_bp = Blueprint('visit_logs', __name__, url_prefix='/visit_logs')
 db = None  
 
-# Логирование посещений перед каждым запросом
-@visit_logs_bp.before_app_request
-def log_visit():
-    if request.endpoint != 'static':  
-        with current_app.app_context():  
-            log = VisitLog(
-                path=request.path, 
-                user_id=current_user.id if current_user.is_authenticated else None  
-            )
-            visit_logs_bp.db.session.add(log) 
-            visit_logs_bp.db.session.commit()  
-
-# Главная страница журнала посещений с пагинацией
+# Логирование посещений после каждого запроса вместе со временем ответа, статусом и размером
+# (запись уходит в буфер, в БД - пакетами). Какие запросы и с какой вероятностью
+# записываются, решают правила visit_rules; вероятность сохраняется в записи.
+@visit_logs_bp.after_app_request
+def log_visit(response):
+    if not visit_rules.tracked(request.endpoint):
+        return response
+    visitor = 'user:%s' % current_user.id if current_user.is_authenticated else 'ip:%s' % request.remote_addr
+    visit_sketches.add(request.path, visitor)  # Оперативная статистика - по всем отслеживаемым запросам
+    sample_rate = visit_rules.decide(request.path, current_user)
+    if sample_rate is not None:
+        duration_ms, db_time_ms = finish_request()
+        visit_buffer.put({
+            'path': request.path,
+            'route': request.url_rule.rule if request.url_rule else None,  # Шаблон маршрута для словаря путей
+            'user_id': current_user.id if current_user.is_authenticated else None,
+            'created_at': datetime.utcnow(),
+            'endpoint': request.endpoint,
+            'status_code': response.status_code,
+            'duration_ms': duration_ms,
+            'db_time_ms': db_time_ms,
+            'response_size': response.content_length,
+            'sample_rate': sample_rate if sample_rate < 1.0 else None,
+        })
+    return response
+
+# Главная страница журнала посещений с курсорной пагинацией по всем разделам
 @visit_logs_bp.route('/')
 def index():
-    page = request.args.get('page', 1, type=int) 
-    logs = visit_logs_bp.db.session.query(VisitLog).order_by(VisitLog.created_at.desc()).paginate(page=page, per_page=10, error_out=False)
-    return render_template('visit_logs/index.html', logs=logs)
+    logs = KeysetPagination(fetch_logs, cursor=request.args.get('cursor'), per_page=10)
+    # Точное число записей - только по запросу (?count=exact), иначе оценка по агрегатам
+    if request.args.get('count') == 'exact':
+        total, exact = count_logs(), True
+    else:
+        total, exact = approximate_total(), False
+    return render_template('visit_logs/index.html', logs=logs, total=total, exact=exact)
+
+# Фильтр отчётов по диапазону дат из параметров запроса
+def report_filters():
+    return {
+        'date_from': request.args.get('date_from') or None,
+        'date_to': request.args.get('date_to') or None,
+    }
 
-# Отчет по страницам с количеством посещений
+# Группировка отчёта по страницам: None - по фактическим путям, 'route' - по маршрутам (?group=route)
+def page_grouping():
+    return 'route' if request.args.get('group') == 'route' else None
+
+# Отчет по страницам с количеством посещений (читает только агрегаты)
 @visit_logs_bp.route('/by_pages')
 @login_required
 @check_rights('Администратор')  
 def by_pages():
-    stats = visit_logs_bp.db.session.query(
-        VisitLog.path, func.count(VisitLog.id).label('visits')
-    ).group_by(VisitLog.path).order_by(func.count(VisitLog.id).desc()).all()
-    return render_template('visit_logs/by_pages.html', stats=stats)
+    filters = report_filters()
+    group = page_grouping()
+    # Строки: (страница, оценка посещений, ± для 95% доверительного интервала)
+    stats = [(row.path, row.visits, margin(row.variance))
+             for row in page_stats(by_route=group == 'route', **filters)]
+    return render_template('visit_logs/by_pages.html', stats=stats, filters=filters, group=group,
+                           sampled=any(stat[2] for stat in stats))
 
 # Отчет по пользователям с количеством посещений
 @visit_logs_bp.route('/by_users')
 @login_required
 @check_rights('Администратор')  
 def by_users():
-    stats = visit_logs_bp.db.session.query(
-        VisitLog.user_id, func.count(VisitLog.id).label('visits')
-    ).group_by(VisitLog.user_id).order_by(func.count(VisitLog.id).desc()).all()
+    filters = report_filters()
+    stats = [(user_name(row), row.visits, margin(row.variance)) for row in user_stats(**filters)]
+    return render_template('visit_logs/by_users.html', stats=stats, filters=filters,
+                           sampled=any(stat[2] for stat in stats))
+
+# Имя пользователя из строки отчета (колонки ФИО получены через JOIN)
+def user_name(row):
+    if row.first_name is None:
+        return ANONYMOUS_NAME
+    return User.format_full_name(row.last_name, row.first_name, row.middle_name)
+
+# Потоковая выгрузка отчета: CSV или JSONL (?format=jsonl), фрагментами по EXPORT_CHUNK_ROWS строк
+def stream_report(query, header, keys, to_row, filename):
+    export_format = 'jsonl' if request.args.get('format') == 'jsonl' else 'csv'
+    rows = query.execution_options(stream_results=True).yield_per(EXPORT_CHUNK_ROWS)
 
-    # Обработка данных для включения имен пользователей
-    processed_stats = []
-    for stat in stats:
-        user = visit_logs_bp.db.session.query(User).get(stat[0])
-        full_name = user.full_name if user else 'Неаутентифицированный пользователь'
-        processed_stats.append((full_name, stat[1]))
+    def generate():
+        output = io.StringIO()
+        writer = csv.writer(output)
+        if export_format == 'csv':
+            output.write('\ufeff')  # BOM, чтобы Excel распознал UTF-8
+            writer.writerow(header)
+        for number, row in enumerate(rows, 1):
+            values = to_row(row)
+            if export_format == 'csv':
+                writer.writerow(values)
+            else:
+                output.write(json.dumps(dict(zip(keys, values)), ensure_ascii=False) + '\n')
+            if number % EXPORT_CHUNK_ROWS == 0:
+                yield output.getvalue().encode('utf-8')
+                output.seek(0)
+                output.truncate()
+        yield output.getvalue().encode('utf-8')
 
-    return render_template('visit_logs/by_users.html', stats=processed_stats)
+    mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    response = Response(stream_with_context(generate()), mimetype=mimetype)
+    response.headers['Content-Disposition'] = 'attachment; filename=%s.%s' % (filename, export_format)
+    return response
+
+# Отчет по времени ответа: p50/p95/p99 по endpoint из гистограмм
+@visit_logs_bp.route('/latency')
+@login_required
+@check_rights('Администратор')
+def latency():
+    filters = report_filters()
+    return render_template('visit_logs/latency.html', stats=latency_stats(**filters), filters=filters)
 
-# Экспорт отчета по страницам в CSV
+# Экспорт отчета по страницам
 @visit_logs_bp.route('/export_pages')
 @login_required
 @check_rights('Администратор') 
 def export_pages():
-    stats = visit_logs_bp.db.session.query(
-        VisitLog.path, func.count(VisitLog.id).label('visits')
-    ).group_by(VisitLog.path).all()
-    output = io.StringIO()  
-    writer = csv.writer(output)
-    writer.writerow(['Страница', 'Количество посещений'])
-    writer.writerows(stats)
-    response = make_response(output.getvalue().encode('utf-8-sig'))
-    response.headers['Content-Disposition'] = 'attachment; filename=pages_report.csv'
-    response.headers['Content-Type'] = 'text/csv'
-    return response
+    by_route = page_grouping() == 'route'
+    return stream_report(page_stats(by_route=by_route, **report_filters()),
+                         ['Маршрут' if by_route else 'Страница', 'Количество посещений', 'Погрешность (95%)'],
+                         ['route' if by_route else 'path', 'visits', 'margin_95'],
+                         lambda row: [row.path, row.visits, margin(row.variance)], 'pages_report')
 
-# Экспорт отчета по пользователям в CSV
+# Экспорт отчета по пользователям
 @visit_logs_bp.route('/export_users')
 @login_required
 @check_rights('Администратор') 
 def export_users():
-    stats = visit_logs_bp.db.session.query(
-        VisitLog.user_id, func.count(VisitLog.id).label('visits')
-    ).group_by(VisitLog.user_id).all()
-    output = io.StringIO() 
-    writer = csv.writer(output)
-    writer.writerow(['Пользователь', 'Количество посещений'])
-    for stat in stats:
-        user = visit_logs_bp.db.session.query(User).get(stat[0])
-        writer.writerow([user.full_name if user else 'Неаутентифицированный пользователь', stat[1]])
-    response = make_response(output.getvalue().encode('utf-8-sig')) # Получение содержимого CSV
-    response.headers['Content-Disposition'] = 'attachment; filename=users_report.csv'
-    response.headers['Content-Type'] = 'text/csv'
-    return response
+    return stream_report(user_stats(**report_filters()),
+                         ['Пользователь', 'Количество посещений', 'Погрешность (95%)'],
+                         ['user', 'visits', 'margin_95'],
+                         lambda row: [user_name(row), row.visits, margin(row.variance)], 'users_report')
 
-# Очистка журнала посещений
+# Очистка журнала посещений. Разделы и агрегаты в БД очищаются для всех воркеров, но
+# буфер записи и оценки /visit_logs/live - память процесса: сбрасываются только в этом
+# воркере. Другие воркеры допишут посещения, накопленные до очистки (не более
+# VISIT_LOG_FLUSH_INTERVAL сек), а их оценки /live по-прежнему учитывают посещения до очистки.
 @visit_logs_bp.route('/clear', methods=['POST'])
 @login_required
 @check_rights('Администратор')  
 def clear_logs():
     with current_app.app_context():
-        visit_logs_bp.db.session.query(VisitLog).delete()  # Удаление всех записей журнала
+        visit_buffer.flush()  # Сначала записываем накопленное, чтобы не вернуть его после очистки
+        clear_partitions()  # Удаление разделов журнала целиком, без построчного DELETE
+        clear_rollups()  # и агрегатов по нему
+        visit_sketches.reset()
         visit_logs_bp.db.session.commit()
         flash('Журнал посещений успешно очищен.', 'success')
     return redirect(url_for('visit_logs.index'))
+
+# Счётчики буфера журнала посещений
+@visit_logs_bp.route('/buffer_stats')
+@login_required
+@check_rights('Администратор')
+def buffer_stats():
+    return jsonify(visit_buffer.stats())
+
+# Кэш словаря путей: размер и доля попаданий
+@visit_logs_bp.route('/path_stats')
+@login_required
+@check_rights('Администратор')
+def path_stats():
+    return jsonify(path_dictionary.stats())
+
+# Счётчики правил записи журнала: записано, исключено, отброшено выборкой
+@visit_logs_bp.route('/rules_stats')
+@login_required
+@check_rights('Администратор')
+def rules_stats():
+    return jsonify(visit_rules.stats())
+
+# Оперативная статистика: top-N страниц и уникальные посетители из потоковых оценок в памяти
+@visit_logs_bp.route('/live')
+@login_required
+@check_rights('Администратор')
+def live():
+    return jsonify(visit_sketches.summary(request.args.get('n', 10, type=int)))
+
+# Лента новых посещений (Server-Sent Events): кадр раз в секунду с посещениями по страницам
+# и пользователям из журнала в БД (записи всех воркеров). Генератор не использует БД и
+# контекст запроса - сессия освобождается сразу, журнал читает общий поток visit_stream.
+@visit_logs_bp.route('/stream')
+@login_required
+@check_rights('Администратор')
+def stream():
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+    try:
+        events = visit_stream.events(last_event_id)
+    except StreamFull:
+        return 'Слишком много подключений к ленте посещений.', 503, {'Retry-After': '30'}
+    response = Response(events, mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # nginx не буферизует поток
+    return response
+
+# Панель оперативной статистики на основе ленты /visit_logs/stream
+@visit_logs_bp.route('/dashboard')
+@login_required
+@check_rights('Администратор')
+def dashboard():
+    return render_template('visit_logs/dashboard.html')
+
+# Подписчики и кадры ленты посещений
+@visit_logs_bp.route('/stream_stats')
+@login_required
+@check_rights('Администратор')
+def stream_stats():
+    return jsonify(visit_stream.stats())
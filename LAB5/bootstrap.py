@@ -0,0 +1,108 @@
+# Подготовка базы данных вне пути обработки запросов.
+# - init_schema: идемпотентное создание таблиц, недостающих колонок/индексов,
+#   поискового индекса пользователей и агрегатов.
+# - seed_roles / seed_users: массовая загрузка ролей и пользователей из файлов
+#   (JSON-список, JSONL или CSV) - общие с lb4 функции web_common.fixtures с моделями
+#   LAB5. Пользователи вставляются пачками по BOOTSTRAP_CHUNK_ROWS строк, повторный
+#   запуск не создаёт дублей.
+# - flask bootstrap: схема + начальные данные; вызывается при развёртывании
+#   (и из app.py при запуске через python app.py).
+# - flask startup-timing: время создания приложения и первых запросов.
+
+import os
+import time
+
+import click
+from flask.cli import with_appcontext
+
+from models import db, Role, User
+from roles import role_cache
+from web_common import fixtures
+from web_common.fixtures import read_fixture
+from web_common.passwords import password_hasher
+from schema import upgrade_schema
+from user_search import ensure_user_search
+import rollups
+
+BOOTSTRAP_CHUNK_ROWS = 10000  # Строк в одном INSERT (executemany)
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def init_schema():
+    db.create_all()
+    upgrade_schema()
+    ensure_user_search()
+    rollups.ensure_rollups()
+
+
+def seed_roles(records):
+    added = fixtures.seed_roles(db.session, Role, records)
+    if added:
+        role_cache.invalidate()
+    return added
+
+
+# Загрузка пользователей; в записи - password или готовый password_hash,
+# роль задаётся названием (role) или идентификатором (role_id)
+def seed_users(records, chunk_rows=BOOTSTRAP_CHUNK_ROWS):
+    return fixtures.seed_users(db.session, User, Role, records, password_hasher.method, chunk_rows)
+
+
+# Синтетические пользователи для нагрузочных проверок (общий пароль, роль "Пользователь")
+def generated_users(count, password, prefix='user'):
+    width = len(str(count))
+    for i in range(1, count + 1):
+        yield {
+            'username': f'{prefix}{i:0{width}d}',
+            'password': password,
+            'last_name': 'Тестов',
+            'first_name': f'Пользователь {i}',
+            'middle_name': '',
+            'role': 'Пользователь',
+        }
+
+
+def bootstrap_database(fixtures_dir=FIXTURES_DIR):
+    init_schema()
+    roles_file = os.path.join(fixtures_dir, 'roles.json')
+    users_file = os.path.join(fixtures_dir, 'users.json')
+    roles = seed_roles(read_fixture(roles_file)) if os.path.exists(roles_file) else 0
+    users = seed_users(read_fixture(users_file)) if os.path.exists(users_file) else 0
+    return roles, users
+
+
+@click.command('bootstrap')
+@click.option('--fixtures', 'fixtures_dir', default=FIXTURES_DIR, show_default=True,
+              type=click.Path(exists=True, file_okay=False), help='Каталог с roles.json и users.json.')
+@click.option('--users', 'users_file', type=click.Path(exists=True, dir_okay=False),
+              help='Дополнительный файл пользователей (.json, .jsonl, .csv).')
+@click.option('--generate', type=int, default=0, help='Создать N синтетических пользователей.')
+@click.option('--password', default='Passw0rd123', show_default=True, help='Пароль синтетических пользователей.')
+@with_appcontext
+def bootstrap_command(fixtures_dir, users_file, generate, password):
+    # Схема и начальные данные; повторный запуск ничего не дублирует
+    started = time.perf_counter()
+    roles, users = bootstrap_database(fixtures_dir)
+    if users_file:
+        users += seed_users(read_fixture(users_file))
+    if generate:
+        users += seed_users(generated_users(generate, password))
+    elapsed = time.perf_counter() - started
+    click.echo(f'Схема готова. Добавлено ролей: {roles}, пользователей: {users} за {elapsed:.2f} с.')
+
+
+@click.command('startup-timing')
+@click.option('--path', 'paths', multiple=True, default=['/', '/login'], show_default=True,
+              help='Страницы для первых запросов.')
+def startup_timing_command(paths):
+    # Время создания нового экземпляра приложения (как при старте воркера) и первых запросов
+    from app import create_app
+    started = time.perf_counter()
+    app = create_app()
+    click.echo(f'create_app: {(time.perf_counter() - started) * 1000:.1f} мс')
+    client = app.test_client()
+    for attempt in ('первый', 'второй'):
+        for path in paths:
+            started = time.perf_counter()
+            status = client.get(path).status_code
+            click.echo(f'{path} ({attempt} запрос, {status}): {(time.perf_counter() - started) * 1000:.1f} мс')
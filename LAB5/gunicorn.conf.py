@@ -0,0 +1,18 @@
+# Настройки gunicorn для LAB5.
+# Запуск: gunicorn -c gunicorn.conf.py "app:create_app()"
+# - Воркеры gevent: каждое подключение - greenlet, поэтому долгие подключения к ленте
+#   посещений (/visit_logs/stream, SSE) не занимают воркер целиком.
+# - worker_connections - одновременных подключений на воркер; лента занимает не больше
+#   VISIT_STREAM_MAX_SUBSCRIBERS из них (200 по умолчанию), остальные - обычным запросам.
+# - Кадры ленты читаются из журнала в БД, поэтому посещения, обработанные любым
+#   воркером, видны подписчикам всех воркеров (см. visit_stream).
+
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gevent'
+worker_connections = 1000
+timeout = 30  # Для gevent - время без ответа воркера арбитру, а не длительность запроса
+keepalive = 5
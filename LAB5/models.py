@@ -1,10 +1,14 @@
 # Модели базы данных для приложения.
 # - Role: хранит роли пользователей.
-# - User: хранит данные пользователей и интеграцию с Flask-Login.
-# - VisitLog: хранит записи о посещениях страниц.
+# - User: хранит данные пользователей и интеграцию с Flask-Login (active - учётная запись не отключена).
+# - VisitLog: хранит записи о посещениях страниц (путь и маршрут - id из словаря VisitPath).
+# - VisitPath: словарь шаблонов маршрутов и фактических путей запросов.
+# - VisitPageRollup, VisitUserRollup: агрегаты посещений по страницам и пользователям за час/день.
+# - VisitLatencyRollup: гистограммы времени ответа по endpoint за час/день.
 
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+import hashlib
 
 db = SQLAlchemy()  # Создайте экземпляр SQLAlchemy
 
@@ -17,7 +21,11 @@ class Role(db.Model):
 
 class User(db.Model):
     __tablename__ = 'user'
-    __table_args__ = {'extend_existing': True}
+    # Индекс для курсорной пагинации справочника пользователей (новые первыми)
+    __table_args__ = (
+        db.Index('ix_user_created_at_id', 'created_at', 'id'),
+        {'extend_existing': True}
+    )
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(50), unique=True, nullable=False)
     password_hash = db.Column(db.String(128), nullable=False)
@@ -27,10 +35,17 @@ class User(db.Model):
     role_id = db.Column(db.Integer, db.ForeignKey('role.id'))
     role = db.relationship('Role', backref=db.backref('users', lazy=True))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Отключённый пользователь не может войти, его сессии недействительны (см. user_bulk)
+    active = db.Column(db.Boolean, nullable=False, default=True, server_default='1')
 
     @property
     def full_name(self):
-        return f"{self.last_name} {self.first_name} {self.middle_name}".strip()
+        return User.format_full_name(self.last_name, self.first_name, self.middle_name)
+
+    # ФИО по отдельным полям - для запросов, выбирающих колонки без загрузки объекта
+    @staticmethod
+    def format_full_name(last_name, first_name, middle_name):
+        return f"{last_name} {first_name} {middle_name}".strip()
 
     # Flask-Login integration
     @property
@@ -39,24 +54,98 @@ class User(db.Model):
 
     @property
     def is_active(self):
-        return True
+        return self.active
 
     @property
     def is_anonymous(self):
         return False
 
+    # Версия пароля - короткий отпечаток хеша; меняется при смене пароля
+    @property
+    def password_version(self):
+        return hashlib.sha1(self.password_hash.encode()).hexdigest()[:8]
+
+    # Идентификатор в сессии включает версию пароля: смена пароля завершает другие сессии
     def get_id(self):
-        return str(self.id)
+        return f"{self.id}:{self.password_version}"
 
 class VisitLog(db.Model):
     __tablename__ = 'visit_log'
-    __table_args__ = {'extend_existing': True}
+    # Составные индексы для курсорной пагинации общего и личного журнала
+    __table_args__ = (
+        db.Index('ix_visit_log_created_at_id', 'created_at', 'id'),
+        db.Index('ix_visit_log_user_id_created_at_id', 'user_id', 'created_at', 'id'),
+        {'extend_existing': True}
+    )
     id = db.Column(db.Integer, primary_key=True)
-    path = db.Column(db.String(100), nullable=False)
+    path_id = db.Column(db.Integer)  # VisitPath.id фактического пути запроса
+    route_id = db.Column(db.Integer)  # VisitPath.id шаблона маршрута (None - путь без маршрута, 404)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-
-    user = db.relationship('User', backref='visit_logs')
+    endpoint = db.Column(db.String(100))  # Имя обработчика Flask
+    status_code = db.Column(db.Integer)
+    duration_ms = db.Column(db.Float)  # Полное время обработки запроса
+    db_time_ms = db.Column(db.Float)  # Время SQL-запросов за время обработки
+    response_size = db.Column(db.Integer)  # Размер тела ответа, байт (None для потоковых)
+    sample_rate = db.Column(db.Float)  # Вероятность записи запроса (None - записывается каждый, см. visit_rules)
+
+    # passive_deletes: при удалении пользователя ORM не загружает его журнал (см. user_deletion)
+    user = db.relationship('User', backref=db.backref('visit_logs', passive_deletes=True))
+
+# Словарь путей журнала: kind='route' - шаблон маршрута (request.url_rule),
+# kind='path' - фактический путь запроса, route_id - его маршрут (см. visit_paths)
+class VisitPath(db.Model):
+    __tablename__ = 'visit_path'
+    __table_args__ = (
+        db.UniqueConstraint('kind', 'value', name='uq_visit_path_kind_value'),
+        {'extend_existing': True}
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(5), nullable=False)
+    value = db.Column(db.String(255), nullable=False)
+    route_id = db.Column(db.Integer)
+
+# Агрегат посещений страницы за период (period: 'hour' или 'day', bucket: 'ГГГГ-ММ-ДД ЧЧ' / 'ГГГГ-ММ-ДД')
+class VisitPageRollup(db.Model):
+    __tablename__ = 'visit_page_rollup'
+    # Покрывающий индекс отчёта: группировка по path_id за период без обращения к таблице
+    __table_args__ = (
+        db.Index('ix_visit_page_rollup_report', 'period', 'path_id', 'bucket', 'visits', 'extra_visits', 'variance'),
+        {'extend_existing': True}
+    )
+    period = db.Column(db.String(4), primary_key=True)
+    bucket = db.Column(db.String(13), primary_key=True)
+    path_id = db.Column(db.Integer, primary_key=True, autoincrement=False)  # VisitPath.id
+    visits = db.Column(db.Integer, nullable=False, default=0)
+    # Поправка на выборку: оценка непопавших в журнал посещений (сумма 1/sample_rate - 1)
+    extra_visits = db.Column(db.Float, nullable=False, default=0, server_default='0')
+    variance = db.Column(db.Float, nullable=False, default=0, server_default='0')  # Дисперсия оценки
+
+# Агрегат посещений пользователя за период (user_id = 0 - неаутентифицированные посетители)
+class VisitUserRollup(db.Model):
+    __tablename__ = 'visit_user_rollup'
+    # Покрывающий индекс отчёта: группировка по user_id за период без обращения к таблице
+    __table_args__ = (
+        db.Index('ix_visit_user_rollup_report', 'period', 'user_id', 'bucket', 'visits', 'extra_visits', 'variance'),
+        {'extend_existing': True}
+    )
+    period = db.Column(db.String(4), primary_key=True)
+    bucket = db.Column(db.String(13), primary_key=True)
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    visits = db.Column(db.Integer, nullable=False, default=0)
+    extra_visits = db.Column(db.Float, nullable=False, default=0, server_default='0')  # См. VisitPageRollup
+    variance = db.Column(db.Float, nullable=False, default=0, server_default='0')
+
+# Гистограмма времени ответа endpoint за период: число запросов в логарифмической корзине
+# (корзина i содержит длительности до LATENCY_BASE ** i мс, см. rollups.latency_bucket)
+class VisitLatencyRollup(db.Model):
+    __tablename__ = 'visit_latency_rollup'
+    __table_args__ = {'extend_existing': True}
+    period = db.Column(db.String(4), primary_key=True)
+    bucket = db.Column(db.String(13), primary_key=True)
+    endpoint = db.Column(db.String(100), primary_key=True)
+    latency_bucket = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    requests = db.Column(db.Integer, nullable=False, default=0)
 
 
 
@@ -0,0 +1,53 @@
+# Курсорная (keyset) пагинация по паре (created_at, id) в порядке убывания.
+# - KeysetPagination: страница записей с непрозрачными токенами next/prev вместо номера страницы.
+# - Не использует OFFSET и COUNT(*): каждая страница - поиск по составному индексу.
+# - Записи выбирает функция fetch(direction, position, limit): direction 'next' - строки
+#   старше position (или первые, если position нет) по убыванию, 'prev' - новее по возрастанию.
+
+import base64
+import json
+from datetime import datetime
+
+
+def encode_cursor(direction, created_at, id):
+    raw = json.dumps([direction, created_at.isoformat(), id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+# Разбор токена; для некорректного токена возвращается None (первая страница)
+def decode_cursor(token):
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        direction, created_at, id = json.loads(raw)
+        if direction not in ('next', 'prev'):
+            return None
+        return direction, datetime.fromisoformat(created_at), int(id)
+    except (ValueError, TypeError):
+        return None
+
+
+class KeysetPagination:
+    def __init__(self, fetch, cursor=None, per_page=10):
+        self.per_page = per_page
+        position = decode_cursor(cursor)
+
+        if position is None or position[0] == 'next':
+            rows = fetch('next', position[1:] if position else None, per_page + 1)
+            self.items = rows[:per_page]
+            self.has_prev = position is not None and bool(self.items)
+            self.has_next = len(rows) > per_page
+        else:
+            # Назад: берём записи "новее" курсора по возрастанию и разворачиваем
+            rows = fetch('prev', position[1:], per_page + 1)
+            self.items = list(reversed(rows[:per_page]))
+            self.has_prev = len(rows) > per_page
+            self.has_next = True
+
+        self.next_cursor = self._cursor('next', self.items[-1]) if self.has_next and self.items else None
+        self.prev_cursor = self._cursor('prev', self.items[0]) if self.has_prev else None
+
+    @staticmethod
+    def _cursor(direction, item):
+        return encode_cursor(direction, item.created_at, item.id)
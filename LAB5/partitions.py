@@ -0,0 +1,283 @@
+# Помесячные разделы журнала посещений.
+# - Новые записи пишутся в таблицы visit_log_ГГГГММ по дате посещения.
+# - Исходная таблица visit_log хранит записи, накопленные до разделения,
+#   и читается как самый старый раздел.
+# - Удаление раздела - DROP TABLE, т.е. O(1) независимо от числа строк.
+#   Перед удалением по сроку хранения или архивацией записи раздела вычитаются
+#   из агрегатов (rollups.subtract_partition) в той же транзакции.
+# - Очистка и хранение удаляют разделы для всех процессов сразу; воркер, который
+#   считает раздел созданным, при "no such table" создаёт его заново и повторяет запись.
+# - Архивация: раздел копируется в отдельный файл SQLite, сжимается gzip
+#   и удаляется из основной БД; архив читается sqlite3 после распаковки и
+#   содержит сами пути (path, route), а не только id словаря основной БД.
+
+import gzip
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+from collections import defaultdict
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import Table, Column, Index, MetaData, func, select, text, tuple_, inspect
+from sqlalchemy.exc import OperationalError
+
+from models import db, User, VisitLog, VisitPath
+from visit_paths import path_dictionary
+
+LEGACY_TABLE = VisitLog.__tablename__
+PARTITION_PREFIX = LEGACY_TABLE + '_'
+PARTITION_RE = re.compile(r'^%s(\d{4})(\d{2})$' % PARTITION_PREFIX)
+
+# Отдельные метаданные: разделы не попадают в db.create_all()
+partition_metadata = MetaData()
+_tables = {}
+_created = set()  # Разделы, уже созданные в БД этим процессом (см. insert_entries)
+
+
+def partition_name(dt):
+    return '%s%04d%02d' % (PARTITION_PREFIX, dt.year, dt.month)
+
+
+# Месяц раздела (год, месяц); для исходной таблицы - None
+def partition_month(name):
+    match = PARTITION_RE.match(name)
+    return (int(match.group(1)), int(match.group(2))) if match else None
+
+
+# Описание таблицы раздела: колонки и индексы копируются с VisitLog
+def partition_table(name):
+    if name == LEGACY_TABLE:
+        return VisitLog.__table__
+    table = _tables.get(name)
+    if table is None:
+        columns = [
+            Column(c.name, c.type, primary_key=c.primary_key, nullable=c.nullable)
+            for c in VisitLog.__table__.columns
+        ]
+        table = Table(name, partition_metadata, *columns)
+        for index in VisitLog.__table__.indexes:
+            Index(index.name.replace(LEGACY_TABLE, name, 1),
+                  *[table.c[c.name] for c in index.columns])
+        _tables[name] = table
+    return table
+
+
+# Имена существующих разделов от новых к старым; исходная таблица - последней
+def list_partitions(include_legacy=True):
+    names = inspect(db.engine).get_table_names()
+    partitions = sorted((n for n in names if PARTITION_RE.match(n)), reverse=True)
+    if include_legacy and LEGACY_TABLE in names:
+        partitions.append(LEGACY_TABLE)
+    return partitions
+
+
+def ensure_partition(name):
+    table = partition_table(name)
+    if name not in _created:
+        table.create(db.session.connection(), checkfirst=True)
+        _created.add(name)
+    return table
+
+
+# Запись пакета посещений: строки раскладываются по разделам месяца.
+# Пути кодируются словарём до начала записи (новые значения словаря фиксируются
+# сразу, см. visit_paths), поэтому функция должна открывать транзакцию вызывающего кода.
+def insert_entries(entries):
+    path_dictionary.encode(entries)
+    by_partition = defaultdict(list)
+    for entry in entries:
+        by_partition[partition_name(entry['created_at'])].append(entry)
+    for name, rows in by_partition.items():
+        try:
+            db.session.execute(ensure_partition(name).insert(), rows)  # executemany
+        except OperationalError as e:
+            # _created - память этого процесса: раздел мог удалить другой воркер
+            # (очистка журнала, хранение). Раздел создаётся заново, пакет повторяется
+            if name not in _created or 'no such table' not in str(e.orig):
+                raise
+            _created.discard(name)
+            db.session.execute(ensure_partition(name).insert(), rows)
+
+
+# Выражение ФИО для выборок без загрузки объектов User
+def user_name_column():
+    return func.trim(
+        func.coalesce(User.last_name, '') + ' ' + User.first_name + ' ' + func.coalesce(User.middle_name, '')
+    ).label('user_name')
+
+
+# Выборка страницы записей по всем разделам для KeysetPagination.
+# Разделы перебираются по порядку времени, пока не наберётся limit строк;
+# разделы по другую сторону курсора не запрашиваются.
+def fetch_logs(direction, position, limit, user_id=None):
+    names = list_partitions()
+    if direction == 'prev':
+        names.reverse()
+    rows = []
+    for name in names:
+        month = partition_month(name)
+        if position is not None and month is not None:
+            cursor_month = (position[0].year, position[0].month)
+            if (direction == 'next' and month > cursor_month) or (direction == 'prev' and month < cursor_month):
+                continue
+        table = partition_table(name)
+        key = tuple_(table.c.created_at, table.c.id)
+        query = (select(table, user_name_column(), VisitPath.value.label('path'))
+                 .outerjoin(User, User.id == table.c.user_id)
+                 .outerjoin(VisitPath, VisitPath.id == table.c.path_id))
+        if user_id is not None:
+            query = query.where(table.c.user_id == user_id)
+        if direction == 'prev':
+            query = query.where(key > tuple_(*position)).order_by(table.c.created_at.asc(), table.c.id.asc())
+        else:
+            if position is not None:
+                query = query.where(key < tuple_(*position))
+            query = query.order_by(table.c.created_at.desc(), table.c.id.desc())
+        rows.extend(db.session.execute(query.limit(limit - len(rows))).all())
+        if len(rows) >= limit:
+            break
+    return rows
+
+
+# Точное число записей во всех разделах
+def count_logs():
+    return sum(
+        db.session.execute(select(func.count()).select_from(partition_table(name))).scalar()
+        for name in list_partitions()
+    )
+
+
+def drop_partition(name):
+    partition_table(name).drop(db.session.connection(), checkfirst=True)
+    _created.discard(name)
+
+
+# Мгновенная очистка: разделы удаляются целиком, исходная таблица очищается
+# DELETE без условия, который SQLite выполняет как усечение таблицы
+def clear_partitions():
+    for name in list_partitions(include_legacy=False):
+        drop_partition(name)
+    db.session.execute(VisitLog.__table__.delete())
+
+
+# Разделы старше retention_months полных месяцев (текущий месяц не считается)
+def expired_partitions(retention_months, now=None):
+    now = now or datetime.utcnow()
+    current = now.year * 12 + now.month - 1
+    expired = []
+    for name in list_partitions(include_legacy=False):
+        year, month = partition_month(name)
+        if current - (year * 12 + month - 1) > retention_months:
+            expired.append(name)
+    return expired
+
+
+# Копия раздела в отдельный сжатый файл SQLite (таблица visit_log внутри, с колонками
+# path и route - значениями словаря путей для path_id и route_id)
+def archive_partition(name, archive_dir):
+    os.makedirs(archive_dir, exist_ok=True)
+    target = os.path.join(archive_dir, name + '.db')
+    if os.path.exists(target):
+        os.remove(target)
+    # ATTACH/DETACH нельзя выполнять внутри транзакции, поэтому отдельное соединение
+    with db.engine.connect() as connection:
+        connection.execute(text('ATTACH DATABASE :path AS archive'), {'path': target})
+        try:
+            # Пути и маршруты - строками из словаря: архив читается без основной БД
+            connection.execute(text(
+                'CREATE TABLE archive.%s AS SELECT log.*, path.value AS path, route.value AS route '
+                'FROM main."%s" AS log '
+                'LEFT JOIN main.%s AS path ON path.id = log.path_id '
+                'LEFT JOIN main.%s AS route ON route.id = log.route_id'
+                % (LEGACY_TABLE, name, VisitPath.__tablename__, VisitPath.__tablename__)))
+            connection.commit()
+        finally:
+            connection.execute(text('DETACH DATABASE archive'))
+    with open(target, 'rb') as src, gzip.open(target + '.gz', 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(target)
+    return target + '.gz'
+
+
+# Чтение архива без основной БД: распаковка во временный файл и sqlite3
+def open_archive(path):
+    fd, tmp_path = tempfile.mkstemp(suffix='.db')
+    with os.fdopen(fd, 'wb') as dst, gzip.open(path, 'rb') as src:
+        shutil.copyfileobj(src, dst)
+    return sqlite3.connect(tmp_path)
+
+
+# Удаление раздела вместе с его вкладом в агрегаты (одна транзакция)
+def retire_partition(name):
+    import rollups  # rollups импортирует этот модуль
+    rollups.subtract_partition(name)
+    drop_partition(name)
+    db.session.commit()
+
+
+# Применение политики хранения: архивировать (если задан каталог) и удалить
+def apply_retention(retention_months, archive_dir=None):
+    removed = []
+    for name in expired_partitions(retention_months):
+        if archive_dir:
+            archive_partition(name, archive_dir)
+        retire_partition(name)
+        removed.append(name)
+    return removed
+
+
+# Перенос записей исходной таблицы visit_log в помесячные разделы (однократно)
+def split_legacy():
+    moved = 0
+    month = func.strftime('%Y%m', VisitLog.created_at)
+    months = [m for (m,) in db.session.execute(select(month).group_by(month)).all() if m]
+    for value in months:
+        table = ensure_partition(PARTITION_PREFIX + value)
+        columns = [c.name for c in table.columns if c.name != 'id']
+        source = select(*[VisitLog.__table__.c[c] for c in columns]).where(month == value)
+        moved += db.session.execute(table.insert().from_select(columns, source)).rowcount
+        db.session.execute(VisitLog.__table__.delete().where(month == value))
+        db.session.commit()
+    return moved
+
+
+visit_logs_cli = AppGroup('visit-logs', help='Обслуживание разделов журнала посещений.')
+
+
+@visit_logs_cli.command('list')
+def list_command():
+    for name in list_partitions():
+        count = db.session.execute(select(func.count()).select_from(partition_table(name))).scalar()
+        click.echo('%s\t%d' % (name, count))
+
+
+@visit_logs_cli.command('retention')
+@click.option('--months', type=int, default=None, help='Сколько полных месяцев хранить.')
+@click.option('--no-archive', is_flag=True, help='Удалить разделы без архивации.')
+def retention_command(months, no_archive):
+    months = months if months is not None else current_app.config['VISIT_LOG_RETENTION_MONTHS']
+    if months is None:
+        raise click.UsageError('Не задан срок хранения (--months или VISIT_LOG_RETENTION_MONTHS).')
+    archive_dir = None if no_archive else current_app.config['VISIT_LOG_ARCHIVE_DIR']
+    for name in apply_retention(months, archive_dir):
+        click.echo('Раздел %s удалён%s.' % (name, '' if no_archive else ' (архив в %s)' % archive_dir))
+
+
+@visit_logs_cli.command('archive')
+@click.argument('name')
+def archive_command(name):
+    if partition_month(name) is None or name not in list_partitions(include_legacy=False):
+        raise click.BadParameter('Нет раздела %s.' % name)
+    path = archive_partition(name, current_app.config['VISIT_LOG_ARCHIVE_DIR'])
+    retire_partition(name)
+    click.echo('Раздел %s перенесён в %s.' % (name, path))
+
+
+@visit_logs_cli.command('split-legacy')
+def split_legacy_command():
+    click.echo('Перенесено записей: %d.' % split_legacy())
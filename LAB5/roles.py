@@ -0,0 +1,58 @@
+# Кэш ролей для проверки прав без запросов к БД.
+# - RoleCache: неизменяемый снимок таблицы role (id -> название) с номером версии.
+# - Снимок загружается одним запросом при первом обращении и сбрасывается
+#   invalidate() при изменении ролей в этом процессе; другие процессы
+#   перечитывают роли не реже чем раз в ROLE_CACHE_TTL секунд.
+
+import threading
+import time
+
+from models import db, Role
+
+ROLE_CACHE_TTL = 30  # Секунд до принудительной перезагрузки снимка
+
+
+class RoleSnapshot:
+    def __init__(self, roles, version):
+        self.version = version
+        self.names = {role.id: role.name for role in roles}  # id -> название роли
+        self.choices = [(role.id, role.name) for role in roles]  # Для SelectField
+        self.loaded_at = time.monotonic()
+
+
+class RoleCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._version = 0
+
+    def snapshot(self):
+        snapshot = self._snapshot
+        if snapshot is None or time.monotonic() - snapshot.loaded_at > ROLE_CACHE_TTL:
+            with self._lock:
+                snapshot = self._snapshot
+                if snapshot is None or time.monotonic() - snapshot.loaded_at > ROLE_CACHE_TTL:
+                    snapshot = RoleSnapshot(db.session.query(Role).order_by(Role.id).all(), self._version)
+                    self._snapshot = snapshot
+        return snapshot
+
+    def invalidate(self):
+        with self._lock:
+            self._version += 1
+            self._snapshot = None
+
+    @property
+    def version(self):
+        return self._version
+
+    def role_name(self, role_id):
+        return self.snapshot().names.get(role_id)
+
+    def has_role(self, role_id, role_name):
+        return role_id is not None and self.role_name(role_id) == role_name
+
+    def choices(self):
+        return list(self.snapshot().choices)
+
+
+role_cache = RoleCache()
@@ -0,0 +1,328 @@
+# Агрегаты журнала посещений.
+# - record_visits: инкрементально обновляет агрегаты по пакету новых записей.
+# - page_stats, user_stats: запросы отчётов, читающие только агрегаты (страницы - и по маршрутам).
+#   Для записей, сохранённых выборкой (visit_rules), отчёты показывают оценку числа
+#   посещений и дисперсию; margin - половина 95% доверительного интервала.
+# - latency_stats: перцентили времени ответа по endpoint из логарифмических гистограмм.
+# - anonymize_users: перенос посещений удалённых пользователей в агрегат анонимных посетителей.
+# - rebuild_rollups: полный пересчёт агрегатов из всех разделов журнала (команда flask rebuild-rollups).
+# - subtract_partition: вычитание удаляемого раздела журнала (хранение и архивация, см. partitions).
+
+import math
+from collections import Counter, defaultdict
+from datetime import datetime
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import cast, func, literal, select, true
+from sqlalchemy.orm import aliased
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from models import db, User, VisitPath, VisitPageRollup, VisitUserRollup, VisitLatencyRollup
+from partitions import list_partitions, partition_table
+
+ANONYMOUS_USER_ID = 0  # Ключ агрегата для неаутентифицированных посетителей
+UNMATCHED_ROUTE = '(без маршрута)'  # Пути, не соответствующие ни одному маршруту (404)
+CONFIDENCE_Z = 1.96  # Квантиль нормального распределения для 95% доверительного интервала
+
+# Корзины гистограммы времени ответа: корзина i - длительности до LATENCY_BASE ** i мс.
+# Шаг 2^(1/4) даёт погрешность перцентиля не более ~19%.
+LATENCY_BASE = 2 ** 0.25
+LATENCY_MAX_BUCKET = 120  # ~ 10^9 мс, всё больше попадает в последнюю корзину
+REBUILD_BATCH_ROWS = 1000  # Строк за одну выборку при пересчёте из сырого журнала
+UPSERT_CHUNK_ROWS = 500  # Строк в одном executemany (SQLAlchemy объединяет их в многострочный INSERT)
+
+# Формат ключа периода: час и день
+PERIOD_FORMATS = {
+    'hour': '%Y-%m-%d %H',
+    'day': '%Y-%m-%d',
+}
+
+
+def bucket_key(dt, period):
+    return dt.strftime(PERIOD_FORMATS[period])
+
+
+# Обновление агрегатов по пакету записей (в транзакции вызывающего кода). Записи должны
+# быть уже закодированы словарём путей (path_id, см. partitions.insert_entries);
+# weight=-1 вычитает записи из агрегатов (удаление журнала пользователя)
+def record_visits(entries, weight=1):
+    pages = defaultdict(lambda: [0, 0.0, 0.0])  # Ключ -> [строк, extra_visits, variance]
+    users = defaultdict(lambda: [0, 0.0, 0.0])
+    latencies = Counter()
+    for entry in entries:
+        created_at = entry.get('created_at') or datetime.utcnow()
+        user_id = entry.get('user_id') or ANONYMOUS_USER_ID
+        duration_ms = entry.get('duration_ms')
+        extra, variance = sample_correction(entry.get('sample_rate'))
+        for period in PERIOD_FORMATS:
+            bucket = bucket_key(created_at, period)
+            for counters in (pages[(period, bucket, entry['path_id'])], users[(period, bucket, user_id)]):
+                counters[0] += weight
+                counters[1] += extra * weight
+                counters[2] += variance * weight
+            if duration_ms is not None:
+                latencies[(period, bucket, entry.get('endpoint') or '', latency_bucket(duration_ms))] += weight
+
+    _upsert(VisitPageRollup, 'path_id', pages)
+    _upsert(VisitUserRollup, 'user_id', users)
+    _upsert_latency(latencies)
+
+
+# Вклад строки, записанной с вероятностью rate, в оценку Хорвица-Томпсона:
+# (1/rate - 1 непопавших посещений, дисперсия (1 - rate) / rate^2)
+def sample_correction(rate):
+    if not rate or rate >= 1:
+        return 0.0, 0.0
+    return 1 / rate - 1, (1 - rate) / rate ** 2
+
+
+# Половина ширины доверительного интервала оценки по сумме дисперсий
+def margin(variance):
+    return int(round(CONFIDENCE_Z * math.sqrt(variance))) if variance and variance > 0 else 0
+
+
+def latency_bucket(duration_ms):
+    if duration_ms <= 1:
+        return 0
+    return min(LATENCY_MAX_BUCKET, int(math.ceil(math.log(duration_ms, LATENCY_BASE))))
+
+
+def _upsert_latency(counter):
+    if not counter:
+        return
+    table = VisitLatencyRollup.__table__
+    rows = [
+        {'period': period, 'bucket': bucket, 'endpoint': endpoint, 'latency_bucket': index, 'requests': requests}
+        for (period, bucket, endpoint, index), requests in counter.items()
+    ]
+    stmt = sqlite_insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['period', 'bucket', 'endpoint', 'latency_bucket'],
+        set_={'requests': table.c.requests + stmt.excluded.requests}
+    )
+    # executemany одного и того же выражения: компиляция кэшируется, а не повторяется на каждую пачку
+    for start in range(0, len(rows), UPSERT_CHUNK_ROWS):
+        db.session.execute(stmt, rows[start:start + UPSERT_CHUNK_ROWS])
+
+
+def _upsert(model, key_column, counter):
+    if not counter:
+        return
+    rows = [
+        {'period': period, 'bucket': bucket, key_column: key,
+         'visits': visits, 'extra_visits': extra, 'variance': variance}
+        for (period, bucket, key), (visits, extra, variance) in counter.items()
+    ]
+    stmt = sqlite_insert(model.__table__)
+    stmt = stmt.on_conflict_do_update(index_elements=['period', 'bucket', key_column], set_=_sum_counters(model, stmt))
+    for start in range(0, len(rows), UPSERT_CHUNK_ROWS):
+        db.session.execute(stmt, rows[start:start + UPSERT_CHUNK_ROWS])
+
+
+# Разбор границы диапазона: 'ГГГГ-ММ-ДД' -> день, 'ГГГГ-ММ-ДДTЧЧ:ММ' -> час
+def parse_bound(value):
+    if not value:
+        return None
+    for fmt, period in (('%Y-%m-%dT%H:%M', 'hour'), ('%Y-%m-%d', 'day')):
+        try:
+            return period, datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+# Период агрегатов и фильтр по диапазону дат (границы включительно).
+# Если одна граница с часом, а другая - только дата, дата расширяется до целого дня:
+# начало - час 00, конец - час 23.
+def _range_filter(model, date_from, date_to):
+    bounds = [parse_bound(date_from), parse_bound(date_to)]
+    period = 'hour' if any(b and b[0] == 'hour' for b in bounds) else 'day'
+    conditions = [model.period == period]
+    if bounds[0]:
+        conditions.append(model.bucket >= _bound_key(bounds[0], period, '00'))
+    if bounds[1]:
+        conditions.append(model.bucket <= _bound_key(bounds[1], period, '23'))
+    return conditions
+
+
+def _bound_key(bound, period, day_hour):
+    kind, dt = bound
+    if period == 'hour' and kind == 'day':
+        return '%s %s' % (bucket_key(dt, 'day'), day_hour)
+    return bucket_key(dt, period)
+
+
+# Посещения по страницам (фактическим путям) или, при by_route, по шаблонам маршрутов:
+# группировка по целочисленному id, строки - из словаря путей
+def page_stats(date_from=None, date_to=None, by_route=False):
+    visits = _estimate(VisitPageRollup)
+    if by_route:
+        route = aliased(VisitPath)
+        label, group = func.coalesce(route.value, UNMATCHED_ROUTE), VisitPath.route_id
+    else:
+        route, label, group = None, VisitPath.value, VisitPageRollup.path_id
+    query = db.session.query(label.label('path'), visits.label('visits'),
+                             func.sum(VisitPageRollup.variance).label('variance')).select_from(VisitPageRollup) \
+        .join(VisitPath, VisitPath.id == VisitPageRollup.path_id)
+    if route is not None:
+        query = query.outerjoin(route, route.id == VisitPath.route_id)
+    return query.filter(*_range_filter(VisitPageRollup, date_from, date_to)) \
+        .group_by(group).order_by(visits.desc())
+
+
+# Перцентили времени ответа по endpoint: верхняя граница корзины, в которой
+# накопленная доля запросов достигает перцентиля
+def latency_stats(date_from=None, date_to=None, percentiles=(50, 95, 99)):
+    requests = func.sum(VisitLatencyRollup.requests)
+    rows = db.session.query(
+        VisitLatencyRollup.endpoint, VisitLatencyRollup.latency_bucket, requests
+    ).filter(*_range_filter(VisitLatencyRollup, date_from, date_to)) \
+     .group_by(VisitLatencyRollup.endpoint, VisitLatencyRollup.latency_bucket) \
+     .order_by(VisitLatencyRollup.endpoint, VisitLatencyRollup.latency_bucket).all()
+
+    histograms = defaultdict(list)
+    for endpoint, index, count in rows:
+        histograms[endpoint].append((index, count))
+
+    stats = []
+    for endpoint, histogram in histograms.items():
+        total = sum(count for _, count in histogram)
+        result = {'endpoint': endpoint, 'requests': total}
+        for percentile in percentiles:
+            threshold = total * percentile / 100.0
+            seen = 0
+            for index, count in histogram:
+                seen += count
+                if seen >= threshold:
+                    result['p%d' % percentile] = round(LATENCY_BASE ** index, 1)
+                    break
+        stats.append(result)
+    return sorted(stats, key=lambda item: item['p%d' % percentiles[-1]], reverse=True)
+
+
+# Имена пользователей подтягиваются тем же запросом через LEFT JOIN
+def user_stats(date_from=None, date_to=None):
+    visits = _estimate(VisitUserRollup)
+    return db.session.query(
+        VisitUserRollup.user_id, User.last_name, User.first_name, User.middle_name, visits.label('visits'),
+        func.sum(VisitUserRollup.variance).label('variance')
+    ).outerjoin(User, User.id == VisitUserRollup.user_id) \
+     .filter(*_range_filter(VisitUserRollup, date_from, date_to)) \
+     .group_by(VisitUserRollup.user_id).order_by(visits.desc())
+
+
+# Приблизительное число записей журнала (всего или одного пользователя) по дневным агрегатам
+def approximate_total(user_id=None):
+    query = db.session.query(func.coalesce(func.sum(VisitUserRollup.visits), 0)) \
+        .filter(VisitUserRollup.period == 'day')
+    if user_id is not None:
+        query = query.filter(VisitUserRollup.user_id == user_id)
+    return query.scalar()
+
+
+# Удаление строк агрегатов, счётчики которых обнулились после вычитания (record_visits с weight=-1)
+def prune_empty():
+    db.session.query(VisitPageRollup).filter(VisitPageRollup.visits <= 0).delete()
+    db.session.query(VisitUserRollup).filter(VisitUserRollup.visits <= 0).delete()
+    db.session.query(VisitLatencyRollup).filter(VisitLatencyRollup.requests <= 0).delete()
+
+
+# Перенос посещений пользователей в агрегат анонимных посетителей (одним INSERT ... SELECT)
+def anonymize_users(user_ids):
+    source = (select(VisitUserRollup.period, VisitUserRollup.bucket, literal(ANONYMOUS_USER_ID),
+                     func.sum(VisitUserRollup.visits), func.sum(VisitUserRollup.extra_visits),
+                     func.sum(VisitUserRollup.variance))
+              .where(VisitUserRollup.user_id.in_(user_ids))
+              .group_by(VisitUserRollup.period, VisitUserRollup.bucket))
+    _upsert_select(VisitUserRollup, 'user_id', source)
+    db.session.query(VisitUserRollup).filter(VisitUserRollup.user_id.in_(user_ids)).delete(synchronize_session=False)
+
+
+def clear_rollups():
+    db.session.query(VisitPageRollup).delete()
+    db.session.query(VisitUserRollup).delete()
+    db.session.query(VisitLatencyRollup).delete()
+
+
+# Полный пересчёт агрегатов: по одному INSERT ... SELECT на раздел и период.
+# Один час/день может встретиться в нескольких разделах, поэтому счётчики складываются.
+def rebuild_rollups():
+    clear_rollups()
+    for name in list_partitions():
+        _add_partition(partition_table(name))
+    db.session.commit()
+
+
+# Вычитание раздела из агрегатов перед его удалением (хранение, архивация), в транзакции
+# вызывающего кода: отчёты и approximate_total не должны учитывать удалённые записи
+def subtract_partition(name):
+    _add_partition(partition_table(name), weight=-1)
+    prune_empty()
+
+
+# Счётчики раздела, сгруппированные по корзинам, прибавляются к агрегатам с весом weight
+def _add_partition(table, weight=1):
+    rate = func.coalesce(table.c.sample_rate, 1.0)
+    rows = func.count() * weight
+    extra = func.sum(1.0 / rate - 1) * weight  # См. sample_correction
+    variance = func.sum((1.0 - rate) / (rate * rate)) * weight
+    for period, fmt in PERIOD_FORMATS.items():
+        bucket = func.strftime(fmt, table.c.created_at)
+        user_id = func.coalesce(table.c.user_id, ANONYMOUS_USER_ID)
+        _upsert_select(VisitPageRollup, 'path_id',
+                       select(literal(period), bucket, table.c.path_id, rows, extra, variance)
+                       .where(true()).group_by(bucket, table.c.path_id))
+        _upsert_select(VisitUserRollup, 'user_id',
+                       select(literal(period), bucket, user_id, rows, extra, variance)
+                       .where(true()).group_by(bucket, user_id))
+    _rebuild_latency(table, weight)
+
+
+# Гистограммы времени ответа пересчитываются в Python: логарифм корзины в SQLite
+# доступен не во всех сборках. Строки читаются потоком, память - O(число корзин).
+def _rebuild_latency(table, weight=1):
+    latencies = Counter()
+    rows = db.session.execute(
+        select(table.c.created_at, table.c.endpoint, table.c.duration_ms)
+        .where(table.c.duration_ms.isnot(None))
+        .execution_options(stream_results=True, yield_per=REBUILD_BATCH_ROWS)
+    )
+    for created_at, endpoint, duration_ms in rows:
+        for period in PERIOD_FORMATS:
+            latencies[(period, bucket_key(created_at, period), endpoint or '', latency_bucket(duration_ms))] += weight
+    _upsert_latency(latencies)
+
+
+def _upsert_select(model, key_column, source):
+    stmt = sqlite_insert(model.__table__).from_select(
+        ['period', 'bucket', key_column, 'visits', 'extra_visits', 'variance'], source)
+    stmt = stmt.on_conflict_do_update(index_elements=['period', 'bucket', key_column], set_=_sum_counters(model, stmt))
+    db.session.execute(stmt)
+
+
+# При конфликте ключа счётчики агрегата складываются
+def _sum_counters(model, stmt):
+    table = model.__table__
+    return {name: table.c[name] + stmt.excluded[name] for name in ('visits', 'extra_visits', 'variance')}
+
+
+# Оценка числа посещений с поправкой на выборку (строк журнала + непопавшие), целое
+def _estimate(model):
+    return cast(func.round(func.sum(model.visits + model.extra_visits)), db.Integer)
+
+
+# Заполнение агрегатов при первом запуске на уже накопленном журнале
+def ensure_rollups():
+    if db.session.query(VisitPageRollup.period).first() is None and any(
+            db.session.execute(select(partition_table(name).c.id).limit(1)).first()
+            for name in list_partitions()):
+        rebuild_rollups()
+
+
+@click.command('rebuild-rollups')
+@with_appcontext
+def rebuild_rollups_command():
+    # Пересчёт агрегатов журнала посещений из всех разделов
+    rebuild_rollups()
+    click.echo('Агрегаты журнала посещений пересчитаны.')
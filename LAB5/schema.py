@@ -0,0 +1,69 @@
+# Обновление схемы существующей БД без миграций.
+# - db.create_all() создаёт только отсутствующие таблицы, поэтому индексы и
+#   колонки, добавленные к уже существующим таблицам, создаются здесь отдельно.
+# - Колонки журнала посещений добавляются и в исходную таблицу, и во все разделы.
+# - encode_legacy_paths: однократный перевод журнала со строковой колонки path на
+#   словарь путей (visit_paths): словарь заполняется различными путями таблицы,
+#   path_id/route_id проставляются одним UPDATE, колонка path удаляется. Агрегаты
+#   страниц со строковым ключом пересоздаются и пересчитываются из журнала.
+
+from sqlalchemy import inspect, text
+
+from models import db, VisitLog, VisitPageRollup
+from visit_paths import path_dictionary
+import partitions
+import rollups
+
+LEGACY_PATH_CHUNK_ROWS = 5000  # Различных путей за один вызов словаря
+
+
+def upgrade_schema():
+    for table in db.metadata.sorted_tables:
+        add_missing_columns(table.name, table.columns)
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)  # CREATE INDEX только если его ещё нет
+    for name in partitions.list_partitions(include_legacy=False):
+        add_missing_columns(name, VisitLog.__table__.columns)
+    encode_legacy_paths()
+
+
+def column_names(table_name):
+    return {column['name'] for column in inspect(db.engine).get_columns(table_name)}
+
+
+def encode_legacy_paths():
+    migrated = False
+    for name in partitions.list_partitions():
+        if 'path' not in column_names(name):
+            continue
+        paths = db.session.execute(text('SELECT DISTINCT path FROM "%s"' % name)).scalars().all()
+        for start in range(0, len(paths), LEGACY_PATH_CHUNK_ROWS):
+            path_dictionary.encode([{'path': path} for path in paths[start:start + LEGACY_PATH_CHUNK_ROWS]])
+        lookup = "FROM visit_path WHERE kind = 'path' AND value = substr(\"%s\".path, 1, 255)" % name
+        db.session.execute(text('UPDATE "%s" SET path_id = (SELECT id %s), route_id = (SELECT route_id %s)'
+                                % (name, lookup, lookup)))
+        db.session.execute(text('ALTER TABLE "%s" DROP COLUMN path' % name))
+        db.session.commit()
+        migrated = True
+    if 'path' in column_names(VisitPageRollup.__tablename__):
+        # Первичный ключ не меняется через ALTER TABLE: агрегаты выводимы из журнала
+        VisitPageRollup.__table__.drop(db.engine)
+        VisitPageRollup.__table__.create(db.engine)
+        migrated = True
+    if migrated:
+        rollups.rebuild_rollups()
+
+
+# ALTER TABLE ... ADD COLUMN для колонок модели, которых нет в таблице БД
+def add_missing_columns(table_name, columns):
+    inspector = inspect(db.engine)
+    if not inspector.has_table(table_name):
+        return
+    existing = {column['name'] for column in inspector.get_columns(table_name)}
+    with db.engine.begin() as connection:
+        for column in columns:
+            if column.name not in existing:
+                # Тип, NOT NULL и DEFAULT - как в CREATE TABLE; DEFAULT заполняет существующие строки
+                ddl = db.engine.dialect.ddl_compiler(db.engine.dialect, None)
+                connection.execute(text('ALTER TABLE "%s" ADD COLUMN %s'
+                                        % (table_name, ddl.get_column_specification(column))))
@@ -0,0 +1,192 @@
+# Потоковые оценки посещений в памяти процесса.
+# - SpaceSaving: top-N страниц по числу посещений на k счётчиках.
+#   Оценка счётчика завышена не более чем на error <= N/k (N - всего посещений),
+#   любая страница с долей больше 1/k гарантированно присутствует в таблице.
+# - HyperLogLog: число уникальных посетителей (пользователей или IP) с
+#   относительной стандартной ошибкой 1.04/sqrt(2^p), для p=10 - около 3.3%.
+# - VisitSketches: общий HLL и по HLL на каждую отслеживаемую страницу;
+#   память ограничена k * 2^p байт. Состояние периодически сохраняется в JSON-файл.
+# Оценки локальны для процесса: при нескольких воркерах каждый считает свою долю трафика.
+
+import atexit
+import base64
+import hashlib
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+
+
+class HyperLogLog:
+    def __init__(self, p=10, registers=None):
+        self.p = p
+        self.m = 1 << p
+        self.registers = registers if registers is not None else bytearray(self.m)
+        # Сумма 2^-r и число нулевых регистров ведутся инкрементально: count() - O(1)
+        self._sum = sum(2.0 ** -r for r in self.registers)
+        self._zeros = self.registers.count(0)
+
+    def add(self, value):
+        x = int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big')
+        index = x >> (64 - self.p)
+        rest = x & ((1 << (64 - self.p)) - 1)
+        rank = (64 - self.p) - rest.bit_length() + 1  # Позиция первой единицы
+        old = self.registers[index]
+        if rank > old:
+            self.registers[index] = rank
+            self._sum += 2.0 ** -rank - 2.0 ** -old
+            if old == 0:
+                self._zeros -= 1
+
+    def count(self):
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimate = alpha * self.m * self.m / self._sum
+        if estimate <= 2.5 * self.m and self._zeros:
+            estimate = self.m * math.log(self.m / self._zeros)  # Линейный подсчёт для малых значений
+        return int(round(estimate))
+
+    @property
+    def relative_error(self):
+        return 1.04 / math.sqrt(self.m)
+
+
+class SpaceSaving:
+    def __init__(self, capacity=100):
+        self.capacity = capacity
+        self.counters = {}  # Элемент -> [оценка, максимальная ошибка]
+        self.total = 0
+
+    # Возвращает вытесненный элемент (если был), чтобы освободить связанные с ним данные
+    def add(self, item):
+        self.total += 1
+        counter = self.counters.get(item)
+        if counter is not None:
+            counter[0] += 1
+            return None
+        if len(self.counters) < self.capacity:
+            self.counters[item] = [1, 0]
+            return None
+        evicted = min(self.counters, key=lambda key: self.counters[key][0])
+        minimum = self.counters.pop(evicted)[0]
+        self.counters[item] = [minimum + 1, minimum]
+        return evicted
+
+    def top(self, n):
+        return sorted(self.counters.items(), key=lambda kv: kv[1][0], reverse=True)[:n]
+
+
+class VisitSketches:
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._snapshot_lock = threading.Lock()  # Сохранения по очереди: старый снимок не заменит новый
+        self.app = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('VISIT_SKETCH_CAPACITY', 100)  # Отслеживаемых страниц (k)
+        app.config.setdefault('VISIT_SKETCH_PRECISION', 10)  # p для HyperLogLog
+        app.config.setdefault('VISIT_SKETCH_SNAPSHOT', os.path.join(app.instance_path, 'visit_sketches.json'))
+        app.config.setdefault('VISIT_SKETCH_SNAPSHOT_INTERVAL', 60)  # Период сохранения, сек
+
+        self.app = app
+        self.capacity = app.config['VISIT_SKETCH_CAPACITY']
+        self.precision = app.config['VISIT_SKETCH_PRECISION']
+        self.snapshot_path = app.config['VISIT_SKETCH_SNAPSHOT']
+        self.snapshot_interval = app.config['VISIT_SKETCH_SNAPSHOT_INTERVAL']
+        self.reset()
+        self.load()
+        self._last_snapshot = time.monotonic()
+        app.extensions['visit_sketches'] = self
+        atexit.register(self.snapshot)
+
+    def reset(self):
+        with self._lock:
+            self.pages = SpaceSaving(self.capacity)
+            self.visitors = HyperLogLog(self.precision)
+            self.page_visitors = {}
+
+    # Учёт посещения: path - страница, visitor - ключ посетителя
+    def add(self, path, visitor):
+        with self._lock:
+            evicted = self.pages.add(path)
+            if evicted is not None:
+                self.page_visitors.pop(evicted, None)
+            self.visitors.add(visitor)
+            hll = self.page_visitors.get(path)
+            if hll is None:
+                hll = self.page_visitors[path] = HyperLogLog(self.precision)
+            hll.add(visitor)
+            now = time.monotonic()
+            due = now - self._last_snapshot >= self.snapshot_interval
+            if due:
+                self._last_snapshot = now  # Под блокировкой: поток сохранения запускает один вызов
+        if due:
+            threading.Thread(target=self.snapshot, name='visit-sketch-snapshot', daemon=True).start()
+
+    def summary(self, n=10):
+        with self._lock:
+            top = [{
+                'path': path,
+                'visits': count,
+                'max_error': error,
+                'unique_visitors': self.page_visitors[path].count() if path in self.page_visitors else 0,
+            } for path, (count, error) in self.pages.top(n)]
+            return {
+                'total_visits': self.pages.total,
+                'unique_visitors': self.visitors.count(),
+                'top_pages': top,
+                'error_bounds': {
+                    'visits_max_overestimate': self.pages.total // self.capacity,
+                    'unique_visitors_relative_error': round(self.visitors.relative_error, 4),
+                },
+            }
+
+    def snapshot(self):
+        if self.app is None:
+            return
+        with self._snapshot_lock:
+            with self._lock:
+                state = {
+                    'capacity': self.capacity,
+                    'precision': self.precision,
+                    'total': self.pages.total,
+                    'pages': {path: list(counter) for path, counter in self.pages.counters.items()},
+                    'visitors': base64.b64encode(bytes(self.visitors.registers)).decode(),
+                    'page_visitors': {path: base64.b64encode(bytes(hll.registers)).decode()
+                                      for path, hll in self.page_visitors.items()},
+                }
+            directory = os.path.dirname(self.snapshot_path)
+            os.makedirs(directory, exist_ok=True)
+            # Своё имя временного файла у каждого сохранения: снимки из разных потоков
+            # и воркеров не пишут в один файл
+            with tempfile.NamedTemporaryFile('w', dir=directory, prefix='.visit_sketches.',
+                                             suffix='.tmp', delete=False) as f:
+                json.dump(state, f)
+            try:
+                os.replace(f.name, self.snapshot_path)  # Атомарная замена снимка
+            except OSError:
+                os.unlink(f.name)
+                raise
+
+    def load(self):
+        try:
+            with open(self.snapshot_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+        if state.get('capacity') != self.capacity or state.get('precision') != self.precision:
+            return  # Снимок с другими параметрами несовместим
+        with self._lock:
+            self.pages.total = state['total']
+            self.pages.counters = {path: list(counter) for path, counter in state['pages'].items()}
+            self.visitors = HyperLogLog(self.precision, bytearray(base64.b64decode(state['visitors'])))
+            self.page_visitors = {
+                path: HyperLogLog(self.precision, bytearray(base64.b64decode(registers)))
+                for path, registers in state['page_visitors'].items()
+            }
+
+
+visit_sketches = VisitSketches()
@@ -0,0 +1,130 @@
+# Профили SQLite для разных окружений (APP_ENV: development, production, testing).
+# - PROFILES: PRAGMA, выполняемые при каждом новом подключении (WAL, synchronous,
+#   cache_size, mmap_size, temp_store, busy_timeout), и настройки пула соединений.
+# - configure: выбор профиля до db.init_app - заполняет SQLALCHEMY_ENGINE_OPTIONS;
+#   отдельные PRAGMA можно переопределить словарём SQLITE_PRAGMAS.
+# - install: подписка на событие connect движка.
+# - retry_on_locked: повтор операции с экспоненциальной задержкой и случайным
+#   разбросом при "database is locked" (busy_timeout не помогает, например, если
+#   читающая транзакция пытается стать пишущей). Так пишутся транзакции, которые можно
+#   повторить целиком: сброс буфера журнала, пачки импорта, массовых операций и
+#   обработки журнала удалённых пользователей, само удаление пользователя. Формы с одной
+#   записью через ORM (создание и правка пользователя, роли, пароль) не повторяются:
+#   после rollback изменений в сессии уже нет, поэтому при блокировке дольше
+#   busy_timeout такой запрос завершается ошибкой, и форму нужно отправить снова.
+# - readiness: проверка доступности БД и фактические значения PRAGMA.
+
+import os
+import random
+import time
+
+from sqlalchemy import event, text
+from sqlalchemy.exc import OperationalError
+
+PRAGMA_NAMES = ('journal_mode', 'synchronous', 'cache_size', 'mmap_size', 'temp_store', 'busy_timeout')
+
+PROFILES = {
+    'development': {
+        'pragmas': {
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',
+            'cache_size': -20000,  # Отрицательное значение - в КиБ (~20 МБ)
+            'mmap_size': 0,
+            'temp_store': 'MEMORY',
+            'busy_timeout': 5000,  # мс
+        },
+        'engine_options': {'pool_size': 5, 'max_overflow': 5, 'pool_timeout': 10},
+    },
+    'production': {
+        'pragmas': {
+            'journal_mode': 'WAL',  # Читатели не блокируют писателя
+            'synchronous': 'NORMAL',  # В режиме WAL - без риска повреждения, fsync только на checkpoint
+            'cache_size': -64000,  # ~64 МБ страничного кэша на соединение
+            'mmap_size': 268435456,  # 256 МБ файла БД читаются через отображение в память
+            'temp_store': 'MEMORY',
+            'busy_timeout': 5000,
+        },
+        # Соединения SQLite дешёвые; пул ограничивает число одновременных писателей на воркер
+        'engine_options': {'pool_size': 8, 'max_overflow': 8, 'pool_timeout': 30, 'pool_recycle': 3600},
+    },
+    'testing': {
+        'pragmas': {
+            'journal_mode': 'WAL',
+            'synchronous': 'OFF',
+            'cache_size': -8000,
+            'mmap_size': 0,
+            'temp_store': 'MEMORY',
+            'busy_timeout': 1000,
+        },
+        'engine_options': {'pool_size': 2, 'max_overflow': 2, 'pool_timeout': 5},
+    },
+}
+
+
+def configure(app):
+    app.config.setdefault('APP_ENV', os.environ.get('APP_ENV', 'development'))
+    app.config.setdefault('SQLITE_PRAGMAS', {})  # Переопределение отдельных PRAGMA профиля
+    app.config.setdefault('SQLITE_LOCK_RETRIES', 5)  # Повторов при "database is locked"
+    app.config.setdefault('SQLITE_LOCK_RETRY_DELAY', 0.05)  # Начальная задержка, сек
+
+    env = app.config['APP_ENV']
+    if env not in PROFILES:
+        raise ValueError('Неизвестное окружение APP_ENV: %r' % env)
+    profile = PROFILES[env]
+    pragmas = dict(profile['pragmas'], **app.config['SQLITE_PRAGMAS'])
+    app.config['SQLITE_EFFECTIVE_PRAGMAS'] = pragmas
+
+    options = dict(profile['engine_options'])
+    # Ожидание блокировки на уровне драйвера совпадает с busy_timeout
+    options['connect_args'] = {'timeout': pragmas['busy_timeout'] / 1000, 'check_same_thread': False}
+    options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+
+def install(engine, pragmas):
+    if engine.dialect.name != 'sqlite' or getattr(engine, 'sqlite_pragmas', None) is not None:
+        return
+
+    def apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name in PRAGMA_NAMES:
+                if name in pragmas:
+                    cursor.execute('PRAGMA %s = %s' % (name, pragmas[name]))
+        finally:
+            cursor.close()
+
+    event.listen(engine, 'connect', apply_pragmas)
+    engine.sqlite_pragmas = pragmas
+
+
+def is_locked_error(error):
+    return isinstance(error, OperationalError) and 'database is locked' in str(error.orig)
+
+
+# Вызов func с повторами при блокировке БД; rollback вызывается перед каждым повтором
+def retry_on_locked(func, retries=5, delay=0.05, rollback=None):
+    for attempt in range(retries + 1):
+        try:
+            return func()
+        except OperationalError as e:
+            if not is_locked_error(e) or attempt == retries:
+                raise
+            if rollback is not None:
+                rollback()
+            # Экспоненциальная задержка со случайным разбросом, чтобы воркеры не повторяли синхронно
+            time.sleep(random.uniform(0, delay * 2 ** attempt))
+
+
+# Готовность БД: SELECT 1 и фактические PRAGMA соединения из пула
+def readiness(engine):
+    started = time.perf_counter()
+    with engine.connect() as connection:
+        connection.execute(text('SELECT 1'))
+        pragmas = {name: connection.execute(text('PRAGMA %s' % name)).scalar() for name in PRAGMA_NAMES}
+    return {
+        'database': 'ok',
+        'latency_ms': round((time.perf_counter() - started) * 1000, 2),
+        'pragmas': pragmas,
+        'pool': engine.pool.status(),
+    }
@@ -0,0 +1,63 @@
+# Бюджеты SQL-запросов (QUERY_BUDGETS в create_app) на заполненной временной БД:
+# данные - тот же детерминированный набор, что у benchmark.py seed, только меньше;
+# каждая страница с бюджетом запрашивается администратором через
+# request_timing.assert_query_budget, который падает и при превышении бюджета,
+# и при повторяющихся запросах (N+1).
+# Запуск из каталога LAB5: python -m pytest tests
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark  # noqa: E402
+
+VISITS = 2000
+USERS = 50
+
+# Страница для каждого endpoint из QUERY_BUDGETS; {user_id} - администратор замеров
+PAGES = {
+    'index': '/?q=пользователь',
+    'suggest_users': '/users/suggest?q=bench1',
+    'view_user': '/user/{user_id}',
+    'edit_user': '/user/{user_id}/edit',
+    'manage_roles': '/roles',
+    'visit_logs.index': '/visit_logs/',
+    'visit_logs.by_pages': '/visit_logs/by_pages',
+    'visit_logs.by_users': '/visit_logs/by_users',
+    'visit_logs.latency': '/visit_logs/latency',
+}
+
+
+@pytest.fixture(scope='module')
+def app(tmp_path_factory):
+    database = str(tmp_path_factory.mktemp('db') / 'app.db')
+    app = benchmark.bench_app(database, 'testing')
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    benchmark.seed_database(app, VISITS, USERS, seed=42, months=2)
+    with app.app_context():
+        from models import User
+        app.config['TEST_USER_ID'] = User.query.filter_by(username=benchmark.BENCH_ADMIN['username']).one().id
+    yield app
+
+
+@pytest.fixture
+def client(app):
+    client = app.test_client()
+    client.post('/login', data=benchmark.BENCH_FORMS['/login'])
+    return client
+
+
+def test_every_budget_has_a_page(app):
+    assert set(app.config['QUERY_BUDGETS']) == set(PAGES)
+
+
+@pytest.mark.parametrize('endpoint', sorted(PAGES))
+def test_query_budget(app, client, endpoint):
+    from web_common.request_timing import assert_query_budget
+
+    path = PAGES[endpoint].format(user_id=app.config['TEST_USER_ID'])
+    response = assert_query_budget(client, path)
+    assert response.status_code == 200
@@ -0,0 +1,132 @@
+# Массовые операции администратора над пользователями и ролями.
+# - move_role: перевод всех пользователей одной роли в другую (в т.ч. перед удалением роли);
+#   delete_users: удаление выбранных пользователей, журнал - по политике USER_DELETE_LOG_POLICY;
+#   set_active: включение и отключение выбранных пользователей;
+#   deactivate_inactive: отключение пользователей без посещений с заданной даты. Последнее
+#   посещение - последний день в дневных агрегатах visit_user_rollup (покрывающий индекс),
+#   у пользователей без посещений - дата регистрации.
+# - Операция выполняется пачками по USER_BULK_CHUNK_ROWS пользователей: выборка id и один
+#   UPDATE/DELETE ... WHERE id IN (...) в своей короткой транзакции (с повтором при
+#   блокировке SQLite). По id пачки сбрасываются записи identity_cache.
+# - Операции - генераторы: после каждой пачки отдаётся запись о ходе выполнения, маршрут
+#   /users/bulk передаёт их потоком JSONL. Прерванное удаление оставляет журнал удалённых
+#   пользователей необработанным - его завершает flask users purge-logs --orphans.
+
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import func, select
+
+from web_common.identity_cache import identity_cache
+from models import db, User, VisitUserRollup
+from roles import role_cache
+from sqlite_profile import retry_on_locked
+from user_deletion import purge_logs, LOG_POLICIES
+from visit_buffer import visit_buffer
+
+BULK_CHUNK_ROWS = 1000  # Пользователей в одной транзакции, если не задан USER_BULK_CHUNK_ROWS
+
+users = User.__table__
+
+
+def _chunk_rows():
+    return current_app.config.get('USER_BULK_CHUNK_ROWS', BULK_CHUNK_ROWS)
+
+
+# Пачки id выбранных пользователей
+def _list_batches(user_ids, chunk_rows):
+    for start in range(0, len(user_ids), chunk_rows):
+        yield user_ids[start:start + chunk_rows]
+
+
+# Пачки id по условию; запрос повторяется после каждой пачки, поэтому изменение пачки
+# должно выводить её строки из условия (иначе выборка не продвинется)
+def _query_batches(ids_query, chunk_rows):
+    while True:
+        ids = db.session.execute(ids_query.limit(chunk_rows)).scalars().all()
+        if ids:
+            yield ids
+        if len(ids) < chunk_rows:
+            return
+
+
+# Выполнение операции по пачкам: statement(ids) - UPDATE/DELETE пачки,
+# after(ids) - дополнительная обработка после фиксации (возвращает число, например строк журнала)
+def _run(operation, batches, total, statement, after=None):
+    config = current_app.config
+    processed = extra = 0
+
+    def record(status):
+        result = {'status': status, 'operation': operation, 'processed': processed, 'total': total}
+        if after is not None:
+            result['log_rows'] = extra
+        return result
+
+    yield record('progress')
+    for ids in batches:
+        def chunk():
+            db.session.execute(statement(ids))
+            db.session.commit()
+        retry_on_locked(chunk, config.get('SQLITE_LOCK_RETRIES', 0), config.get('SQLITE_LOCK_RETRY_DELAY', 0.05),
+                        rollback=db.session.rollback)
+        identity_cache.invalidate_many(ids)
+        if after is not None:
+            extra += after(ids)
+        processed += len(ids)
+        yield record('progress')
+    yield record('done')
+
+
+def _count(condition):
+    return db.session.execute(select(func.count()).select_from(users).where(condition)).scalar()
+
+
+def move_role(from_role_id, to_role_id):
+    if role_cache.role_name(from_role_id) is None or role_cache.role_name(to_role_id) is None:
+        raise ValueError('Роль не найдена.')
+    if from_role_id == to_role_id:
+        raise ValueError('Исходная и новая роль совпадают.')
+    condition = users.c.role_id == from_role_id
+    return _run('move_role', _query_batches(select(users.c.id).where(condition), _chunk_rows()),
+                _count(condition),
+                lambda ids: users.update().where(users.c.id.in_(ids)).values(role_id=to_role_id))
+
+
+# exclude_id - текущий администратор: себя удалить или отключить нельзя
+def delete_users(user_ids, policy=None, exclude_id=None):
+    deletion = current_app.extensions['user_deletion']
+    policy = policy or deletion.policy
+    if policy not in LOG_POLICIES:
+        raise ValueError('Неизвестная политика журнала: %r' % policy)
+    user_ids = sorted(set(user_ids) - {exclude_id})
+    # Записи удаляемых пользователей, ещё ждущие в буфере, должны попасть в разделы
+    if visit_buffer.enabled:
+        visit_buffer.flush()
+    return _run('delete', _list_batches(user_ids, _chunk_rows()), len(user_ids),
+                lambda ids: users.delete().where(users.c.id.in_(ids)),
+                lambda ids: purge_logs(ids, policy, deletion.chunk_rows))
+
+
+def set_active(user_ids, active, exclude_id=None):
+    user_ids = sorted(set(user_ids) - {exclude_id})
+    return _run('activate' if active else 'deactivate', _list_batches(user_ids, _chunk_rows()), len(user_ids),
+                lambda ids: users.update().where(users.c.id.in_(ids)).values(active=active))
+
+
+# Отключение пользователей, не заходивших с даты since (datetime или date)
+def deactivate_inactive(since, exclude_id=None):
+    if visit_buffer.enabled:
+        visit_buffer.flush()  # Последние посещения - в агрегатах
+    last_visit = (select(func.max(VisitUserRollup.bucket))
+                  .where(VisitUserRollup.period == 'day', VisitUserRollup.user_id == users.c.id)
+                  .scalar_subquery())
+    condition = (users.c.active.is_(True)) & (users.c.id != (exclude_id or 0)) & (
+        func.coalesce(last_visit, func.strftime('%Y-%m-%d', users.c.created_at)) < since.strftime('%Y-%m-%d'))
+    return _run('deactivate_inactive', _query_batches(select(users.c.id).where(condition), _chunk_rows()),
+                _count(condition),
+                lambda ids: users.update().where(users.c.id.in_(ids)).values(active=False))
+
+
+# Дата из формы (ГГГГ-ММ-ДД); ValueError при неверном формате
+def parse_date(value):
+    return datetime.strptime((value or '').strip(), '%Y-%m-%d')
@@ -0,0 +1,208 @@
+# Удаление пользователей без загрузки их журнала посещений в память.
+# - Запись user удаляется сразу (вход и сессии перестают работать), журнал
+#   обрабатывается отдельно по политике USER_DELETE_LOG_POLICY:
+#   anonymize - записи остаются, user_id обнуляется (статистика страниц не меняется,
+#   посещения пользователя переходят в агрегат анонимных посетителей);
+#   remove - записи удаляются и вычитаются из всех агрегатов.
+# - Журнал обрабатывается пачками по USER_DELETE_CHUNK_ROWS строк во всех разделах
+#   (UPDATE/DELETE ... WHERE id IN (SELECT id ... LIMIT n)), каждая пачка - своя
+#   короткая транзакция, поэтому запись журнала другими запросами не блокируется надолго.
+# - Если у пользователя больше USER_DELETE_SYNC_LIMIT записей (по дневным агрегатам),
+#   журнал обрабатывается в фоновом потоке; ход выполнения - в jobs().
+# - Обработка идемпотентна: прерванное удаление можно завершить командой
+#   flask users purge-logs (в т.ч. --orphans для всех уже удалённых пользователей).
+# - purge_logs принимает набор пользователей: массовое удаление (user_bulk) обрабатывает
+#   журнал пачки пользователей теми же запросами с user_id IN (...).
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import select
+
+import rollups
+from web_common.identity_cache import identity_cache
+from models import db, User, VisitUserRollup
+from partitions import list_partitions, partition_table
+from sqlite_profile import retry_on_locked
+from visit_buffer import visit_buffer
+
+LOG_POLICIES = ('anonymize', 'remove')
+JOBS_HISTORY = 50  # Завершённых фоновых удалений в jobs()
+
+
+class UserDeletion:
+    def __init__(self, app=None):
+        self.app = None
+        self._lock = threading.Lock()
+        self._executor = None
+        self._jobs = {}  # user_id -> состояние обработки журнала
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('USER_DELETE_LOG_POLICY', 'anonymize')  # anonymize или remove
+        app.config.setdefault('USER_DELETE_CHUNK_ROWS', 5000)  # Строк журнала в одной транзакции
+        app.config.setdefault('USER_DELETE_SYNC_LIMIT', 10000)  # Больше записей - обработка в фоне
+
+        if app.config['USER_DELETE_LOG_POLICY'] not in LOG_POLICIES:
+            raise ValueError('Неизвестная политика USER_DELETE_LOG_POLICY: %r'
+                             % app.config['USER_DELETE_LOG_POLICY'])
+        self.app = app
+        self.policy = app.config['USER_DELETE_LOG_POLICY']
+        self.chunk_rows = app.config['USER_DELETE_CHUNK_ROWS']
+        self.sync_limit = app.config['USER_DELETE_SYNC_LIMIT']
+        app.extensions['user_deletion'] = self
+
+    # Удаление пользователя; возвращает True, если журнал обрабатывается в фоне
+    def delete(self, user_id, policy=None):
+        policy = policy or self.policy
+        if policy not in LOG_POLICIES:
+            raise ValueError('Неизвестная политика журнала: %r' % policy)
+        # Записи этого пользователя, ещё ждущие в буфере, должны попасть в разделы до обработки
+        if visit_buffer.enabled:
+            visit_buffer.flush()
+        logs = rollups.approximate_total(user_id)
+
+        def delete_user():
+            db.session.execute(User.__table__.delete().where(User.__table__.c.id == user_id))
+            db.session.commit()
+
+        config = self.app.config
+        retry_on_locked(delete_user, config.get('SQLITE_LOCK_RETRIES', 0),
+                        config.get('SQLITE_LOCK_RETRY_DELAY', 0.05), rollback=db.session.rollback)
+        identity_cache.invalidate(user_id)
+
+        if logs <= self.sync_limit:
+            purge_logs([user_id], policy, self.chunk_rows)
+            return False
+        self._start(user_id, policy, logs)
+        return True
+
+    def _start(self, user_id, policy, logs):
+        job = {'user_id': user_id, 'policy': policy, 'estimated': logs, 'processed': 0,
+               'status': 'running', 'started_at': datetime.utcnow().isoformat(timespec='seconds')}
+        with self._lock:
+            self._jobs[user_id] = job
+            if self._executor is None:
+                # Один поток: пишущие транзакции SQLite всё равно выполняются по очереди
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='user-deletion')
+        self._executor.submit(self._run, job)
+
+    def _run(self, job):
+        def progress(rows):
+            job['processed'] += rows
+
+        with self.app.app_context():
+            try:
+                purge_logs([job['user_id']], job['policy'], self.chunk_rows, progress)
+                job['status'] = 'done'
+            except Exception:
+                db.session.rollback()
+                job['status'] = 'failed'
+                self.app.logger.exception('Ошибка обработки журнала удалённого пользователя %s', job['user_id'])
+            finally:
+                job['finished_at'] = datetime.utcnow().isoformat(timespec='seconds')
+                self._trim()
+
+    def _trim(self):
+        with self._lock:
+            finished = [key for key, job in self._jobs.items() if job['status'] != 'running']
+            for key in finished[:max(0, len(finished) - JOBS_HISTORY)]:
+                del self._jobs[key]
+
+    def jobs(self):
+        with self._lock:
+            return [dict(job) for job in self._jobs.values()]
+
+
+def _chunk(table, user_ids, policy, chunk_rows):
+    ids = select(table.c.id).where(table.c.user_id.in_(user_ids)).limit(chunk_rows)
+    if policy == 'anonymize':
+        result = db.session.execute(
+            table.update().where(table.c.id.in_(ids.scalar_subquery())).values(user_id=None))
+        rows = result.rowcount
+    else:
+        # Удаляемые записи вычитаются из агрегатов в той же транзакции
+        entries = [dict(row._mapping) for row in db.session.execute(
+            select(table.c.id, table.c.path_id, table.c.user_id, table.c.created_at,
+                   table.c.endpoint, table.c.duration_ms, table.c.sample_rate)
+            .where(table.c.user_id.in_(user_ids)).limit(chunk_rows))]
+        rows = len(entries)
+        if entries:
+            rollups.record_visits(entries, weight=-1)
+            db.session.execute(table.delete().where(table.c.id.in_([entry['id'] for entry in entries])))
+    db.session.commit()
+    return rows
+
+
+# Обработка журнала пользователей во всех разделах пачками; возвращает число строк
+def purge_logs(user_ids, policy, chunk_rows, progress=None):
+    config = current_app.config
+    total = 0
+    for name in list_partitions():
+        table = partition_table(name)
+        while True:
+            rows = retry_on_locked(lambda: _chunk(table, user_ids, policy, chunk_rows),
+                                   config.get('SQLITE_LOCK_RETRIES', 0),
+                                   config.get('SQLITE_LOCK_RETRY_DELAY', 0.05),
+                                   rollback=db.session.rollback)
+            total += rows
+            if progress is not None:
+                progress(rows)
+            if rows < chunk_rows:
+                break
+            time.sleep(0)  # Уступаем GIL обработчикам запросов между пачками
+
+    def finish():
+        if policy == 'anonymize':
+            rollups.anonymize_users(user_ids)
+        else:
+            rollups.prune_empty()
+            db.session.query(VisitUserRollup).filter(VisitUserRollup.user_id.in_(user_ids)).delete(synchronize_session=False)
+        db.session.commit()
+
+    retry_on_locked(finish, config.get('SQLITE_LOCK_RETRIES', 0), config.get('SQLITE_LOCK_RETRY_DELAY', 0.05),
+                    rollback=db.session.rollback)
+    return total
+
+
+# Пользователи, которых нет в таблице user, но чьи записи остались в журнале
+def orphan_user_ids():
+    ids = set()
+    existing = select(User.__table__.c.id)
+    for name in list_partitions():
+        table = partition_table(name)
+        ids.update(db.session.execute(
+            select(table.c.user_id).distinct()
+            .where(table.c.user_id.isnot(None), table.c.user_id.notin_(existing))).scalars())
+    return sorted(ids)
+
+
+@click.command('purge-logs')
+@click.argument('user_ids', nargs=-1, type=int)
+@click.option('--orphans', is_flag=True, help='Все пользователи, удалённые без обработки журнала.')
+@click.option('--policy', type=click.Choice(LOG_POLICIES), default=None,
+              help='По умолчанию - USER_DELETE_LOG_POLICY.')
+@with_appcontext
+def purge_logs_command(user_ids, orphans, policy):
+    """Обработка журнала посещений удалённых пользователей."""
+    deletion = current_app.extensions['user_deletion']
+    if not user_ids and not orphans:
+        raise click.UsageError('Укажите USER_IDS или --orphans.')
+    user_ids = list(user_ids) + (orphan_user_ids() if orphans else [])
+    if not user_ids:
+        click.echo('Записей журнала удалённых пользователей нет.')
+    for user_id in user_ids:
+        if db.session.get(User, user_id) is not None:
+            click.echo('Пользователь %d существует - пропущен.' % user_id, err=True)
+            continue
+        rows = purge_logs([user_id], policy or deletion.policy, deletion.chunk_rows)
+        click.echo('Пользователь %d: обработано записей журнала: %d.' % (user_id, rows))
+
+
+user_deletion = UserDeletion()
@@ -0,0 +1,219 @@
+# Массовый импорт и экспорт пользователей (CSV или JSONL).
+# - read_records: потоковое чтение входного файла, записи нумеруются по строкам.
+# - import_users: проверка каждой строки правилами UserForm, хеширование паролей и
+#   вставка пачками по IMPORT_CHUNK_ROWS строк, каждая пачка - своя транзакция. Для
+#   каждой строки выдаётся результат (created / error с описанием).
+# - Пароль строки - password (открытый) или password_hash (готовый хеш werkzeug, как в
+#   bootstrap.seed_users). Открытые пароли хешируются в отдельном пуле с низким
+#   приоритетом (bulk_password_hasher), а не в пуле проверки паролей при входе. Скорость
+#   ограничена KDF: scrypt ~130 мс на пароль, т.е. ~8 строк в секунду на процесс пула
+#   (PASSWORD_BULK_HASH_WORKERS); 100 тыс. строк с открытыми паролями - несколько часов.
+#   Строки с password_hash вставляются со скоростью БД: тысячи строк в секунду.
+# - export_query / export_row: выгрузка в том же формате, что принимает импорт
+#   (роль - по названию); пароли не выгружаются.
+# - flask users import|export: те же операции из командной строки.
+
+import csv
+import json
+import re
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy.dialects.sqlite import insert
+from werkzeug.datastructures import MultiDict
+
+from forms import UserForm
+from models import db, Role, User
+from web_common.passwords import bulk_password_hasher
+from roles import role_cache
+from sqlite_profile import retry_on_locked
+
+IMPORT_CHUNK_ROWS = 500  # Строк в одной транзакции
+EXPORT_CHUNK_ROWS = 500
+IMPORT_FIELDS = ['username', 'password', 'password_hash', 'last_name', 'first_name', 'middle_name', 'role']
+# Хеш werkzeug: "метод:параметры$соль$хеш"
+PASSWORD_HASH_RE = re.compile(r'^(scrypt|pbkdf2):[\w:]+\$[^$]+\$[0-9a-f]+$')
+EXPORT_FIELDS = ['username', 'last_name', 'first_name', 'middle_name', 'role', 'created_at']
+
+
+# Формат по явному параметру или расширению имени файла
+def detect_format(fmt=None, filename=None):
+    if fmt in ('csv', 'jsonl'):
+        return fmt
+    if filename and filename.lower().endswith(('.jsonl', '.ndjson', '.json')):
+        return 'jsonl'
+    return 'csv'
+
+
+# (номер строки, запись или None, ошибка разбора) для текстового потока
+def read_records(stream, fmt):
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row, None
+        return
+    for number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield number, None, 'Некорректный JSON: %s' % e
+            continue
+        if not isinstance(row, dict):
+            yield number, None, 'Ожидается JSON-объект.'
+            continue
+        yield number, row, None
+
+
+# Проверка строки теми же правилами, что и форма создания пользователя.
+# Результат - форма, ошибки и готовый хеш пароля (None - пароль нужно хешировать)
+def validate_record(row, role_ids):
+    role = (row.get('role') or '').strip()
+    password = row.get('password') or ''
+    password_hash = (row.get('password_hash') or '').strip() or None
+    data = MultiDict({
+        'username': row.get('username') or '',
+        'password': password,
+        'confirm_password': password,
+        'last_name': row.get('last_name') or '',
+        'first_name': row.get('first_name') or '',
+        'middle_name': row.get('middle_name') or '',
+        'role_id': str(role_ids.get(role, '')),
+    })
+    form = UserForm(formdata=data, meta={'csrf': False})
+    form.role_id.choices = role_cache.choices()
+    form.validate()
+    errors = {name: list(messages) for name, messages in form.errors.items() if name != 'confirm_password'}
+    if password_hash is not None:
+        # Правила открытого пароля к готовому хешу неприменимы
+        errors.pop('password', None)
+        if password:
+            errors['password'] = ['Укажите либо password, либо password_hash.']
+        elif not PASSWORD_HASH_RE.match(password_hash):
+            errors['password_hash'] = ['Ожидается хеш werkzeug (scrypt или pbkdf2).']
+    if role and role not in role_ids:
+        errors['role_id'] = ['Роль "%s" не найдена.' % role]
+    return form, errors, password_hash
+
+
+def _insert_chunk(pending):
+    # Открытые пароли пачки хешируются в пуле массового импорта, готовые хеши - как есть
+    hashed = iter(bulk_password_hasher.hash_many(
+        [form.password.data for _, form, password_hash in pending if password_hash is None]))
+    rows = [{
+        'username': form.username.data,
+        'password_hash': password_hash or next(hashed),
+        'last_name': form.last_name.data,
+        'first_name': form.first_name.data,
+        'middle_name': form.middle_name.data,
+        'role_id': form.role_id.data,
+    } for _, form, password_hash in pending]
+    stmt = (insert(User.__table__).on_conflict_do_nothing(index_elements=['username'])
+            .returning(User.__table__.c.username))
+
+    def write():
+        created = {username for username, in db.session.execute(stmt, rows)}
+        db.session.commit()
+        return created
+
+    # Хеши уже посчитаны: при блокировке БД повторяется только INSERT пачки
+    config = current_app.config
+    created = retry_on_locked(write, config.get('SQLITE_LOCK_RETRIES', 0),
+                              config.get('SQLITE_LOCK_RETRY_DELAY', 0.05), rollback=db.session.rollback)
+    for number, form, _ in pending:
+        if form.username.data in created:
+            yield {'line': number, 'username': form.username.data, 'status': 'created'}
+        else:
+            yield {'line': number, 'username': form.username.data, 'status': 'error',
+                   'errors': {'username': ['Пользователь с таким логином уже существует.']}}
+
+
+# Импорт записей; результат - по одной записи отчёта на каждую входную строку
+def import_users(records, chunk_rows=IMPORT_CHUNK_ROWS):
+    role_ids = {name: role_id for role_id, name in role_cache.choices()}
+    seen = set()  # Логины, уже встреченные в файле
+    pending = []
+
+    def flush():
+        names = [form.username.data for _, form, _ in pending]
+        existing = {name for name, in db.session.query(User.username).filter(User.username.in_(names))}
+        accepted = []
+        for number, form, password_hash in pending:
+            if form.username.data in existing:
+                yield {'line': number, 'username': form.username.data, 'status': 'error',
+                       'errors': {'username': ['Пользователь с таким логином уже существует.']}}
+            else:
+                accepted.append((number, form, password_hash))
+        if accepted:
+            yield from _insert_chunk(accepted)
+        pending.clear()
+
+    for number, row, parse_error in records:
+        if parse_error:
+            yield {'line': number, 'status': 'error', 'errors': {'row': [parse_error]}}
+            continue
+        form, errors, password_hash = validate_record(row, role_ids)
+        username = form.username.data
+        if not errors and username in seen:
+            errors = {'username': ['Логин повторяется в файле.']}
+        if errors:
+            yield {'line': number, 'username': username, 'status': 'error', 'errors': errors}
+            continue
+        seen.add(username)
+        pending.append((number, form, password_hash))
+        if len(pending) >= chunk_rows:
+            yield from flush()
+    if pending:
+        yield from flush()
+
+
+def export_query():
+    return (db.session.query(User.username, User.last_name, User.first_name, User.middle_name,
+                             Role.name, User.created_at)
+            .outerjoin(Role, Role.id == User.role_id)
+            .order_by(User.id))
+
+
+def export_row(row):
+    return [row.username, row.last_name or '', row.first_name, row.middle_name or '',
+            row.name or '', row.created_at.isoformat(sep=' ') if row.created_at else '']
+
+
+users_cli = AppGroup('users', help='Массовый импорт и экспорт пользователей.')
+
+
+@users_cli.command('import')
+@click.argument('source', type=click.File('r', encoding='utf-8-sig'))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='По умолчанию - по расширению файла.')
+@click.option('--report', type=click.File('w', encoding='utf-8'), help='Файл отчёта JSONL по каждой строке.')
+def import_command(source, fmt, report):
+    fmt = detect_format(fmt, source.name)
+    created = failed = 0
+    for result in import_users(read_records(source, fmt)):
+        if result['status'] == 'created':
+            created += 1
+        else:
+            failed += 1
+            click.echo('Строка %d: %s' % (result['line'], json.dumps(result['errors'], ensure_ascii=False)),
+                       err=True)
+        if report:
+            report.write(json.dumps(result, ensure_ascii=False) + '\n')
+    click.echo('Создано пользователей: %d, строк с ошибками: %d.' % (created, failed))
+
+
+@users_cli.command('export')
+@click.argument('target', type=click.File('w', encoding='utf-8', lazy=True), default='-')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='По умолчанию - по расширению файла.')
+def export_command(target, fmt):
+    fmt = detect_format(fmt, getattr(target, 'name', None))
+    writer = csv.writer(target)
+    if fmt == 'csv':
+        writer.writerow(EXPORT_FIELDS)
+    for row in export_query().yield_per(EXPORT_CHUNK_ROWS):
+        values = export_row(row)
+        if fmt == 'csv':
+            writer.writerow(values)
+        else:
+            target.write(json.dumps(dict(zip(EXPORT_FIELDS, values)), ensure_ascii=False) + '\n')
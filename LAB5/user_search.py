@@ -0,0 +1,53 @@
+# Поиск пользователей для справочника на главной странице.
+# - Индекс FTS5 user_fts, триггеры и выражения MATCH - общие с lb4 (web_common.user_search):
+#   префиксный поиск по логину и ФИО, все слова запроса должны встретиться.
+# - Анонимный поиск (columns=NAME_COLUMNS) ищет только по ФИО: по совпадению с
+#   префиксом логина можно было бы перебрать логины пользователей.
+# - fetch_users: выборка для KeysetPagination по (created_at, id) с ролью в том же запросе.
+# - suggest: лучшие совпадения по рангу bm25 для автодополнения (только для вошедших).
+
+from sqlalchemy import select, tuple_
+from sqlalchemy.orm import joinedload
+
+from models import db, User
+from web_common import user_search
+from web_common.user_search import NAME_COLUMNS, match_expression, matching_ids, ranked_matches  # noqa: F401
+
+SUGGEST_LIMIT = 10  # Подсказок в ответе по умолчанию
+
+
+# Создание индекса и триггеров (flask bootstrap)
+def ensure_user_search():
+    user_search.ensure_user_search(db.session)
+
+
+# Страница справочника для KeysetPagination (новые пользователи первыми)
+def fetch_users(direction, position, limit, q=None, columns=None):
+    query = select(User).options(joinedload(User.role))
+    match = match_expression(q, columns)
+    if match:
+        query = query.where(User.id.in_(matching_ids(match)))
+    key = tuple_(User.created_at, User.id)
+    if direction == 'prev':
+        query = query.where(key > tuple_(*position)).order_by(User.created_at.asc(), User.id.asc())
+    else:
+        if position is not None:
+            query = query.where(key < tuple_(*position))
+        query = query.order_by(User.created_at.desc(), User.id.desc())
+    return db.session.execute(query.limit(limit)).scalars().all()
+
+
+# Подсказки для автодополнения: лучшие совпадения по рангу
+def suggest(q, limit=SUGGEST_LIMIT):
+    match = match_expression(q)
+    if not match:
+        return []
+    ranked = ranked_matches(match, limit)
+    query = (select(User).options(joinedload(User.role))
+             .join(ranked, ranked.c.id == User.id).order_by(ranked.c.rank))
+    return [{
+        'id': user.id,
+        'username': user.username,
+        'full_name': user.full_name,
+        'role': user.role.name if user.role else None,
+    } for user in db.session.execute(query).scalars()]
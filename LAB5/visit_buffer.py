@@ -0,0 +1,190 @@
+# Буферизованная запись журнала посещений.
+# - VisitLogBuffer: ограниченная очередь записей о посещениях, которую фоновый
+#   поток сбрасывает в БД пакетными INSERT по размеру пакета или по таймеру.
+# - Политика переполнения очереди: block (ждать), drop (отбросить), sample (выборка).
+# - Счётчики queued / flushed / dropped доступны через stats().
+# - Обработчики on_flush вызываются с каждым пакетом в той же транзакции, что и INSERT.
+
+import atexit
+import queue
+import random
+import threading
+
+from models import db
+from partitions import insert_entries
+from sqlite_profile import retry_on_locked
+
+BACKPRESSURE_POLICIES = ('block', 'drop', 'sample')
+
+
+class VisitLogBuffer:
+    def __init__(self, app=None):
+        self.app = None
+        self._queue = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()  # Досрочный сброс при наборе пакета
+        self._thread_lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # Один сброс в БД одновременно
+        self._stats_lock = threading.Lock()
+        self._listeners = []  # Обработчики пакета, см. on_flush
+        self._atexit_registered = False
+        self.queued = 0  # Принято в очередь
+        self.flushed = 0  # Записано в БД
+        self.dropped = 0  # Отброшено из-за переполнения или выборки
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # Значения по умолчанию для настроек буфера
+        app.config.setdefault('VISIT_LOG_BUFFER_ENABLED', True)
+        app.config.setdefault('VISIT_LOG_QUEUE_SIZE', 10000)  # Максимальный размер очереди
+        app.config.setdefault('VISIT_LOG_BATCH_SIZE', 500)  # Размер пакета INSERT
+        app.config.setdefault('VISIT_LOG_FLUSH_INTERVAL', 1.0)  # Период сброса, сек
+        app.config.setdefault('VISIT_LOG_BACKPRESSURE', 'drop')
+        app.config.setdefault('VISIT_LOG_BLOCK_TIMEOUT', 0.05)  # Ожидание места в очереди, сек
+        app.config.setdefault('VISIT_LOG_SAMPLE_RATE', 0.1)  # Доля записей, сохраняемых при заполнении
+        app.config.setdefault('VISIT_LOG_SAMPLE_WATERMARK', 0.5)  # Заполненность, с которой включается выборка
+
+        if app.config['VISIT_LOG_BACKPRESSURE'] not in BACKPRESSURE_POLICIES:
+            raise ValueError('Неизвестная политика VISIT_LOG_BACKPRESSURE: %r'
+                             % app.config['VISIT_LOG_BACKPRESSURE'])
+
+        self.app = app
+        self.enabled = app.config['VISIT_LOG_BUFFER_ENABLED']
+        self.batch_size = app.config['VISIT_LOG_BATCH_SIZE']
+        self.flush_interval = app.config['VISIT_LOG_FLUSH_INTERVAL']
+        self.policy = app.config['VISIT_LOG_BACKPRESSURE']
+        self.block_timeout = app.config['VISIT_LOG_BLOCK_TIMEOUT']
+        self.sample_rate = app.config['VISIT_LOG_SAMPLE_RATE']
+        self.sample_watermark = app.config['VISIT_LOG_SAMPLE_WATERMARK']
+        self._queue = queue.Queue(maxsize=app.config['VISIT_LOG_QUEUE_SIZE'])
+        app.extensions['visit_log_buffer'] = self
+        if not self._atexit_registered:
+            # Один раз на буфер, сколько бы приложений ни вызвало init_app (тесты, benchmark)
+            atexit.register(self.close)  # Сброс оставшихся записей при остановке процесса
+            self._atexit_registered = True
+
+    # Добавление записи о посещении; возвращает False, если запись отброшена
+    def put(self, entry):
+        if not self.enabled:
+            self._count(queued=1)
+            self._write([entry])  # Буфер выключен - пишем синхронно
+            return True
+
+        self._ensure_thread()
+        try:
+            if self.policy == 'block':
+                self._queue.put(entry, timeout=self.block_timeout)
+            else:
+                if self.policy == 'sample' and self._above_watermark():
+                    if random.random() >= self.sample_rate:
+                        self._count(dropped=1)
+                        return False
+                    # Сохранённая запись представляет 1/sample_rate посещений (см. visit_rules)
+                    entry['sample_rate'] = (entry.get('sample_rate') or 1.0) * self.sample_rate
+                self._queue.put_nowait(entry)
+        except queue.Full:
+            self._count(dropped=1)
+            return False
+
+        self._count(queued=1)
+        if self._queue.qsize() >= self.batch_size:
+            self._wakeup.set()  # Пакет набран - сбрасываем, не дожидаясь таймера
+        return True
+
+    # Регистрация обработчика пакета записей: func(batch)
+    def on_flush(self, func):
+        self._listeners.append(func)
+        return func
+
+    # Синхронный сброс всех накопленных записей; возвращает число записанных
+    def flush(self):
+        total = 0
+        with self._flush_lock:
+            while True:
+                batch = self._drain(self.batch_size)
+                if not batch:
+                    break
+                self._write(batch)
+                total += len(batch)
+        return total
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'queued': self.queued,
+                'flushed': self.flushed,
+                'dropped': self.dropped,
+                'pending': self._queue.qsize() if self._queue else 0,
+                'policy': self.policy,
+            }
+
+    # Остановка фонового потока и запись остатка очереди
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._wakeup.set()
+            self._thread.join(timeout=5)
+            self._thread = None
+        if self._queue is not None:
+            self.flush()
+
+    def _ensure_thread(self):
+        # Поток запускается лениво, уже в рабочем процессе (после fork)
+        if self._thread is None or not self._thread.is_alive():
+            with self._thread_lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._stop.clear()
+                    self._thread = threading.Thread(target=self._run, name='visit-log-flusher', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                self.app.logger.exception('Ошибка записи журнала посещений')
+
+    def _above_watermark(self):
+        return self._queue.qsize() >= self._queue.maxsize * self.sample_watermark
+
+    def _drain(self, limit):
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        with self.app.app_context():
+            try:
+                # При "database is locked" пакет повторяется с задержкой (см. sqlite_profile)
+                retry_on_locked(lambda: self._write_batch(batch),
+                                self.app.config.get('SQLITE_LOCK_RETRIES', 0),
+                                self.app.config.get('SQLITE_LOCK_RETRY_DELAY', 0.05),
+                                rollback=db.session.rollback)
+            except Exception:
+                db.session.rollback()
+                self._count(dropped=len(batch))
+                raise
+        self._count(flushed=len(batch))
+
+    def _write_batch(self, batch):
+        insert_entries(batch)  # Пакетный INSERT в раздел месяца
+        for listener in self._listeners:
+            listener(batch)
+        db.session.commit()
+
+    def _count(self, queued=0, flushed=0, dropped=0):
+        with self._stats_lock:
+            self.queued += queued
+            self.flushed += flushed
+            self.dropped += dropped
+
+
+visit_buffer = VisitLogBuffer()
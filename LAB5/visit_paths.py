@@ -0,0 +1,113 @@
+# Словарь путей журнала посещений.
+# - Таблица visit_path: шаблоны маршрутов (kind='route', правило request.url_rule,
+#   например /user/<int:user_id>) и фактические пути запросов (kind='path') с
+#   целочисленными id. Строки журнала хранят только path_id и route_id, поэтому
+#   таблица меньше, а группировки в отчётах идут по целым числам.
+# - PathDictionary.encode: проставляет path_id/route_id пакету записей. Значения, которых
+#   нет в кэше, разрешаются одним INSERT ... ON CONFLICT DO NOTHING и одним SELECT на
+#   пакет и фиксируются отдельной короткой транзакцией: повтор пакета после ошибки
+#   записи не ссылается на откаченные id. Кэш value -> id - LRU на VISIT_PATH_CACHE_SIZE.
+# - route_for: шаблон маршрута для пути, если он не передан с записью (старые записи,
+#   синтетические данные) - по таблице маршрутов приложения.
+
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert
+from werkzeug.exceptions import HTTPException
+
+from models import db, VisitPath
+
+MAX_VALUE_LENGTH = 255  # Длиннее - обрезается (пути со случайными хвостами от сканеров)
+RESOLVE_CHUNK_ROWS = 500  # Значений в одном IN (...) при разрешении промахов
+
+
+class PathDictionary:
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._ids = OrderedDict()  # (kind, value) -> id
+        self._url_adapter = None
+        self.max_size = 10000
+        self.hits = 0
+        self.misses = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('VISIT_PATH_CACHE_SIZE', 10000)  # Значений словаря в памяти
+        self.max_size = app.config['VISIT_PATH_CACHE_SIZE']
+        self._url_map = app.url_map
+        app.extensions['visit_paths'] = self
+
+    # Шаблон маршрута для пути; None, если путь не соответствует ни одному маршруту
+    def route_for(self, path):
+        if self._url_adapter is None:
+            self._url_adapter = self._url_map.bind('localhost')
+        try:
+            rule, _ = self._url_adapter.match(path, method='GET', return_rule=True)
+        except HTTPException:  # 404, 405, редиректы на путь со слэшем
+            return None
+        return rule.rule
+
+    # path_id и route_id для записей пакета (в самих словарях записей)
+    def encode(self, entries):
+        pending = [entry for entry in entries if 'path_id' not in entry]
+        if not pending:
+            return
+        for entry in pending:
+            entry['path'] = entry['path'][:MAX_VALUE_LENGTH]
+            if 'route' not in entry:
+                entry['route'] = self.route_for(entry['path'])
+
+        route_ids = self._resolve('route', {entry['route']: None for entry in pending if entry['route']})
+        path_ids = self._resolve('path', {entry['path']: route_ids.get(entry['route']) for entry in pending})
+        for entry in pending:
+            entry['path_id'] = path_ids[entry['path']]
+            entry['route_id'] = route_ids.get(entry['route'])
+
+    # value -> id для значений одного вида; отсутствующие добавляются в словарь
+    def _resolve(self, kind, values):
+        ids = {}
+        missing = []
+        with self._lock:
+            for value in values:
+                cached = self._ids.get((kind, value))
+                if cached is None:
+                    missing.append(value)
+                else:
+                    self._ids.move_to_end((kind, value))
+                    ids[value] = cached
+            self.hits += len(ids)
+            self.misses += len(missing)
+        if not missing:
+            return ids
+
+        table = VisitPath.__table__
+        stmt = insert(table).on_conflict_do_nothing(index_elements=['kind', 'value'])
+        resolved = {}
+        for start in range(0, len(missing), RESOLVE_CHUNK_ROWS):
+            chunk = missing[start:start + RESOLVE_CHUNK_ROWS]
+            db.session.execute(stmt, [{'kind': kind, 'value': value, 'route_id': values[value]} for value in chunk])
+            resolved.update(db.session.execute(
+                select(table.c.value, table.c.id).where(table.c.kind == kind, table.c.value.in_(chunk))).all())
+        db.session.commit()  # Кэшируются только зафиксированные id
+
+        with self._lock:
+            for value, value_id in resolved.items():
+                self._ids[(kind, value)] = value_id
+            while len(self._ids) > self.max_size:
+                self._ids.popitem(last=False)
+        ids.update(resolved)
+        return ids
+
+    def clear(self):
+        with self._lock:
+            self._ids.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._ids), 'max_size': self.max_size, 'hits': self.hits, 'misses': self.misses}
+
+
+path_dictionary = PathDictionary()
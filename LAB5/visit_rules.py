@@ -0,0 +1,92 @@
+# Правила записи журнала посещений (какие запросы и с какой вероятностью записывать).
+# - VISIT_LOG_EXCLUDE_ENDPOINTS / VISIT_LOG_INCLUDE_ENDPOINTS: имена обработчиков
+#   (допускаются шаблоны fnmatch, например 'visit_logs.*'). Исключение сильнее всего;
+#   если задан список включения, остальные обработчики не записываются.
+# - VISIT_LOG_ALWAYS_LOG_ADMINS: запросы администраторов записываются без выборки.
+# - VISIT_LOG_PATH_SAMPLE_RATES: {префикс пути: доля записываемых запросов}; действует
+#   самый длинный совпавший префикс, без совпадения - 1 (все запросы).
+# Записанная строка хранит свою вероятность (sample_rate): агрегаты накапливают оценку
+# Хорвица-Томпсона (каждая строка - 1/sample_rate посещений) и её дисперсию, поэтому
+# отчёты показывают пересчитанные значения с доверительным интервалом (см. rollups).
+
+import random
+import threading
+from fnmatch import fnmatchcase
+
+from roles import role_cache
+
+ADMIN_ROLE = 'Администратор'
+
+
+class VisitRules:
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self.exclude = ()
+        self.include = None
+        self.always_log_admins = True
+        self.sample_rates = []
+        self.counters = {'logged': 0, 'excluded': 0, 'sampled_out': 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('VISIT_LOG_EXCLUDE_ENDPOINTS', ['static', 'readiness'])
+        app.config.setdefault('VISIT_LOG_INCLUDE_ENDPOINTS', None)  # None - все, кроме исключённых
+        app.config.setdefault('VISIT_LOG_ALWAYS_LOG_ADMINS', True)
+        app.config.setdefault('VISIT_LOG_PATH_SAMPLE_RATES', {})  # Например {'/visit_logs/': 0.1}
+
+        for prefix, rate in app.config['VISIT_LOG_PATH_SAMPLE_RATES'].items():
+            if not 0 < rate <= 1:
+                raise ValueError('Доля выборки для %r должна быть в (0, 1]: %r' % (prefix, rate))
+        self.exclude = tuple(app.config['VISIT_LOG_EXCLUDE_ENDPOINTS'])
+        include = app.config['VISIT_LOG_INCLUDE_ENDPOINTS']
+        self.include = tuple(include) if include is not None else None
+        self.always_log_admins = app.config['VISIT_LOG_ALWAYS_LOG_ADMINS']
+        # Длинные префиксы проверяются первыми
+        self.sample_rates = sorted(app.config['VISIT_LOG_PATH_SAMPLE_RATES'].items(),
+                                   key=lambda item: len(item[0]), reverse=True)
+        app.extensions['visit_rules'] = self
+
+    # Записывается ли обработчик вообще (без учёта выборки)
+    def tracked(self, endpoint):
+        endpoint = endpoint or ''
+        tracked = not any(fnmatchcase(endpoint, pattern) for pattern in self.exclude) and (
+            self.include is None or any(fnmatchcase(endpoint, pattern) for pattern in self.include))
+        if not tracked:
+            self._count('excluded')
+        return tracked
+
+    # Вероятность записи запроса по префиксу пути
+    def rate_for(self, path):
+        for prefix, rate in self.sample_rates:
+            if path.startswith(prefix):
+                return rate
+        return 1.0
+
+    # Решение для отслеживаемого запроса (см. tracked): вероятность, с которой он записан,
+    # или None - запрос не попал в выборку
+    def decide(self, path, user):
+        if self.always_log_admins and user.is_authenticated and role_cache.has_role(user.role_id, ADMIN_ROLE):
+            rate = 1.0
+        else:
+            rate = self.rate_for(path)
+        if rate < 1.0 and random.random() >= rate:
+            self._count('sampled_out')
+            return None
+        self._count('logged')
+        return rate
+
+    def _count(self, key):
+        with self._lock:
+            self.counters[key] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        stats['sample_rates'] = dict(self.sample_rates)
+        stats['exclude'] = list(self.exclude)
+        stats['include'] = list(self.include) if self.include is not None else None
+        return stats
+
+
+visit_rules = VisitRules()
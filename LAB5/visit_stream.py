@@ -0,0 +1,197 @@
+# Оперативная лента посещений для панели администратора (Server-Sent Events).
+# - Источник кадров - журнал посещений в БД, общий для всех воркеров: фоновый поток
+#   раз в VISIT_STREAM_INTERVAL сек читает строки, добавленные после прошлого чтения
+#   (по id в двух последних помесячных разделах - на стыке месяцев пишутся оба), и
+#   превращает их в кадр: посещения по страницам и пользователям с поправкой на
+#   выборку (1/sample_rate). Поэтому панель видит посещения, обработанные любым
+#   воркером, с задержкой сброса буфера журнала (VISIT_LOG_FLUSH_INTERVAL).
+#   Запросы, которые правила visit_rules не записывают, в ленту не попадают.
+# - Пока у процесса нет подписчиков, поток журнал не читает; при появлении первого
+#   подписчика чтение начинается с текущего конца журнала, без истории.
+# - Кадры лежат в кольцевом буфере последних VISIT_STREAM_BACKLOG кадров. Подписчики не
+#   имеют собственных очередей: все ждут одно условие и читают кадры из общего буфера
+#   по номеру и не держат соединений с БД. Номера кадров свои в каждом процессе:
+#   переподключение с Last-Event-ID досылает пропущенные кадры, если клиент попал в
+#   тот же воркер. Без событий раз в VISIT_STREAM_HEARTBEAT сек отправляется
+#   комментарий - так обнаруживаются закрытые клиентом соединения.
+# - Подключение занимает обработчик на всё время просмотра панели. С синхронными
+#   воркерами это целый воркер, поэтому приложение запускается с воркерами gevent
+#   (gunicorn.conf.py): подключение - greenlet, ожидание threading.Condition после
+#   monkey-patch не блокирует воркер. VISIT_STREAM_MAX_SUBSCRIBERS - предел на воркер,
+#   меньше worker_connections, чтобы обычным запросам оставались места.
+
+import json
+import threading
+import time
+from collections import Counter, deque
+
+from sqlalchemy import func, select
+
+from models import db, User, VisitPath
+from partitions import list_partitions, partition_table, user_name_column
+
+
+class StreamFull(Exception):
+    pass
+
+
+# События одного подписчика. Место освобождает close(), который сервер вызывает у
+# тела ответа всегда - в том числе когда тело ни разу не читалось (HEAD, отключение
+# клиента до первого кадра) и генератор не дошёл бы до своего finally.
+class Subscription:
+    def __init__(self, stream, events):
+        self._stream = stream
+        self._events = events
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._events)
+
+    def close(self):
+        with self._stream._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._stream.subscribers -= 1
+        self._events.close()
+
+
+class VisitStream:
+    def __init__(self, app=None):
+        self.app = None
+        self._lock = threading.Lock()  # Запуск фонового потока
+        self._cond = threading.Condition()  # Новый кадр в буфере
+        self._thread = None
+        self._cursors = None  # Раздел журнала -> последний прочитанный id; None - с конца журнала
+        self._frames = deque()  # (номер, время, JSON кадра)
+        self._seq = 0
+        self.subscribers = 0
+        self.published = 0
+        self.interval = 1.0
+        self.heartbeat = 15
+        self.max_subscribers = 200
+        self.backlog = 60
+        self.poll_rows = 5000
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('VISIT_STREAM_INTERVAL', 1.0)  # Период кадров, сек
+        app.config.setdefault('VISIT_STREAM_HEARTBEAT', 15)  # Комментарий-пульс без событий, сек
+        app.config.setdefault('VISIT_STREAM_MAX_SUBSCRIBERS', 200)  # На воркер, см. gunicorn.conf.py
+        app.config.setdefault('VISIT_STREAM_BACKLOG', 60)  # Кадров для досылки при переподключении
+        app.config.setdefault('VISIT_STREAM_POLL_ROWS', 5000)  # Строк журнала за одно чтение, остаток - в следующем кадре
+        self.app = app
+        self.interval = app.config['VISIT_STREAM_INTERVAL']
+        self.heartbeat = app.config['VISIT_STREAM_HEARTBEAT']
+        self.max_subscribers = app.config['VISIT_STREAM_MAX_SUBSCRIBERS']
+        self.backlog = app.config['VISIT_STREAM_BACKLOG']
+        self.poll_rows = app.config['VISIT_STREAM_POLL_ROWS']
+        app.extensions['visit_stream'] = self
+
+    # События SSE для одного подписчика (Subscription); last_event_id - номер последнего полученного кадра
+    def events(self, last_event_id=None):
+        with self._cond:
+            if self.subscribers >= self.max_subscribers:
+                raise StreamFull()
+            self.subscribers += 1
+        self._ensure_thread()
+        return Subscription(self, self._events(last_event_id))
+
+    def _events(self, last_event_id):
+        with self._cond:
+            seq = self._seq if last_event_id is None else min(last_event_id, self._seq)
+        yield 'retry: %d\n\n' % int(self.interval * 3000)
+        while True:
+            with self._cond:
+                if self._seq == seq:
+                    self._cond.wait(self.heartbeat)
+                frames = [frame for frame in self._frames if frame[0] > seq]
+            if not frames:
+                yield ': heartbeat\n\n'
+                continue
+            for number, _, data in frames:
+                yield 'id: %d\nevent: visits\ndata: %s\n\n' % (number, data)
+            seq = frames[-1][0]
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name='visit-stream', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            if not self.subscribers:
+                self._cursors = None  # Следующий подписчик начнёт с текущего конца журнала
+                continue
+            try:
+                with self.app.app_context():
+                    self.tick()
+            except Exception:
+                self.app.logger.exception('Лента посещений: ошибка чтения журнала')
+
+    # Кадр из строк журнала, добавленных после прошлого чтения (в контексте приложения)
+    def tick(self):
+        pages, users, names = Counter(), Counter(), {}
+        cursors = {}
+        for name in list_partitions(include_legacy=False)[:2]:
+            table = partition_table(name)
+            if self._cursors is None:
+                # Первое чтение - только запоминаем конец раздела
+                cursors[name] = db.session.execute(select(func.coalesce(func.max(table.c.id), 0))).scalar()
+                continue
+            last_id = self._cursors.get(name, 0)  # Раздел нового месяца читается с начала
+            rows = db.session.execute(
+                select(table.c.id, table.c.user_id, table.c.sample_rate, user_name_column(),
+                       VisitPath.value.label('path'))
+                .outerjoin(User, User.id == table.c.user_id)
+                .outerjoin(VisitPath, VisitPath.id == table.c.path_id)
+                .where(table.c.id > last_id).order_by(table.c.id).limit(self.poll_rows)
+            ).all()
+            for row in rows:
+                weight = 1 / row.sample_rate if row.sample_rate else 1  # Оценка с поправкой на выборку
+                key = str(row.user_id) if row.user_id is not None else 'anonymous'
+                pages[row.path] += weight
+                users[key] += weight
+                if row.user_id is not None:
+                    names[key] = row.user_name
+            cursors[name] = rows[-1].id if rows else last_id
+        db.session.rollback()  # Только чтение: транзакцию и соединение - сразу обратно в пул
+        self._cursors = cursors
+        if not pages:
+            return None
+        now = time.time()
+        data = json.dumps({
+            'ts': round(now, 3),
+            'interval': self.interval,
+            'visits': round(sum(pages.values())),
+            'pages': {path: round(count) for path, count in pages.most_common()},
+            'users': [{'id': key, 'name': names.get(key), 'visits': round(count)}
+                      for key, count in users.most_common()],
+        }, ensure_ascii=False)
+        with self._cond:
+            self._seq += 1
+            self._frames.append((self._seq, now, data))
+            while len(self._frames) > self.backlog:
+                self._frames.popleft()
+            self._cond.notify_all()
+        self.published += 1
+        return self._seq
+
+    def stats(self):
+        with self._cond:
+            return {
+                'subscribers': self.subscribers,
+                'max_subscribers': self.max_subscribers,
+                'frames_published': self.published,
+                'last_event_id': self._seq,
+            }
+
+
+visit_stream = VisitStream()
@@ -0,0 +1,8 @@
+# Общие модули Flask-приложений репозитория (LAB5, lb4, lb6).
+# Устанавливается в окружение каждого приложения строкой "-e ../common" в его
+# requirements.txt (pip install -r requirements.txt из папки приложения).
+# - passwords: хеширование и проверка паролей в пуле процессов, ограничение попыток входа.
+# - identity_cache: LRU+TTL кэш пользователей для загрузчика Flask-Login.
+# - request_timing: число и время SQL-запросов каждого запроса, бюджеты по endpoint и поиск N+1.
+# - user_search: индекс FTS5 пользователей и выражения поиска (LAB5, lb4).
+# - fixtures: чтение фикстур (JSON, JSONL, CSV) и массовая загрузка ролей и пользователей (LAB5, lb4).
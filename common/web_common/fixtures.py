@@ -0,0 +1,81 @@
+# Загрузка начальных данных из файлов (flask bootstrap в LAB5 и lb4).
+# - read_fixture: записи из JSON-списка, JSONL или CSV (формат - по расширению файла).
+# - seed_roles / seed_users: массовая вставка ролей и пользователей. Пользователи
+#   вставляются пачками по chunk_rows строк через INSERT ... ON CONFLICT DO NOTHING,
+#   поэтому повторный запуск не создаёт дублей. Хеш считается один раз на каждый
+#   различный пароль, что позволяет загружать 10^6 пользователей за секунды.
+# Модели остаются в приложениях: функции получают сессию SQLAlchemy и классы моделей
+# (таблица пользователей - с колонками username, password_hash, ФИО и role_id).
+
+import csv
+import json
+from datetime import datetime
+from itertools import islice
+
+from sqlalchemy.dialects.sqlite import insert
+from werkzeug.security import generate_password_hash
+
+CHUNK_ROWS = 10000  # Строк в одном INSERT (executemany)
+
+
+# Чтение записей фикстуры; формат определяется по расширению файла
+def read_fixture(path):
+    with open(path, encoding='utf-8', newline='') as f:
+        if path.endswith('.csv'):
+            yield from csv.DictReader(f)
+        elif path.endswith('.jsonl'):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from json.load(f)
+
+
+# Роли, которых ещё нет (по названию); возвращает число добавленных
+def seed_roles(session, role_model, records):
+    existing = {name for name, in session.query(role_model.name)}
+    new_roles = [role_model(name=r['name'], description=r.get('description'))
+                 for r in records if r['name'] not in existing]
+    if new_roles:
+        session.bulk_save_objects(new_roles)  # Массовое сохранение
+        session.commit()
+    return len(new_roles)
+
+
+# Загрузка пользователей; в записи - password или готовый password_hash,
+# роль задаётся названием (role) или идентификатором (role_id).
+# method - параметры KDF для новых хешей (PASSWORD_HASH_METHOD приложения)
+def seed_users(session, user_model, role_model, records, method, chunk_rows=CHUNK_ROWS):
+    role_ids = {name: role_id for role_id, name in session.query(role_model.id, role_model.name)}
+    hashes = {}  # Пароль -> хеш
+    table = user_model.__table__
+    stmt = insert(table).on_conflict_do_nothing(index_elements=['username'])
+    now = datetime.utcnow()
+
+    def rows():
+        for r in records:
+            password_hash = r.get('password_hash')
+            if not password_hash:
+                password = r['password']
+                if password not in hashes:
+                    hashes[password] = generate_password_hash(password, method)
+                password_hash = hashes[password]
+            role_id = r.get('role_id') or role_ids.get(r.get('role'))
+            row = {
+                'username': r['username'],
+                'password_hash': password_hash,
+                'last_name': r.get('last_name') or '',
+                'first_name': r['first_name'],
+                'middle_name': r.get('middle_name') or '',
+                'role_id': int(role_id) if role_id else None,
+            }
+            if 'created_at' in table.c:
+                row['created_at'] = now
+            yield row
+
+    inserted = 0
+    source = rows()
+    while chunk := list(islice(source, chunk_rows)):
+        inserted += session.execute(stmt, chunk).rowcount
+    session.commit()
+    return inserted
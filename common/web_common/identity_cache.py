@@ -0,0 +1,84 @@
+# Кэш пользователей для загрузчика Flask-Login.
+# - IdentityCache: LRU-кэш с ограниченным временем жизни записей (TTL) в памяти процесса.
+# - Ключ - идентификатор сессии "id:версия_пароля" (см. User.get_id), значение -
+#   отсоединённый от сессии SQLAlchemy объект User (в LAB5 - с уже загруженной ролью).
+# - После смены пароля ключ меняется, поэтому старые сессии не находят пользователя.
+# - Изменения профиля сбрасывают записи явно (invalidate); в остальных процессах
+#   устаревшие данные живут не дольше TTL.
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class IdentityCache:
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # Ключ -> (время записи, пользователь)
+        self.maxsize = 1000
+        self.ttl = 60
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('IDENTITY_CACHE_SIZE', 1000)
+        app.config.setdefault('IDENTITY_CACHE_TTL', 60)  # Секунд, верхняя граница устаревания прав
+        self.maxsize = app.config['IDENTITY_CACHE_SIZE']
+        self.ttl = app.config['IDENTITY_CACHE_TTL']
+        app.extensions['identity_cache'] = self
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, user):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), user)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    # Сброс всех записей пользователя (при любой версии пароля)
+    def invalidate(self, user_id):
+        prefix = '%s:' % user_id
+        with self._lock:
+            for key in [k for k in self._entries if k == str(user_id) or k.startswith(prefix)]:
+                del self._entries[key]
+
+    # Сброс записей набора пользователей за один проход по кэшу (массовые операции)
+    def invalidate_many(self, user_ids):
+        ids = {str(user_id) for user_id in user_ids}
+        with self._lock:
+            for key in [k for k in self._entries if k.partition(':')[0] in ids]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+                'ttl': self.ttl,
+            }
+
+
+identity_cache = IdentityCache()
@@ -0,0 +1,217 @@
+# Хеширование и проверка паролей вне потока обработки запроса.
+# - PasswordHasher: пул процессов для generate/check_password_hash; KDF не держит GIL
+#   воркера. Число одновременно принятых задач ограничено (PASSWORD_HASH_QUEUE_SIZE):
+#   если очередь заполнена дольше PASSWORD_HASH_QUEUE_TIMEOUT, вызывается HasherBusy.
+# - needs_rehash: хеш создан с другими параметрами KDF, чем PASSWORD_HASH_METHOD;
+#   такой хеш пересчитывается при следующем успешном входе.
+# - LoginThrottle: ограничение попыток входа в скользящем окне - по IP (все попытки)
+#   и по учётной записи (неудачные попытки).
+# - bulk_password_hasher: отдельный пул для массового импорта (настройки PASSWORD_BULK_HASH_*)
+#   с пониженным приоритетом процессов (nice) и ожиданием места в очереди без ограничения:
+#   импорт не занимает очередь, из которой проверяются пароли при входе.
+# При PASSWORD_HASH_WORKERS = 0 хеширование выполняется в текущем потоке.
+
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+LATENCY_WINDOW = 1000  # Последних замеров для перцентилей
+
+
+class HasherBusy(Exception):
+    pass
+
+
+class PasswordHasher:
+    # name - ключ в app.extensions, config_prefix - префикс настроек пула, defaults - их значения
+    def __init__(self, app=None, name='password_hasher', config_prefix='PASSWORD_HASH', defaults=None):
+        self._lock = threading.Lock()
+        self._pool = None
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._canonical_method = None
+        self.name = name
+        self.config_prefix = config_prefix
+        self.defaults = {
+            'WORKERS': min(4, os.cpu_count() or 1),
+            'QUEUE_SIZE': 64,  # Задач в пуле одновременно
+            'QUEUE_TIMEOUT': 5.0,  # Ожидание места в очереди, сек (None - без ограничения)
+            'NICE': 0,  # Прибавка к nice процессов пула (ниже приоритет)
+        }
+        self.defaults.update(defaults or {})
+        self.completed = 0
+        self.rejected = 0
+        self.in_flight = 0
+        self.workers = 0
+        self.nice = 0
+        self.method = 'scrypt'
+        self.timeout = None
+        self._slots = threading.BoundedSemaphore(1)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PASSWORD_HASH_METHOD', 'scrypt')  # Параметры KDF для новых хешей
+        for name, value in self.defaults.items():
+            app.config.setdefault('%s_%s' % (self.config_prefix, name), value)
+
+        config = {name: app.config['%s_%s' % (self.config_prefix, name)] for name in self.defaults}
+        self.method = app.config['PASSWORD_HASH_METHOD']
+        self.workers = config['WORKERS']
+        self.timeout = config['QUEUE_TIMEOUT']
+        self.nice = config['NICE']
+        self._slots = threading.BoundedSemaphore(config['QUEUE_SIZE'])
+        self._canonical_method = None
+        app.extensions[self.name] = self
+
+    # Пул создаётся при первой задаче - уже в процессе воркера, а не в мастер-процессе
+    def _executor(self):
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_lower_priority,
+                                                     initargs=(self.nice,))
+        return self._pool
+
+    # Постановка задачи в пул; место в очереди освобождается по завершении задачи
+    def _submit(self, func, *args):
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self.rejected += 1
+            raise HasherBusy()
+        started = time.perf_counter()
+        with self._lock:
+            self.in_flight += 1
+
+        def done(future):
+            with self._lock:
+                self.in_flight -= 1
+                self.completed += 1
+                self._latencies.append((time.perf_counter() - started) * 1000)
+            self._slots.release()
+
+        if self.workers:
+            future = self._executor().submit(func, *args)
+        else:
+            future = Future()
+            try:
+                future.set_result(func(*args))
+            except Exception as e:
+                future.set_exception(e)
+        future.add_done_callback(done)
+        return future
+
+    def hash(self, password):
+        return self._submit(generate_password_hash, password, self.method).result()
+
+    def check(self, password_hash, password):
+        return self._submit(check_password_hash, password_hash, password).result()
+
+    # Параллельное хеширование списка паролей (массовый импорт); порядок сохраняется
+    def hash_many(self, passwords):
+        futures = [self._submit(generate_password_hash, password, self.method) for password in passwords]
+        return [future.result() for future in futures]
+
+    # Хеш создан с другими параметрами (например, после смены метода или числа итераций)
+    def needs_rehash(self, password_hash):
+        if self._canonical_method is None:
+            # Полная строка параметров ("scrypt:32768:8:1") - из пробного хеша
+            self._canonical_method = self.hash('').split('$', 1)[0]
+        return password_hash.split('$', 1)[0] != self._canonical_method
+
+    def stats(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            stats = {
+                'workers': self.workers,
+                'method': self.method,
+                'queue_depth': self.in_flight,
+                'completed': self.completed,
+                'rejected': self.rejected,
+            }
+        for p in (50, 95, 99):
+            stats['latency_p%d_ms' % p] = (
+                round(latencies[min(len(latencies) - 1, len(latencies) * p // 100)], 1) if latencies else None)
+        return stats
+
+
+# Инициализация процесса пула: пониженный приоритет (только POSIX)
+def _lower_priority(nice):
+    if nice and hasattr(os, 'nice'):
+        os.nice(nice)
+
+
+class LoginThrottle:
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._ip_attempts = defaultdict(deque)
+        self._account_failures = defaultdict(deque)
+        self.throttled = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('LOGIN_THROTTLE_WINDOW', 300)  # Окно подсчёта попыток, сек
+        app.config.setdefault('LOGIN_THROTTLE_PER_IP', 30)  # Попыток входа с одного IP за окно
+        app.config.setdefault('LOGIN_THROTTLE_PER_ACCOUNT', 5)  # Неудачных попыток на учётную запись
+        self.window = app.config['LOGIN_THROTTLE_WINDOW']
+        self.per_ip = app.config['LOGIN_THROTTLE_PER_IP']
+        self.per_account = app.config['LOGIN_THROTTLE_PER_ACCOUNT']
+        app.extensions['login_throttle'] = self
+
+    def _prune(self, events, now):
+        while events and now - events[0] > self.window:
+            events.popleft()
+
+    # Секунд до следующей разрешённой попытки (0 - можно пытаться); попытка учитывается для IP
+    def attempt(self, ip, username):
+        now = time.monotonic()
+        with self._lock:
+            if len(self._ip_attempts) + len(self._account_failures) > 100000:
+                self._sweep(now)
+            ip_events = self._ip_attempts[ip]
+            account_events = self._account_failures[username]
+            self._prune(ip_events, now)
+            self._prune(account_events, now)
+            wait = 0
+            if len(ip_events) >= self.per_ip:
+                wait = max(wait, self.window - (now - ip_events[0]))
+            if len(account_events) >= self.per_account:
+                wait = max(wait, self.window - (now - account_events[0]))
+            if wait:
+                self.throttled += 1
+                return int(wait) + 1
+            ip_events.append(now)
+            return 0
+
+    def failure(self, username):
+        with self._lock:
+            self._account_failures[username].append(time.monotonic())
+
+    def success(self, username):
+        with self._lock:
+            self._account_failures.pop(username, None)
+
+    # Удаление устаревших ключей, чтобы память не росла при переборе логинов/IP
+    def _sweep(self, now):
+        for events in (self._ip_attempts, self._account_failures):
+            for key in [key for key, queue in events.items() if not queue or now - queue[-1] > self.window]:
+                del events[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'tracked_ips': len(self._ip_attempts),
+                'tracked_accounts': len(self._account_failures),
+                'throttled': self.throttled,
+            }
+
+
+password_hasher = PasswordHasher()
+# Один процесс с nice 10: scrypt ~130 мс на пароль, т.е. ~8 паролей в секунду на процесс
+bulk_password_hasher = PasswordHasher(name='bulk_password_hasher', config_prefix='PASSWORD_BULK_HASH',
+                                      defaults={'WORKERS': 1, 'QUEUE_SIZE': 8, 'QUEUE_TIMEOUT': None, 'NICE': 10})
+login_throttle = LoginThrottle()
@@ -0,0 +1,173 @@
+# Замер времени обработки запроса и SQL-запросов, бюджеты числа запросов и поиск N+1.
+# - install_db_timer: подписка на события движка SQLAlchemy; каждое выполнение курсора
+#   учитывается в QueryRecorder текущего запроса (g.query_recorder): число запросов,
+#   суммарное время и число повторов каждой "формы" запроса (текст без параметров,
+#   списки IN (?, ?, ...) свёрнуты).
+# - Для формы, встретившейся второй раз, запоминается место вызова: строка шаблона Jinja
+#   (ленивая загрузка связи в цикле шаблона) или ближайшая строка кода приложения.
+# - init_app: хук начала запроса (start_request) и проверка после него: формы,
+#   повторившиеся QUERY_REPEAT_THRESHOLD раз и более, и превышение бюджета QUERY_BUDGETS
+#   ({endpoint: число запросов}) пишутся в журнал приложения; при QUERY_AUDIT_HEADERS
+#   число и время запросов - в заголовках ответа. finish_request - метрики запроса
+#   для хуков after_request приложения (журнал посещений LAB5).
+# - assert_query_budget: помощник для тестов - выполняет запрос тестовым клиентом и
+#   проверяет бюджет endpoint; в сообщении об ошибке - повторяющиеся формы и их места.
+
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+
+_app_roots = set()  # Папки приложений (init_app) - для места вызова вне шаблонов
+IN_LIST_RE = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')  # (?, ?, ?) - списки IN и VALUES
+SPACE_RE = re.compile(r'\s+')
+
+_recorders = []  # (поток, QueryRecorder) активных блоков record_queries (помощник тестов)
+_recorders_lock = threading.Lock()
+
+
+# Форма запроса: текст без лишних пробелов, списки параметров любой длины совпадают
+def statement_shape(statement):
+    return IN_LIST_RE.sub('(?, ...)', SPACE_RE.sub(' ', statement).strip())
+
+
+# Место выполнения запроса: строка шаблона или кода приложения (без библиотек)
+def query_origin():
+    frame = sys._getframe(1)
+    fallback = None
+    while frame is not None:
+        template = frame.f_globals.get('__jinja_template__')
+        if template is not None:
+            return '%s:%d' % (template.name or template.filename, template.get_corresponding_lineno(frame.f_lineno))
+        filename = frame.f_code.co_filename
+        if fallback is None and filename != __file__:
+            root = next((root for root in _app_roots if filename.startswith(root + os.sep)), None)
+            if root is not None:
+                fallback = '%s:%d' % (os.path.relpath(filename, root), frame.f_lineno)
+        frame = frame.f_back
+    return fallback
+
+
+class QueryRecorder:
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0  # Секунды
+        self.shapes = Counter()
+        self.origins = {}  # Форма -> место второго выполнения
+
+    def record(self, statement, elapsed):
+        shape = statement_shape(statement)
+        self.count += 1
+        self.time += elapsed
+        self.shapes[shape] += 1
+        if self.shapes[shape] == 2:
+            self.origins[shape] = query_origin()
+
+    # Формы, выполненные threshold раз и более: [(форма, число, место)]
+    def repeated(self, threshold):
+        return [(shape, count, self.origins.get(shape))
+                for shape, count in self.shapes.most_common() if count >= threshold]
+
+
+def install_db_timer(engine):
+    if event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+        return
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() or _recorders:
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('query_started')
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    if has_request_context():
+        recorder = g.get('query_recorder')
+        if recorder is None:
+            recorder = g.query_recorder = QueryRecorder()
+        recorder.record(statement, elapsed)
+    thread = threading.get_ident()
+    for owner, recorder in list(_recorders):
+        if owner == thread:
+            recorder.record(statement, elapsed)
+
+
+def start_request():
+    g.request_started = time.perf_counter()
+    g.query_recorder = QueryRecorder()
+
+
+# Метрики завершённого запроса: (полное время, время БД) в миллисекундах
+def finish_request():
+    started = g.get('request_started')
+    duration = (time.perf_counter() - started) * 1000 if started is not None else None
+    recorder = g.get('query_recorder')
+    return duration, (recorder.time if recorder is not None else 0.0) * 1000
+
+
+def init_app(app):
+    app.config.setdefault('QUERY_REPEAT_THRESHOLD', 5)  # Повторов одной формы, считающихся N+1
+    app.config.setdefault('QUERY_BUDGETS', {})  # {endpoint: допустимое число SQL-запросов}
+    app.config.setdefault('QUERY_AUDIT_HEADERS', False)  # X-DB-Queries и X-DB-Time-Ms в ответе
+    _app_roots.add(app.root_path)
+    app.before_request(start_request)
+    app.after_request(_audit_request)
+
+
+def _audit_request(response):
+    recorder = g.get('query_recorder')
+    if recorder is None:
+        return response
+    config = current_app.config
+    for shape, count, origin in recorder.repeated(config['QUERY_REPEAT_THRESHOLD']):
+        current_app.logger.warning('N+1 в %s: %d раз (%s): %s', request.endpoint, count, origin, shape)
+    budget = config['QUERY_BUDGETS'].get(request.endpoint)
+    if budget is not None and recorder.count > budget:
+        current_app.logger.warning('Бюджет запросов %s превышен: %d > %d', request.endpoint, recorder.count, budget)
+    if config['QUERY_AUDIT_HEADERS']:
+        response.headers['X-DB-Queries'] = str(recorder.count)
+        response.headers['X-DB-Time-Ms'] = '%.2f' % (recorder.time * 1000)
+    return response
+
+
+# Учёт SQL-запросов блока в текущем потоке (в т.ч. вне контекста запроса);
+# фоновые потоки (запись журнала посещений) не учитываются
+@contextmanager
+def record_queries():
+    entry = (threading.get_ident(), QueryRecorder())
+    with _recorders_lock:
+        _recorders.append(entry)
+    try:
+        yield entry[1]
+    finally:
+        with _recorders_lock:
+            _recorders.remove(entry)
+
+
+# Помощник для тестов: запрос тестовым клиентом с проверкой бюджета SQL-запросов.
+# budget по умолчанию - QUERY_BUDGETS для endpoint пути; повтор формы не меньше
+# QUERY_REPEAT_THRESHOLD раз - тоже ошибка. Возвращает ответ.
+def assert_query_budget(client, path, budget=None, method='GET', **kwargs):
+    app = client.application
+    with record_queries() as recorder:
+        response = client.open(path, method=method, **kwargs)
+    if budget is None:
+        endpoint, _ = app.url_map.bind('localhost').match(path.split('?')[0], method=method)
+        budget = app.config['QUERY_BUDGETS'][endpoint]
+    repeated = recorder.repeated(app.config['QUERY_REPEAT_THRESHOLD'])
+    if recorder.count > budget or repeated:
+        lines = ['%s %s: %d SQL-запросов при бюджете %d' % (method, path, recorder.count, budget)]
+        lines += ['  N+1: %d раз (%s): %s' % (count, origin, shape) for shape, count, origin in repeated]
+        raise AssertionError('\n'.join(lines))
+    return response
@@ -0,0 +1,76 @@
+# Полнотекстовый поиск пользователей (LAB5, lb4): индекс и выражения запроса.
+# - user_fts: индекс SQLite FTS5 по логину и ФИО таблицы "user" с внешним содержимым
+#   (content='user'): текст хранится только в таблице user, индекс поддерживается
+#   триггерами на INSERT/UPDATE/DELETE. Токенизатор unicode61 без учёта регистра и
+#   диакритики; префиксные индексы на 2 и 3 символа ускоряют подсказки.
+# - Запрос превращается в префиксный MATCH ("ив" найдёт "Иванов"), все слова запроса
+#   должны встретиться (AND).
+# - NAME_COLUMNS: колонки без логина - для анонимного поиска, иначе по совпадению с
+#   префиксом логина можно было бы перебрать логины пользователей.
+# Модели остаются в приложениях: функции получают сессию SQLAlchemy и строят
+# подзапросы id, которые приложение подставляет в свой SELECT.
+
+import re
+
+from sqlalchemy import Float, Integer, text
+
+NAME_COLUMNS = ('last_name', 'first_name', 'middle_name')  # Колонки индекса без логина
+
+FTS_DDL = (
+    """CREATE VIRTUAL TABLE IF NOT EXISTS user_fts USING fts5(
+        username, last_name, first_name, middle_name,
+        content='user', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3')""",
+    """CREATE TRIGGER IF NOT EXISTS user_fts_ai AFTER INSERT ON "user" BEGIN
+        INSERT INTO user_fts(rowid, username, last_name, first_name, middle_name)
+        VALUES (new.id, new.username, new.last_name, new.first_name, new.middle_name);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS user_fts_ad AFTER DELETE ON "user" BEGIN
+        INSERT INTO user_fts(user_fts, rowid, username, last_name, first_name, middle_name)
+        VALUES ('delete', old.id, old.username, old.last_name, old.first_name, old.middle_name);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS user_fts_au
+        AFTER UPDATE OF username, last_name, first_name, middle_name ON "user" BEGIN
+        INSERT INTO user_fts(user_fts, rowid, username, last_name, first_name, middle_name)
+        VALUES ('delete', old.id, old.username, old.last_name, old.first_name, old.middle_name);
+        INSERT INTO user_fts(rowid, username, last_name, first_name, middle_name)
+        VALUES (new.id, new.username, new.last_name, new.first_name, new.middle_name);
+    END""",
+)
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+# Создание индекса и триггеров; новый индекс заполняется из таблицы user
+def ensure_user_search(session):
+    exists = session.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user_fts'")).first()
+    for ddl in FTS_DDL:
+        session.execute(text(ddl))
+    if not exists:
+        session.execute(text("INSERT INTO user_fts(user_fts) VALUES ('rebuild')"))
+    session.commit()
+
+
+# Выражение MATCH из строки поиска; None, если в строке нет ни одного слова.
+# columns - искать только в этих колонках индекса (по умолчанию во всех)
+def match_expression(q, columns=None):
+    tokens = TOKEN_RE.findall(q or '')
+    if not tokens:
+        return None
+    match = ' '.join('"%s"*' % token for token in tokens)
+    if columns:
+        match = '{%s} : (%s)' % (' '.join(columns), match)
+    return match
+
+
+# Подзапрос id подходящих пользователей (для User.id.in_(...))
+def matching_ids(match):
+    return text('SELECT rowid FROM user_fts WHERE user_fts MATCH :match').bindparams(match=match)
+
+
+# Подзапрос (id, rank) limit лучших совпадений; меньший rank - более релевантный (bm25)
+def ranked_matches(match, limit):
+    return (text('SELECT rowid AS id, rank FROM user_fts WHERE user_fts MATCH :match '
+                 'ORDER BY rank LIMIT :limit').bindparams(match=match, limit=limit)
+            .columns(id=Integer, rank=Float).subquery())
@@ -1,11 +1,20 @@
 # Импорт необходимых модулей Flask и связанных библиотек
 from flask import Flask, render_template, redirect, url_for, request, flash, jsonify
 from flask_login import LoginManager, login_user, login_required, logout_user, current_user
-from werkzeug.security import generate_password_hash, check_password_hash  # Для хеширования и проверки паролей
 from flask_sqlalchemy import SQLAlchemy  # ORM для работы с базой данных
 from flask_wtf import FlaskForm  # Для работы с формами
 from wtforms import StringField, PasswordField, SelectField, SubmitField  # Поля форм
 from wtforms.validators import DataRequired, Length, Regexp, EqualTo  # Валидаторы полей форм
+from sqlalchemy.orm import joinedload  # Загрузка роли тем же запросом
+from functools import wraps
+import click
+import importlib.util
+import os
+import time
+from web_common.passwords import password_hasher, login_throttle, HasherBusy  # Пул хеширования паролей и ограничение входа
+from web_common import fixtures  # Загрузка ролей и пользователей из файлов
+from web_common.fixtures import read_fixture
+from web_common.user_search import NAME_COLUMNS, ensure_user_search, match_expression, matching_ids  # Поиск FTS5
 
 # Создание экземпляра Flask-приложения
 app = Flask(__name__)
@@ -20,6 +29,16 @@ login_manager.login_view = 'login'  # Указываем endpoint для стр
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///app.db'
 db = SQLAlchemy(app)
 
+# Хеширование паролей в пуле процессов и ограничение попыток входа
+app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256'
+password_hasher.init_app(app)
+login_throttle.init_app(app)
+
+# Очередь хеширования паролей переполнена
+@app.errorhandler(HasherBusy)
+def handle_hasher_busy(err):
+    return 'Сервер перегружен. Повторите попытку позже.', 503, {'Retry-After': '5'}
+
 # Модель данных для ролей пользователей
 class Role(db.Model):
     id = db.Column(db.Integer, primary_key=True)  # Первичный ключ
@@ -59,6 +78,19 @@ class User(db.Model):
 def load_user(user_id):
     return User.query.get(int(user_id))  # Загружаем пользователя по ID
 
+# Декоратор для проверки прав доступа
+def check_rights(required_role):
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            # Проверка аутентификации и роли пользователя
+            if not current_user.is_authenticated or not current_user.role or current_user.role.name != required_role:
+                flash('У вас недостаточно прав для доступа к данной странице.', 'danger')
+                return redirect(url_for('index'))
+            return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
 # Форма для создания/редактирования пользователя
 class UserForm(FlaskForm):
     username = StringField('Логин', validators=[
@@ -77,11 +109,47 @@ class UserForm(FlaskForm):
     role_id = SelectField('Роль', coerce=int)  # Выпадающий список ролей
     submit = SubmitField('Сохранить')
 
-# Главная страница - список пользователей
+# Запрос пользователей с ролями (одним SELECT), отфильтрованных поиском по индексу FTS5
+# (индекс и выражения MATCH - общие с LAB5, см. web_common.user_search)
+def search_users_query(q, columns=None):
+    query = User.query.options(joinedload(User.role))
+    match = match_expression(q, columns)
+    if match:
+        query = query.filter(User.id.in_(matching_ids(match)))
+    return query
+
+
+# Главная страница - справочник пользователей с поиском и постраничным выводом
 @app.route('/')
 def index():
-    users = User.query.all()
-    return render_template('index.html', users=users)
+    q = request.args.get('q', '').strip()
+    page = request.args.get('page', 1, type=int)
+    # Без входа - поиск только по ФИО (логины в справочнике не раскрываются)
+    columns = None if current_user.is_authenticated else NAME_COLUMNS
+    users = search_users_query(q, columns).order_by(User.id).paginate(page=page, per_page=20, error_out=False)
+    return render_template('index.html', users=users, q=q)
+
+# Метрики пула хеширования паролей и ограничения входа
+@app.route('/passwords/stats')
+@login_required
+@check_rights('Администратор')
+def password_stats():
+    return jsonify(hasher=password_hasher.stats(), throttle=login_throttle.stats())
+
+# Подсказки для поиска пользователей (JSON для автодополнения); содержат логины,
+# поэтому только для вошедших пользователей
+@app.route('/users/suggest')
+@login_required
+def suggest_users():
+    q = request.args.get('q', '').strip()
+    limit = min(request.args.get('limit', 10, type=int), 50)
+    users = search_users_query(q).order_by(User.id).limit(limit).all() if match_expression(q) else []
+    return jsonify([{
+        'id': user.id,
+        'username': user.username,
+        'full_name': f'{user.last_name} {user.first_name} {user.middle_name}'.strip(),
+        'role': user.role.name if user.role else None,
+    } for user in users])
 
 # Страница входа
 @app.route('/login', methods=['GET', 'POST'])
@@ -90,15 +158,27 @@ def login():
         username = request.form['username']
         password = request.form['password']
         remember = 'remember' in request.form  # Запомнить пользователя
+
+        # Ограничиваем частоту попыток входа
+        wait = login_throttle.attempt(request.remote_addr, username)
+        if wait:
+            flash(f'Слишком много попыток входа. Повторите через {wait} с.', 'danger')
+            return render_template('login.html', next=request.args.get('next')), 429, {'Retry-After': str(wait)}
         user = User.query.filter_by(username=username).first()
         
-        # Проверяем пользователя и пароль
-        if user and check_password_hash(user.password_hash, password):
+        # Проверяем пользователя и пароль (в пуле процессов)
+        if user and password_hasher.check(user.password_hash, password):
+            login_throttle.success(username)
+            # Хеш со старыми параметрами KDF пересчитываем с текущими
+            if password_hasher.needs_rehash(user.password_hash):
+                user.password_hash = password_hasher.hash(password)
+                db.session.commit()
             login_user(user, remember=remember)
             flash('Вы успешно вошли в систему!', 'success')
             next_page = request.args.get('next')
             return redirect(next_page or url_for('index'))  # Редирект на запрошенную страницу или главную
         else:
+            login_throttle.failure(username)
             flash('Неверное имя пользователя или пароль.', 'danger')
     return render_template('login.html', next=request.args.get('next'))
 
@@ -117,11 +197,12 @@ def create_user():
     form = UserForm()
     form.role_id.choices = [(role.id, role.name) for role in Role.query.all()]  # Заполняем список ролей
     if form.validate_on_submit():
+        password_hash = password_hasher.hash(form.password.data)  # Хешируем пароль
         try:
             # Создаем нового пользователя
             user = User(
                 username=form.username.data,
-                password_hash=generate_password_hash(form.password.data),  # Хешируем пароль
+                password_hash=password_hash,
                 last_name=form.last_name.data,
                 first_name=form.first_name.data,
                 middle_name=form.middle_name.data,
@@ -192,7 +273,7 @@ def change_password():
         confirm_password = request.form['confirm_password']
 
         # Проверяем старый пароль
-        if not check_password_hash(current_user.password_hash, old_password):
+        if not password_hasher.check(current_user.password_hash, old_password):
             flash('Старый пароль неверен.', 'danger')
         elif new_password != confirm_password:
             flash('Новые пароли не совпадают.', 'danger')
@@ -200,7 +281,7 @@ def change_password():
             flash('Пароль должен быть от 8 до 128 символов.', 'danger')
         else:
             # Обновляем пароль
-            current_user.password_hash = generate_password_hash(new_password)
+            current_user.password_hash = password_hasher.hash(new_password)
             db.session.commit()
             flash('Пароль успешно изменён.', 'success')
             return redirect(url_for('index'))
@@ -244,40 +325,64 @@ def delete_role(role_id):
         flash('Роль успешно удалена.', 'success')
     return redirect(url_for('manage_roles'))
 
-# Инициализация базы данных перед первым запросом
-@app.before_request
-def initialize_database():
-    if not hasattr(app, 'db_initialized'):
-        db.create_all()  # Создаем таблицы, если их нет
-        app.db_initialized = True
-        
-        # Создаем тестовые роли, если их нет
-        if not Role.query.first():
-            roles = [
-                Role(name="Администратор", description="Полный доступ"),
-                Role(name="Пользователь", description="Ограниченный доступ")
-            ]
-            db.session.bulk_save_objects(roles)
-            db.session.commit()
-        
-        # Создаем тестового пользователя, если его нет
-        if not User.query.filter_by(username="user").first():
-            default_role = Role.query.filter_by(name="Пользователь").first()
-            default_user = User(
-                username="user",
-                password_hash=generate_password_hash("kBj-d53-huA-3zC", method='pbkdf2:sha256'),
-                first_name="Тест",
-                last_name="Пользователь",
-                middle_name="",
-                role_id=default_role.id
-            )
-            db.session.add(default_user)
-            db.session.commit()
-        print("Тестовые данные созданы: пользователь 'user' и роли.")
+# Подготовка базы данных (flask bootstrap) вне обработки запросов:
+# создание таблиц и загрузка ролей и пользователей из файлов fixtures/*.json
+# (или .jsonl/.csv) - общие с LAB5 функции web_common.fixtures.
+# Повторный запуск ничего не дублирует; хеш считается один раз на каждый различный пароль.
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def seed_roles(records):
+    return fixtures.seed_roles(db.session, Role, records)
+
+
+def seed_users(records):
+    return fixtures.seed_users(db.session, User, Role, records, password_hasher.method)
+
+
+def bootstrap_database():
+    db.create_all()  # Создаем таблицы, если их нет
+    ensure_user_search(db.session)
+    roles = seed_roles(read_fixture(os.path.join(FIXTURES_DIR, 'roles.json')))
+    users = seed_users(read_fixture(os.path.join(FIXTURES_DIR, 'users.json')))
+    return roles, users
+
+
+@app.cli.command('bootstrap')
+@click.option('--users', 'users_file', type=click.Path(exists=True, dir_okay=False),
+              help='Дополнительный файл пользователей (.json, .jsonl, .csv).')
+def bootstrap_command(users_file):
+    started = time.perf_counter()
+    roles, users = bootstrap_database()
+    if users_file:
+        users += seed_users(read_fixture(users_file))
+    click.echo(f'Схема готова. Добавлено ролей: {roles}, пользователей: {users} '
+               f'за {time.perf_counter() - started:.2f} с.')
+
+
+# Время запуска (flask startup-timing, как в LAB5): приложение создаётся при импорте модуля,
+# поэтому модуль загружается заново под другим именем - как при старте воркера
+@app.cli.command('startup-timing')
+@click.option('--path', 'paths', multiple=True, default=['/', '/login'], show_default=True,
+              help='Страницы для первых запросов.')
+def startup_timing_command(paths):
+    started = time.perf_counter()
+    spec = importlib.util.spec_from_file_location('startup_timing_app', os.path.abspath(__file__))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    click.echo(f'Создание приложения: {(time.perf_counter() - started) * 1000:.1f} мс')
+    client = module.app.test_client()
+    for attempt in ('первый', 'второй'):
+        for path in paths:
+            started = time.perf_counter()
+            status = client.get(path).status_code
+            click.echo(f'{path} ({attempt} запрос, {status}): {(time.perf_counter() - started) * 1000:.1f} мс')
 
 
 # Запуск приложения в режиме отладки
 if __name__ == '__main__':
+    with app.app_context():
+        bootstrap_database()  # Для локального запуска - то же, что flask bootstrap
     app.run(debug=True)
 
 
@@ -1,10 +1,17 @@
 # Импорт необходимых модулей и компонентов
-from flask import Flask, render_template, send_from_directory
+from flask import Flask, abort, render_template
 from flask_migrate import Migrate
+import sqlalchemy as sa
 from sqlalchemy.exc import SQLAlchemyError
-from models import db, Category, Image  # Модели БД
+from web_common.passwords import HasherBusy  # Переполнение очереди хеширования паролей
+from models import db, Course, Review  # Модели БД
 from auth import bp as auth_bp, init_login_manager  # Авторизация
 from courses import bp as courses_bp  # Логика курсов
+from course_search import ensure_course_search  # Полнотекстовый индекс курсов
+from count_cache import count_cache  # Кэш числа записей для пагинации
+from category_tree import category_cache  # Дерево категорий в памяти
+from image_cache import image_cache  # Метаданные изображений для /images/<image_id>
+from web_common import request_timing  # Число и время SQL-запросов, бюджеты и поиск N+1
 
 # Создание Flask-приложения
 app = Flask(__name__)
@@ -19,6 +26,20 @@ migrate = Migrate(app, db)
 
 # Настройка менеджера аутентификации
 init_login_manager(app)
+count_cache.init_app(app)
+category_cache.init_app(app)
+image_cache.init_app(app)
+request_timing.init_app(app)
+
+# Полнотекстовый индекс курсов и триггеры его обновления (создаются один раз),
+# индексы курсорной пагинации для базы, созданной до их появления в моделях
+with app.app_context():
+    request_timing.install_db_timer(db.engine)
+    ensure_course_search()
+    if sa.inspect(db.engine).has_table('courses'):
+        for table in (Course.__table__, Review.__table__):
+            for index in table.indexes:
+                index.create(db.engine, checkfirst=True)  # CREATE INDEX только если его ещё нет
 
 # Обработчик ошибок SQLAlchemy (БД)
 @app.errorhandler(SQLAlchemyError)
@@ -27,6 +48,11 @@ def handle_sqlalchemy_error(err):
                  'Повторите попытку позже.')
     return f'{error_msg} (Подробнее: {err})', 500  # Возврат ошибки 500
 
+# Обработчик переполнения очереди хеширования паролей
+@app.errorhandler(HasherBusy)
+def handle_hasher_busy(err):
+    return 'Сервер перегружен. Повторите попытку позже.', 503, {'Retry-After': '5'}
+
 # Регистрация модулей приложения)
 app.register_blueprint(auth_bp)  # Авторизация
 app.register_blueprint(courses_bp)  # Курсы
@@ -34,15 +60,17 @@ app.register_blueprint(courses_bp)  # Курсы
 # Главная страница
 @app.route('/')
 def index():
-    # Получаем все категории из БД
-    categories = db.session.execute(db.select(Category)).scalars()
+    # Категории из дерева в памяти (без запроса к БД)
+    categories = category_cache.tree().nodes
     # Рендерим шаблон index.html, передавая категории
     return render_template('index.html', categories=categories)
 
 # Загрузка изображения по ID
 @app.route('/images/<image_id>')
 def image(image_id):
-    # Получаем изображение из БД или возвращаем 404
-    img = db.get_or_404(Image, image_id)
-    # Отправляем файл из папки загрузок
-    return send_from_directory(app.config['UPLOAD_FOLDER'], img.storage_filename)
\ No newline at end of file
+    # Метаданные файла - из кэша в памяти (запрос к БД только при первом обращении) или 404
+    entry = image_cache.get(image_id)
+    if entry is None:
+        abort(404)
+    # 304, перенаправление на веб-сервер (X-Sendfile / X-Accel-Redirect) или файл из папки загрузок
+    return image_cache.response(entry)
\ No newline at end of file
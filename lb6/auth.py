@@ -1,6 +1,9 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request
-from flask_login import LoginManager, login_user, logout_user, login_required
+from functools import wraps
+from flask import Blueprint, current_app, render_template, redirect, url_for, flash, request, jsonify
+from flask_login import LoginManager, current_user, login_user, logout_user, login_required
 from models import db, User
+from web_common.identity_cache import identity_cache  # LRU+TTL кэш пользователей для load_user
+from web_common.passwords import password_hasher, login_throttle  # Пул хеширования паролей и ограничение входа
 
 bp = Blueprint('auth', __name__, url_prefix='/auth')
 
@@ -11,9 +14,25 @@ def init_login_manager(app):
     login_manager.login_message_category = 'warning'
     login_manager.user_loader(load_user)
     login_manager.init_app(app)
+    identity_cache.init_app(app)
+    password_hasher.init_app(app)
+    login_throttle.init_app(app)
 
+# user_id - строка "id:версия_пароля" из User.get_id; найденный пользователь
+# хранится в identity_cache отсоединённым от сессии
 def load_user(user_id):
-    user = db.session.execute(db.select(User).filter_by(id=user_id)).scalar()
+    user = identity_cache.get(user_id)
+    if user is not None:
+        return user
+    id_part, _, version = user_id.partition(':')
+    if not id_part.isdigit():
+        return None
+    user = db.session.execute(db.select(User).filter_by(id=int(id_part))).scalar()
+    # Сессии, выданные до смены пароля, больше не действительны
+    if user is None or (version and version != user.password_version):
+        return None
+    db.session.expunge(user)
+    identity_cache.set(user_id, user)
     return user
 
 @bp.route('/login', methods=['GET', 'POST'])
@@ -22,12 +41,23 @@ def login():
         login = request.form.get('login')
         password = request.form.get('password')
         if login and password:
+            # Ограничение частоты попыток входа
+            wait = login_throttle.attempt(request.remote_addr, login)
+            if wait:
+                flash(f'Слишком много попыток входа. Повторите через {wait} с.', 'danger')
+                return render_template('auth/login.html'), 429, {'Retry-After': str(wait)}
             user = db.session.execute(db.select(User).filter_by(login=login)).scalar()
             if user and user.check_password(password):
+                login_throttle.success(login)
+                # Хеш со старыми параметрами KDF пересчитывается с текущими
+                if user.password_needs_rehash():
+                    user.set_password(password)
+                    db.session.commit()
                 login_user(user)
                 flash('Вы успешно аутентифицированы.', 'success')
                 next = request.args.get('next')
                 return redirect(next or url_for('index'))
+            login_throttle.failure(login)
         flash('Введены неверные логин и/или пароль.', 'danger')
     return render_template('auth/login.html')
 
@@ -36,3 +66,28 @@ def login():
 def logout():
     logout_user()
     return redirect(url_for('index'))
+
+
+# Доступ только администраторам - пользователям с логином из ADMIN_LOGINS (ролей в lb6 нет)
+def admin_required(func):
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if current_user.login not in current_app.config['ADMIN_LOGINS']:
+            flash('У вас недостаточно прав для доступа к данной странице.', 'danger')
+            return redirect(url_for('index'))
+        return func(*args, **kwargs)
+    return wrapper
+
+# Метрики пула хеширования паролей (глубина очереди, задержки) и ограничения входа
+@bp.route('/password_stats')
+@login_required
+@admin_required
+def password_stats():
+    return jsonify(hasher=password_hasher.stats(), throttle=login_throttle.stats())
+
+# Метрики кэша пользователей (попадания, промахи, вытеснения)
+@bp.route('/cache_stats')
+@login_required
+@admin_required
+def cache_stats():
+    return jsonify(identity_cache.stats())
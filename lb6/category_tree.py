@@ -0,0 +1,138 @@
+# Дерево категорий курсов в памяти процесса.
+# - CategoryTree: неизменяемый снимок таблицы categories с номером версии: категории в
+#   порядке обхода дерева (с глубиной для выпадающих списков), индексы родителя и детей
+#   и заранее посчитанные множества "категория и все её потомки".
+# - CategoryCache: снимок загружается одним запросом при первом обращении и сбрасывается
+#   после фиксации транзакции, изменившей категории через ORM; другие процессы
+#   перечитывают дерево не реже чем раз в CATEGORY_CACHE_TTL секунд. Курсы фильтра по
+#   категории с потомками зависят от дерева, поэтому count_cache сбрасывает числа
+#   каталога при тех же изменениях.
+# - descendant_ids_query: те же множества рекурсивным CTE - для фильтра, пока снимок
+#   ещё не загружен (не тратить запрос на всё дерево ради одного фильтра).
+
+import threading
+import time
+from collections import namedtuple
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from models import db, Category
+
+# Категория снимка; depth - уровень вложенности (0 - корневая)
+CategoryNode = namedtuple('CategoryNode', 'id name parent_id depth')
+
+
+class CategoryTree:
+    def __init__(self, rows, version):
+        self.version = version
+        self.loaded_at = time.monotonic()
+        by_id = {row.id: row for row in rows}
+        children = {}
+        for row in rows:
+            # Родитель, которого нет в таблице, - категория считается корневой
+            parent_id = row.parent_id if row.parent_id in by_id else None
+            children.setdefault(parent_id, []).append(row.id)
+        self.parents = {row.id: row.parent_id for row in rows}
+        self.children = {key: tuple(sorted(ids, key=lambda i: (by_id[i].name, i))) for key, ids in children.items()}
+
+        # Обход в глубину от корней: порядок для списков и множества потомков.
+        # Узлы, недостижимые от корней (цикл parent_id), в дерево не попадают.
+        self.nodes = []
+        descendants = {}
+        stack = [(category_id, 0, False) for category_id in reversed(self.children.get(None, ()))]
+        while stack:
+            category_id, depth, done = stack.pop()
+            if done:
+                ids = {category_id}
+                for child_id in self.children.get(category_id, ()):
+                    ids |= descendants[child_id]
+                descendants[category_id] = frozenset(ids)
+                continue
+            row = by_id[category_id]
+            self.nodes.append(CategoryNode(row.id, row.name, row.parent_id, depth))
+            stack.append((category_id, depth, True))
+            for child_id in reversed(self.children.get(category_id, ())):
+                stack.append((child_id, depth + 1, False))
+        self.descendants = descendants
+        self.by_id = {node.id: node for node in self.nodes}
+
+    # Категории и все их потомки; неизвестные id пропускаются
+    def descendant_ids(self, category_ids):
+        ids = set()
+        for category_id in category_ids:
+            ids |= self.descendants.get(category_id, frozenset())
+        return ids
+
+
+class CategoryCache:
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._tree = None
+        self._version = 0
+        self.ttl = 300
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('CATEGORY_CACHE_TTL', 300)  # Секунд до принудительной перезагрузки снимка
+        self.ttl = app.config['CATEGORY_CACHE_TTL']
+        app.extensions['category_cache'] = self
+
+    def _fresh(self, tree):
+        return tree is not None and time.monotonic() - tree.loaded_at <= self.ttl
+
+    # Текущий снимок; при отсутствии или устаревании - загрузка одним запросом
+    def tree(self):
+        tree = self._tree
+        if not self._fresh(tree):
+            with self._lock:
+                tree = self._tree
+                if not self._fresh(tree):
+                    rows = db.session.execute(
+                        select(Category.id, Category.name, Category.parent_id)).all()
+                    tree = CategoryTree(rows, self._version)
+                    self._tree = tree
+        return tree
+
+    # Загруженный и не устаревший снимок без обращения к БД; None, если его нет
+    def peek(self):
+        tree = self._tree
+        return tree if self._fresh(tree) else None
+
+    def invalidate(self):
+        with self._lock:
+            self._version += 1
+            self._tree = None
+
+    @property
+    def version(self):
+        return self._version
+
+
+category_cache = CategoryCache()
+
+
+# Подзапрос id категорий category_ids и всех их потомков (рекурсивный CTE)
+def descendant_ids_query(category_ids):
+    tree = select(Category.id).where(Category.id.in_(category_ids)).cte('category_tree', recursive=True)
+    tree = tree.union(select(Category.id).where(Category.parent_id == tree.c.id))
+    return select(tree.c.id)
+
+
+# Изменение категорий через ORM сбрасывает снимок после фиксации
+@event.listens_for(Session, 'after_flush')
+def _collect_changes(session, flush_context):
+    if any(isinstance(obj, Category) for obj in list(session.new) + list(session.dirty) + list(session.deleted)):
+        session.info['category_tree_changed'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_changes(session):
+    if session.info.pop('category_tree_changed', False):
+        category_cache.invalidate()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_changes(session):
+    session.info.pop('category_tree_changed', None)
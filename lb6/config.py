@@ -2,8 +2,22 @@ import os
 
 SECRET_KEY = 'secret-key'
 
-SQLALCHEMY_DATABASE_URI = 'sqlite:///project.db' # Путь к SQL
+# Путь к SQL; DATABASE_URL - другая БД (например, временная для тестов)
+SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'sqlite:///project.db')
 SQLALCHEMY_ECHO = True
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
-UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'media', 'images')
\ No newline at end of file
+# Логины администраторов: служебные страницы (/auth/password_stats и др.)
+ADMIN_LOGINS = [login for login in os.environ.get('ADMIN_LOGINS', '').split(',') if login]
+
+UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'media', 'images')
+
+# Допустимое число SQL-запросов на страницу (request_timing): с запасом на загрузку
+# пользователя при промахе identity_cache и дерева категорий при промахе category_cache
+QUERY_BUDGETS = {
+    'index': 2,
+    'courses.index': 4,
+    'courses.show': 3,
+    'courses.reviews': 4,
+    'courses.new': 3,
+}
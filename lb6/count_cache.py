@@ -0,0 +1,116 @@
+# Кэш числа записей для пагинации каталога и отзывов.
+# - Ключ - нормализованный фильтр: ('courses', слова поиска, категории, с подкатегориями)
+#   или ('reviews', id курса); значение - результат COUNT(*) по фильтру.
+# - LRU с ограниченным временем жизни (COUNT_CACHE_SIZE, COUNT_CACHE_TTL).
+# - После фиксации транзакции, изменившей курсы или категории (через ORM; от дерева
+#   категорий зависит фильтр с подкатегориями), сбрасываются все ключи 'courses',
+#   изменившей отзывы - ключи 'reviews' их курсов. Изменения в других процессах
+#   и запросы в обход ORM видны не позже чем через TTL, поэтому число на страницах
+#   показывается как приблизительное.
+
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event, func, inspect, select
+from sqlalchemy.orm import Session
+
+from course_search import TOKEN_RE
+from models import db, Category, Course, Review
+
+# Колонки курса, от которых зависит число курсов фильтра (рейтинг при отзыве - нет)
+FILTERED_COURSE_COLUMNS = ('name', 'short_desc', 'full_desc', 'category_id')
+
+
+class CountCache:
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # Ключ -> (время записи, число)
+        self.maxsize = 1000
+        self.ttl = 300
+        self.hits = 0
+        self.misses = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('COUNT_CACHE_SIZE', 1000)
+        app.config.setdefault('COUNT_CACHE_TTL', 300)  # Секунд, верхняя граница устаревания числа
+        self.maxsize = app.config['COUNT_CACHE_SIZE']
+        self.ttl = app.config['COUNT_CACHE_TTL']
+        app.extensions['count_cache'] = self
+
+    # Число записей запроса query по ключу key (COUNT(*) только при промахе)
+    def count(self, key, query):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] <= self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        total = db.session.execute(
+            select(func.count()).select_from(query.order_by(None).subquery())).scalar()
+        with self._lock:
+            self._entries[key] = (time.monotonic(), total)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return total
+
+    # Сброс ключей, для которых match(key) истинно
+    def invalidate(self, match):
+        with self._lock:
+            for key in [k for k in self._entries if match(k)]:
+                del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses, 'ttl': self.ttl}
+
+
+count_cache = CountCache()
+
+
+# Ключ каталога: слова поиска без учёта регистра и порядка, категории - отсортированные id
+def courses_key(name, category_ids, subcategories=False):
+    words = tuple(sorted(set(TOKEN_RE.findall((name or '').lower()))))
+    return 'courses', words, tuple(sorted({str(x) for x in category_ids or ()})), bool(subcategories)
+
+
+def reviews_key(course_id):
+    return 'reviews', course_id
+
+
+# Изменённые в сессии курсы и отзывы запоминаются при flush, кэш сбрасывается после
+# фиксации: до COMMIT другой запрос мог бы снова закэшировать старое число
+@event.listens_for(Session, 'after_flush')
+def _collect_changes(session, flush_context):
+    changed = session.info.setdefault('count_cache_changes', set())
+    for obj in list(session.new) + list(session.deleted):
+        if isinstance(obj, (Course, Category)):
+            changed.add(('courses',))
+        elif isinstance(obj, Review):
+            changed.add(reviews_key(obj.course_id))
+    for obj in session.dirty:
+        if isinstance(obj, Category):
+            changed.add(('courses',))
+        elif isinstance(obj, Course):
+            state = inspect(obj)
+            if any(state.attrs[name].history.has_changes() for name in FILTERED_COURSE_COLUMNS):
+                changed.add(('courses',))
+        elif isinstance(obj, Review):
+            changed.add(reviews_key(obj.course_id))
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_changes(session):
+    changed = session.info.pop('count_cache_changes', None)
+    if not changed:
+        return
+    count_cache.invalidate(lambda key: key[:1] in changed or key in changed)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_changes(session):
+    session.info.pop('count_cache_changes', None)
@@ -0,0 +1,81 @@
+# Полнотекстовый поиск курсов для каталога.
+# - courses_fts: индекс SQLite FTS5 по названию, краткому и полному описанию с внешним
+#   содержимым (content='courses'): текст хранится только в таблице courses, индекс
+#   поддерживается триггерами на INSERT/UPDATE/DELETE, поэтому синхронен при любой записи.
+# - Строка поиска превращается в префиксный MATCH ("прог" найдёт "Программирование"),
+#   все слова должны встретиться (AND). Токенизатор unicode61 без учёта регистра и
+#   диакритики; префиксные индексы на 2 и 3 символа ускоряют короткие префиксы.
+# - Ранжирование bm25 с весами колонок: совпадение в названии важнее, чем в описаниях.
+# - Индекс создаётся при запуске приложения (ensure_course_search), если его ещё нет,
+#   и заполняется из таблицы courses.
+
+import re
+
+from sqlalchemy import text
+
+from models import db
+
+# Веса bm25 для name, short_desc, full_desc
+RANK_WEIGHTS = (10.0, 4.0, 1.0)
+
+FTS_DDL = (
+    """CREATE VIRTUAL TABLE IF NOT EXISTS courses_fts USING fts5(
+        name, short_desc, full_desc,
+        content='courses', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3')""",
+    """CREATE TRIGGER IF NOT EXISTS courses_fts_ai AFTER INSERT ON courses BEGIN
+        INSERT INTO courses_fts(rowid, name, short_desc, full_desc)
+        VALUES (new.id, new.name, new.short_desc, new.full_desc);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS courses_fts_ad AFTER DELETE ON courses BEGIN
+        INSERT INTO courses_fts(courses_fts, rowid, name, short_desc, full_desc)
+        VALUES ('delete', old.id, old.name, old.short_desc, old.full_desc);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS courses_fts_au
+        AFTER UPDATE OF name, short_desc, full_desc ON courses BEGIN
+        INSERT INTO courses_fts(courses_fts, rowid, name, short_desc, full_desc)
+        VALUES ('delete', old.id, old.name, old.short_desc, old.full_desc);
+        INSERT INTO courses_fts(rowid, name, short_desc, full_desc)
+        VALUES (new.id, new.name, new.short_desc, new.full_desc);
+    END""",
+)
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+def _table_exists(name):
+    return db.session.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name").bindparams(name=name)).first()
+
+
+# Создание индекса и триггеров; новый индекс заполняется из таблицы courses.
+# До применения миграций (таблицы courses ещё нет) ничего не делает.
+def ensure_course_search():
+    if not _table_exists('courses'):
+        return
+    exists = _table_exists('courses_fts')
+    for ddl in FTS_DDL:
+        db.session.execute(text(ddl))
+    if not exists:
+        db.session.execute(text("INSERT INTO courses_fts(courses_fts) VALUES ('rebuild')"))
+    db.session.commit()
+
+
+# Выражение MATCH из строки поиска; None, если в строке нет ни одного слова
+def match_expression(q):
+    tokens = TOKEN_RE.findall(q or '')
+    if not tokens:
+        return None
+    return ' '.join('"%s"*' % token for token in tokens)
+
+
+# id подходящих курсов (для фильтра без ранжирования)
+def matching_ids(match):
+    return text('SELECT rowid FROM courses_fts WHERE courses_fts MATCH :match').bindparams(match=match)
+
+
+# Подзапрос (id, rank) подходящих курсов; меньший rank - более релевантный курс
+def ranked_matches(match):
+    ranked = text('SELECT rowid AS id, bm25(courses_fts, %s) AS rank FROM courses_fts '
+                  'WHERE courses_fts MATCH :match' % ', '.join(map(str, RANK_WEIGHTS))).bindparams(match=match)
+    return ranked.columns(id=db.Integer, rank=db.Float).subquery()
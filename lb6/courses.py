@@ -2,9 +2,15 @@
 from flask import Blueprint, render_template, request, flash, redirect, url_for
 from flask_login import login_required, current_user  # Для работы с аутентификацией
 from sqlalchemy.exc import IntegrityError  # Ошибки целостности БД
-from models import db, Course, Category, User, Review  # Модели данных
+from models import db, Course, User, Review  # Модели данных
 from tools import CoursesFilter, ImageSaver  # Вспомогательные инструменты
 from sqlalchemy import desc  # Сортировка по убыванию
+from sqlalchemy.orm import joinedload  # Жадная загрузка связей (без запроса на строку)
+from pagination import KeysetPagination  # Курсорная пагинация
+from count_cache import count_cache, courses_key, reviews_key  # Кэш числа записей фильтра
+from category_tree import category_cache  # Дерево категорий в памяти
+
+MAX_PER_PAGE = 100  # Верхняя граница per_page из запроса
 
 # Создание Blueprint для маршрутов курсов
 bp = Blueprint('courses', __name__, url_prefix='/courses')
@@ -21,20 +27,32 @@ def params():
 # Функция для получения параметров поиска
 def search_params():
     return {
-        'name': request.args.get('name'),  # Поиск по названию
+        'name': request.args.get('name'),  # Поиск по названию и описаниям
         'category_ids': [x for x in request.args.getlist('category_ids') if x],  # Фильтр по категориям
+        'order': request.args.get('order', 'relevance'),  # При поиске - по релевантности или новые первыми
+        'subcategories': request.args.get('subcategories', 0, type=int),  # 1 - вместе с подкатегориями
     }
 
+# Размер страницы из запроса
+def per_page(default):
+    return max(1, min(request.args.get('per_page', default, type=int), MAX_PER_PAGE))
+
 # Главная страница со списком курсов
 @bp.route('/')
 def index():
+    # Категории для фильтра - из дерева в памяти (в порядке обхода, с глубиной);
+    # загруженное дерево даёт фильтру готовые множества подкатегорий
+    categories = category_cache.tree().nodes
     # Применяем фильтры к курсам
-    courses = CoursesFilter(**search_params()).perform()
-    # Пагинация результатов
-    pagination = db.paginate(courses)
+    courses_filter = CoursesFilter(**search_params())
+    courses = courses_filter.perform()
+    # Курсорная пагинация по ключу сортировки; общее число - из кэша по нормализованному фильтру
+    columns, descending = courses_filter.sort_key()
+    total = count_cache.count(courses_key(courses_filter.name, courses_filter.category_ids,
+                                          courses_filter.subcategories), courses)
+    pagination = KeysetPagination(courses, columns, cursor=request.args.get('cursor'),
+                                  per_page=per_page(20), descending=descending, total=total)
     courses = pagination.items
-    # Получаем все категории для фильтра
-    categories = db.session.execute(db.select(Category)).scalars()
     return render_template('courses/index.html',
                            courses=courses,
                            categories=categories,
@@ -48,7 +66,7 @@ def new():
     # Создаем пустой курс
     course = Course()
     # Получаем все категории и пользователей для выбора
-    categories = db.session.execute(db.select(Category)).scalars()
+    categories = category_cache.tree().nodes
     users = db.session.execute(db.select(User)).scalars()
     return render_template('courses/new.html',
                            categories=categories,
@@ -78,7 +96,7 @@ def create():
         flash(f'Возникла ошибка при записи данных в БД. Проверьте корректность введённых данных. ({err})', 'danger')
         db.session.rollback()
         # Повторно показываем форму с введенными данными
-        categories = db.session.execute(db.select(Category)).scalars()
+        categories = category_cache.tree().nodes
         users = db.session.execute(db.select(User)).scalars()
         return render_template('courses/new.html',
                             categories=categories,
@@ -96,18 +114,19 @@ def reviews(course_id):
     course = db.get_or_404(Course, course_id)
     # Параметр сортировки отзывов
     sort_order = request.args.get('sort', 'new')
-    query = db.select(Review).filter_by(course_id=course_id)
+    query = db.select(Review).filter_by(course_id=course_id).options(joinedload(Review.user))
 
-    # Применяем сортировку
+    # Ключ сортировки для курсорной пагинации (id - для однозначного порядка)
     if sort_order == 'positive':
-        query = query.order_by(Review.rating.desc())  # Сначала положительные
+        columns, descending = (Review.rating, Review.created_at, Review.id), True  # Сначала положительные
     elif sort_order == 'negative':
-        query = query.order_by(Review.rating.asc())  # Сначала отрицательные
+        columns, descending = (Review.rating, Review.created_at, Review.id), False  # Сначала отрицательные
     else:
-        query = query.order_by(desc(Review.created_at))  #  новые
+        columns, descending = (Review.created_at, Review.id), True  #  новые
 
-    # Пагинация отзывов
-    pagination = db.paginate(query)
+    # Курсорная пагинация отзывов; число отзывов курса - из кэша
+    pagination = KeysetPagination(query, columns, cursor=request.args.get('cursor'), per_page=per_page(20),
+                                  descending=descending, total=count_cache.count(reviews_key(course_id), query))
     reviews = pagination.items
 
     # Обработка отправки нового отзыва
@@ -141,10 +160,11 @@ def reviews(course_id):
 # Страница просмотра курса
 @bp.route('/<int:course_id>')
 def show(course_id):
-    # Получаем курс или 404
-    course = db.get_or_404(Course, course_id)
-    # Получаем 5 последних отзывов
+    # Получаем курс или 404 вместе с фоном и автором (категория загружается всегда)
+    course = db.get_or_404(Course, course_id, options=[joinedload(Course.bg_image), joinedload(Course.author)])
+    # Получаем 5 последних отзывов с их авторами
     reviews = db.session.execute(
-        db.select(Review).filter_by(course_id=course_id).order_by(desc(Review.created_at)).limit(5)
+        db.select(Review).filter_by(course_id=course_id).options(joinedload(Review.user))
+        .order_by(desc(Review.created_at)).limit(5)
     ).scalars()
     return render_template('courses/show.html', course=course, reviews=reviews)
\ No newline at end of file
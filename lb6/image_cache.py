@@ -0,0 +1,110 @@
+# Раздача загруженных изображений (/images/<image_id>) без запросов к БД.
+# - ImageCache: метаданные файлов в памяти процесса, id -> ImageFile(имя в хранилище,
+#   MIME-тип, размер, ETag). Изображение с данным id не меняется (id - UUID, файл
+#   записывается один раз), поэтому записи не устаревают; LRU ограничивает только
+#   размер (IMAGE_CACHE_SIZE). Запись заполняется при первом обращении к изображению
+#   или сразу при загрузке (ImageSaver), отсутствующие id не кэшируются.
+# - ETag сильный - md5 содержимого файла из таблицы images; ответ кэшируется клиентом
+#   и прокси надолго: Cache-Control: public, max-age=IMAGE_MAX_AGE, immutable.
+#   Повторный запрос с совпадающим If-None-Match получает 304 без обращения к диску.
+# - IMAGE_SENDFILE: None - файл отдаёт приложение; 'x-sendfile' - заголовок X-Sendfile
+#   с полным путём (Apache mod_xsendfile, lighttpd); 'x-accel-redirect' - заголовок
+#   X-Accel-Redirect с путём IMAGE_ACCEL_PREFIX + имя файла для internal-location nginx,
+#   которая смотрит в UPLOAD_FOLDER (ETag приложения сохраняется при etag off в ней).
+
+import os
+import threading
+from collections import OrderedDict, namedtuple
+
+from flask import current_app, request
+from sqlalchemy import select
+from werkzeug.utils import send_file
+
+from models import db, Image
+
+ImageFile = namedtuple('ImageFile', 'storage_filename mime_type size etag')
+
+SENDFILE_MODES = (None, 'x-sendfile', 'x-accel-redirect')
+
+
+class ImageCache:
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # id -> ImageFile
+        self.maxsize = 10000
+        self.hits = 0
+        self.misses = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('IMAGE_CACHE_SIZE', 10000)
+        app.config.setdefault('IMAGE_MAX_AGE', 365 * 24 * 3600)  # Секунд, для Cache-Control
+        app.config.setdefault('IMAGE_SENDFILE', None)  # None, 'x-sendfile' или 'x-accel-redirect'
+        app.config.setdefault('IMAGE_ACCEL_PREFIX', '/protected-images/')  # internal-location nginx
+        if app.config['IMAGE_SENDFILE'] not in SENDFILE_MODES:
+            raise ValueError('IMAGE_SENDFILE: ожидается одно из %r' % (SENDFILE_MODES,))
+        self.maxsize = app.config['IMAGE_CACHE_SIZE']
+        app.extensions['image_cache'] = self
+
+    # Метаданные изображения; None, если его нет в БД или файл не найден
+    def get(self, image_id):
+        with self._lock:
+            entry = self._entries.get(image_id)
+            if entry is not None:
+                self._entries.move_to_end(image_id)
+                self.hits += 1
+                return entry
+            self.misses += 1
+        row = db.session.execute(
+            select(Image.id, Image.file_name, Image.mime_type, Image.md5_hash).where(Image.id == image_id)).first()
+        if row is None:
+            return None
+        _, ext = os.path.splitext(row.file_name)
+        return self._put(row.id, row.id + ext, row.mime_type, row.md5_hash)
+
+    # Запись только что сохранённого изображения (не ждать первого обращения)
+    def add(self, img):
+        return self._put(img.id, img.storage_filename, img.mime_type, img.md5_hash)
+
+    def _put(self, image_id, storage_filename, mime_type, md5_hash):
+        try:
+            size = os.path.getsize(os.path.join(current_app.config['UPLOAD_FOLDER'], storage_filename))
+        except OSError:
+            return None
+        entry = ImageFile(storage_filename, mime_type or 'application/octet-stream', size, md5_hash)
+        with self._lock:
+            self._entries[image_id] = entry
+            self._entries.move_to_end(image_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return entry
+
+    # Ответ на запрос изображения: 304, перенаправление на веб-сервер или сам файл
+    def response(self, entry):
+        config = current_app.config
+        mode = config['IMAGE_SENDFILE']
+        if request.if_none_match.contains_weak(entry.etag):
+            rv = current_app.response_class(status=304)
+        elif mode == 'x-accel-redirect':
+            rv = current_app.response_class(mimetype=entry.mime_type)
+            rv.headers['X-Accel-Redirect'] = config['IMAGE_ACCEL_PREFIX'].rstrip('/') + '/' + entry.storage_filename
+        else:
+            # Условные запросы с Range обрабатывает send_file (If-None-Match уже проверен выше)
+            rv = send_file(os.path.join(config['UPLOAD_FOLDER'], entry.storage_filename), request.environ,
+                           mimetype=entry.mime_type, etag=entry.etag, last_modified=None,
+                           use_x_sendfile=mode == 'x-sendfile', response_class=current_app.response_class,
+                           conditional=True, max_age=None)
+        rv.set_etag(entry.etag)
+        rv.cache_control.no_cache = None
+        rv.cache_control.public = True
+        rv.cache_control.max_age = config['IMAGE_MAX_AGE']
+        rv.cache_control.immutable = True
+        return rv
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+image_cache = ImageCache()
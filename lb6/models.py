@@ -1,9 +1,10 @@
 # Импорт необходимых модулей
 import os
+import hashlib  # Отпечаток хеша пароля для идентификатора сессии
 from typing import Optional, Union, List  # Аннотации типов
 from datetime import datetime  # Работа с датой и временем
 import sqlalchemy as sa  # SQLAlchemy core
-from werkzeug.security import check_password_hash, generate_password_hash  # Хеширование паролей
+from web_common.passwords import password_hasher  # Хеширование паролей в пуле процессов
 from flask_login import UserMixin  # Миксин для пользователей Flask-Login
 from flask import url_for  # Генерация URL
 from flask_sqlalchemy import SQLAlchemy  # Flask-SQLAlchemy интеграция
@@ -52,11 +53,24 @@ class User(Base, UserMixin):
 
     # Установка пароля (с хешированием)
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
 
     # Проверка пароля
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return password_hasher.check(self.password_hash, password)
+
+    # Хеш создан с устаревшими параметрами KDF
+    def password_needs_rehash(self):
+        return password_hasher.needs_rehash(self.password_hash)
+
+    # Версия пароля - короткий отпечаток хеша; меняется при смене пароля
+    @property
+    def password_version(self):
+        return hashlib.sha1(self.password_hash.encode()).hexdigest()[:8]
+
+    # Идентификатор в сессии включает версию пароля: смена пароля завершает другие сессии
+    def get_id(self):
+        return f'{self.id}:{self.password_version}'
 
     # Полное имя пользователя (фамилия + имя + отчество)
     @property
@@ -70,6 +84,8 @@ class User(Base, UserMixin):
 # Модель курса
 class Course(Base):
     __tablename__ = 'courses'
+    # Индекс курсорной пагинации каталога (новые первыми)
+    __table_args__ = (sa.Index('ix_courses_created_at_id', 'created_at', 'id'),)
 
     id: Mapped[int] = mapped_column(primary_key=True)  # ID курса
     name: Mapped[str] = mapped_column(String(100))  # Название курса
@@ -128,6 +144,11 @@ class Image(db.Model):
 # Модель отзыва о курсе
 class Review(Base):
     __tablename__ = 'reviews'
+    # Индексы курсорной пагинации отзывов курса по новизне и по оценке
+    __table_args__ = (
+        sa.Index('ix_reviews_course_id_created_at_id', 'course_id', 'created_at', 'id'),
+        sa.Index('ix_reviews_course_id_rating_created_at_id', 'course_id', 'rating', 'created_at', 'id'),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)  # ID отзыва
     rating: Mapped[int] = mapped_column(nullable=False)  # Оценка (1-5)
@@ -0,0 +1,71 @@
+# Курсорная (keyset) пагинация для каталога курсов и отзывов.
+# - KeysetPagination: страница записей с непрозрачными токенами next/prev вместо номера
+#   страницы. Не использует OFFSET и COUNT(*): каждая страница - условие по ключу
+#   сортировки и поиск по составному индексу.
+# - Ключ - колонки сортировки (например, created_at, id) с общим направлением; последняя
+#   колонка - id, чтобы порядок был однозначным. Значения ключа выбираются вместе с
+#   записями, поэтому ключом может быть и вычисляемая колонка (ранг поиска).
+# - Общее число записей страница не считает: total передаётся извне (см. count_cache).
+
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import DateTime, tuple_
+
+from models import db
+
+
+def encode_cursor(direction, values):
+    raw = json.dumps([direction] + [v.isoformat() if isinstance(v, datetime) else v for v in values]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+# Разбор токена по колонкам ключа; для некорректного токена возвращается None (первая страница)
+def decode_cursor(token, columns):
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        direction, *values = json.loads(raw)
+        if direction not in ('next', 'prev') or len(values) != len(columns):
+            return None
+        return direction, tuple(datetime.fromisoformat(value) if isinstance(column.type, DateTime) else value
+                                for column, value in zip(columns, values))
+    except (ValueError, TypeError, AttributeError):
+        return None
+
+
+class KeysetPagination:
+    def __init__(self, query, columns, cursor=None, per_page=10, descending=True, total=None):
+        self.per_page = per_page
+        self.total = total  # Приблизительное число записей фильтра (None - неизвестно)
+        self._columns = columns
+        self._descending = descending
+        position = decode_cursor(cursor, columns)
+
+        if position is None or position[0] == 'next':
+            rows = self._fetch(query, 'next', position[1] if position else None, per_page + 1)
+            page = rows[:per_page]
+            self.has_prev = position is not None and bool(page)
+            self.has_next = len(rows) > per_page
+        else:
+            # Назад: берём записи перед курсором в обратном порядке и разворачиваем
+            rows = self._fetch(query, 'prev', position[1], per_page + 1)
+            page = list(reversed(rows[:per_page]))
+            self.has_prev = len(rows) > per_page
+            self.has_next = True
+
+        self.items = [row[0] for row in page]
+        self.next_cursor = encode_cursor('next', page[-1][1:]) if self.has_next and page else None
+        self.prev_cursor = encode_cursor('prev', page[0][1:]) if self.has_prev and page else None
+
+    def _fetch(self, query, direction, position, limit):
+        key = tuple_(*self._columns)
+        # Вперёд по убыванию (или назад по возрастанию) - записи "меньше" курсора
+        before = (direction == 'next') == self._descending
+        query = query.order_by(None).add_columns(*self._columns)
+        if position is not None:
+            query = query.where(key < tuple_(*position) if before else key > tuple_(*position))
+        order = [column.desc() if before else column.asc() for column in self._columns]
+        return db.session.execute(query.order_by(*order).limit(limit)).all()
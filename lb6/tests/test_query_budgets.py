@@ -0,0 +1,84 @@
+# Бюджеты SQL-запросов (QUERY_BUDGETS в config.py) на заполненной временной БД:
+# каждая страница с бюджетом запрашивается через request_timing.assert_query_budget,
+# который падает и при превышении бюджета, и при повторяющихся запросах (N+1).
+# Запуск из каталога lb6: python -m pytest tests
+
+import os
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+COURSES = 30  # Больше порога N+1 и страницы каталога
+PASSWORD = 'qwerty'
+
+# Страница для каждого endpoint из QUERY_BUDGETS; {course_id} - курс с отзывами
+PAGES = {
+    'index': '/',
+    'courses.index': '/courses/',
+    'courses.show': '/courses/{course_id}',
+    'courses.reviews': '/courses/{course_id}/reviews',
+    'courses.new': '/courses/new',
+}
+
+
+@pytest.fixture(scope='module')
+def app(tmp_path_factory):
+    os.environ['DATABASE_URL'] = 'sqlite:///%s' % (tmp_path_factory.mktemp('db') / 'project.db')
+    from app import app
+    from course_search import ensure_course_search
+    from models import db, Category, Course, Image, Review, User
+
+    app.config.update(TESTING=True, SQLALCHEMY_ECHO=False)
+    with app.app_context():
+        db.create_all()
+        ensure_course_search()
+        root = Category(name='Программирование')
+        db.session.add(root)
+        db.session.flush()
+        child = Category(name='Python', parent_id=root.id)
+        users = [User(first_name='Имя', last_name='Фамилия%d' % i, login='user%d' % i) for i in range(COURSES)]
+        users[0].set_password(PASSWORD)
+        for user in users[1:]:
+            user.password_hash = users[0].password_hash
+        db.session.add_all([child] + users)
+        image = Image(id='bg', file_name='bg.png', mime_type='image/png', md5_hash='0' * 32)
+        db.session.add(image)
+        db.session.flush()
+        started = datetime(2025, 1, 1)
+        courses = [Course(name='Курс %d' % i, short_desc='Кратко', full_desc='Подробно',
+                          category_id=(root, child)[i % 2].id, author_id=users[i].id,
+                          background_image_id=image.id, created_at=started + timedelta(minutes=i))
+                   for i in range(COURSES)]
+        db.session.add_all(courses)
+        db.session.flush()
+        course = courses[-1]
+        db.session.add_all(Review(rating=i % 6, text='Отзыв', course_id=course.id, user_id=user.id,
+                                  created_at=started + timedelta(minutes=i))
+                           for i, user in enumerate(users))
+        course.rating_sum, course.rating_num = sum(i % 6 for i in range(COURSES)), COURSES
+        db.session.commit()
+        app.config['TEST_COURSE_ID'] = course.id
+    yield app
+
+
+@pytest.fixture
+def client(app):
+    client = app.test_client()
+    client.post('/auth/login', data={'login': 'user0', 'password': PASSWORD})
+    return client
+
+
+def test_every_budget_has_a_page(app):
+    assert set(app.config['QUERY_BUDGETS']) == set(PAGES)
+
+
+@pytest.mark.parametrize('endpoint', sorted(PAGES))
+def test_query_budget(app, client, endpoint):
+    from web_common.request_timing import assert_query_budget
+
+    path = PAGES[endpoint].format(course_id=app.config['TEST_COURSE_ID'])
+    response = assert_query_budget(client, path)
+    assert response.status_code == 200
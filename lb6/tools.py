@@ -3,33 +3,64 @@ import hashlib  # Для хеширования файлов
 import uuid  # Для генерации уникальных ID
 import os  # Для работы с файловой системой
 from werkzeug.utils import secure_filename  # Для безопасного сохранения файлов
+from sqlalchemy.orm import joinedload  # Жадная загрузка связей
 from flask import current_app  # Для доступа к конфигурации Flask
 from models import db, Course, Image  # Модели базы данных
+from course_search import match_expression, matching_ids, ranked_matches  # Полнотекстовый поиск курсов
+from category_tree import category_cache, descendant_ids_query  # Дерево категорий
+from image_cache import image_cache  # Метаданные изображений для раздачи
 
 # Класс для фильтрации курсов
 class CoursesFilter:
-    def __init__(self, name, category_ids):
-        self.name = name  # Название курса для поиска
+    def __init__(self, name, category_ids, order=None, subcategories=False):
+        self.name = name  # Строка поиска (название и описания курса)
         self.category_ids = category_ids  # ID категорий для фильтрации
-        self.query = db.select(Course)  # Базовый SQL-запрос
+        self.subcategories = subcategories  # Включать курсы всех подкатегорий выбранных категорий
+        self.order = order  # 'relevance' - по релевантности (при поиске), иначе новые первыми
+        # Базовый SQL-запрос; автор нужен в каждой строке каталога - загружается тем же запросом
+        self.query = db.select(Course).options(joinedload(Course.author))
+        self.ranked = None  # Подзапрос рангов полнотекстового поиска
 
     def perform(self):
-        # Применяем все фильтры и сортируем по дате создания
+        # Применяем все фильтры и сортируем по релевантности или дате создания
         self.__filter_by_name()
         self.__filter_by_category_ids()
-        return self.query.order_by(Course.created_at.desc())
+        columns, descending = self.sort_key()
+        return self.query.order_by(*[c.desc() if descending else c.asc() for c in columns])
+
+    def sort_key(self):
+        # Колонки и направление сортировки для курсорной пагинации (после perform)
+        if self.ranked is not None:
+            return (self.ranked.c.rank, Course.id), False  # Меньший rank - релевантнее
+        return (Course.created_at, Course.id), True  # Новые первыми
 
     def __filter_by_name(self):
-        # Фильтрация по имени (регистронезависимый поиск)
-        if self.name:
-            self.query = self.query.filter(
-                Course.name.ilike('%' + self.name + '%'))
+        # Полнотекстовый поиск по названию и описаниям (индекс courses_fts, префиксы слов)
+        match = match_expression(self.name)
+        if not match:
+            return
+        if self.order == 'relevance':
+            self.ranked = ranked_matches(match)
+            self.query = self.query.join(self.ranked, self.ranked.c.id == Course.id)
+        else:
+            self.query = self.query.filter(Course.id.in_(matching_ids(match)))
 
     def __filter_by_category_ids(self):
         # Фильтрация по ID категорий
-        if self.category_ids:
-            self.query = self.query.filter(
-                Course.category_id.in_(self.category_ids))
+        if not self.category_ids:
+            return
+        category_ids = {int(x) for x in self.category_ids if str(x).isdigit()}
+        if self.subcategories:
+            # Потомки - из загруженного дерева категорий, иначе рекурсивным CTE в том же запросе
+            tree = category_cache.peek()
+            if tree is not None:
+                category_ids = tree.descendant_ids(category_ids)
+            elif category_ids:
+                self.query = self.query.filter(
+                    Course.category_id.in_(descendant_ids_query(category_ids)))
+                return
+        self.query = self.query.filter(
+            Course.category_id.in_(category_ids))
 
 # Класс для сохранения изображений
 class ImageSaver:
@@ -57,6 +88,8 @@ class ImageSaver:
         # Сохраняем данные в БД
         db.session.add(self.img)
         db.session.commit()
+        # Первый запрос изображения обойдётся без обращения к БД
+        image_cache.add(self.img)
         return self.img
 
     def __find_by_md5_hash(self):